@@ -0,0 +1,88 @@
+"""
+Dec page parser throughput over growing synthetic documents.
+
+    python benchmarks/bench_dec_parser.py [--max-kb 1024]
+
+Two document shapes per size: a realistic dec page padded with policy boilerplate,
+and an adversarial one (many "Term"/"Address" anchors that never complete a match,
+the case that used to pin a CPU). Throughput (MB/s) should stay flat as size grows;
+the legacy Term/Address patterns are timed alongside for comparison.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from coverlyze.services.dec_parser import extract_dec_page_data  # noqa: E402
+
+LEGACY = [
+    re.compile(r"Term:?.*?(\d{1,2}[/-]\d{1,2}[/-]\d{2,4}).*?[-–—].*?(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})", re.I | re.S),
+    re.compile(r"Address:?[\s\n]*(\d+.*?(?:[A-Z]{2}|Mass|MA)\s*\d{5})", re.I | re.S),
+]
+
+HEADER = """ACME Mutual Insurance Company
+Policy #: PA-1234567
+Policy Term: 01/15/2024 - 01/15/2025
+Named Insured: John Q Public
+Email: john.public@example.com
+Address: 12 Main Street Springfield, MA 01101
+Full Term Premium: $2,412.00
+"""
+VEHICLE = """Veh #{n} 2019 HONDA Accord EX:
+VIN 1HGCM82633A{n:06d}
+Bodily Injury 100,300  Collision 500  Comprehensive 250
+Rental $30/day for 30 days  Towing Yes  Uninsured 100/300
+Vehicle Premium: $812.00
+"""
+FILLER = "This policy provides coverage only for the terms stated herein, subject to all conditions.\n"
+
+
+def realistic(target: int) -> str:
+    parts, n = [HEADER], 0
+    while sum(map(len, parts)) < target:
+        n += 1
+        parts.append(VEHICLE.format(n=n) if n <= 6 else FILLER)
+    parts.append("Drivers\nDriver 1 John Q Public 03/04/1970\nDriver 2 Jane Public 05/06/1972\n")
+    return "".join(parts)
+
+
+def adversarial(target: int) -> str:
+    unit = "Term 01/02/2024 Address: 12 Elm st no zip here "
+    return unit * (target // len(unit) + 1)
+
+
+def bench(fn, text: str, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(text)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--max-kb", type=int, default=1024)
+    ap.add_argument("--legacy-max-kb", type=int, default=16, help="legacy patterns are quadratic; 16KB adversarial already takes ~1 min")
+    args = ap.parse_args()
+
+    print(f"{'size':>8} {'shape':>12} {'parse s':>9} {'MB/s':>8} {'legacy s':>9}")
+    kb = 16
+    while kb <= args.max_kb:
+        for shape, make in (("realistic", realistic), ("adversarial", adversarial)):
+            text = make(kb * 1024)
+            t = bench(lambda s: extract_dec_page_data(s, time_budget_s=60), text)
+            legacy = "-"
+            if kb <= args.legacy_max_kb:
+                legacy = f"{bench(lambda s: [rx.search(s) for rx in LEGACY], text, repeat=1):9.3f}"
+            print(f"{kb:>6}KB {shape:>12} {t:9.4f} {len(text) / t / 1e6:8.1f} {legacy:>9}")
+        kb *= 4
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+embed_many throughput against the local fake embeddings server (no OpenAI needed).
+
+    python benchmarks/bench_embeddings.py [--texts 5000 --latency 0.2 --fail-every 9]
+
+Runs the same corpus at concurrency 1 and N, checks that output order matches the
+input and that failed batches were retried, and prints texts/s and tokens/s.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--texts", type=int, default=5000)
+    ap.add_argument("--batch-size", type=int, default=256)
+    ap.add_argument("--max-batch-tokens", type=int, default=20_000)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--latency", type=float, default=0.2)
+    ap.add_argument("--fail-every", type=int, default=9)
+    args = ap.parse_args()
+
+    from openai import OpenAI
+    from coverlyze.services.embeddings import embed_many, normalize_text
+    from coverlyze.services.embeddings_fake import FakeEmbeddingsServer, fake_vector
+
+    server = FakeEmbeddingsServer(dim=32, latency_s=args.latency, per_item_s=0.0002,
+                                  fail_every=args.fail_every).start()
+    client = OpenAI(base_url=server.base_url, api_key="fake", max_retries=0)
+    texts = [f"MA auto guideline chunk {i}: " + "bodily injury liability limits " * (1 + i % 40)
+             for i in range(args.texts)]
+    try:
+        for conc in (1, args.concurrency):
+            server.requests = server.max_concurrent = 0
+            stats: dict = {}
+            n = 0
+            for i, vec in enumerate(embed_many(iter(texts), batch_size=args.batch_size,
+                                               max_batch_tokens=args.max_batch_tokens, concurrency=conc,
+                                               backoff_s=0.05, client=client, stats=stats)):
+                assert vec == fake_vector(normalize_text(texts[i]), 32), f"order broken at {i}"
+                n += 1
+            assert n == len(texts)
+            print(f"concurrency {conc}: {stats['texts']} texts in {stats['batches']} batches, "
+                  f"{stats['seconds']:.2f}s | {stats['texts_per_s']:.0f} texts/s, "
+                  f"{stats['tokens_per_s']:.0f} tokens/s | requests {server.requests} "
+                  f"(incl. retries), max in flight {server.max_concurrent}, max batch {server.max_batch}")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
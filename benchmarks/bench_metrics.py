@@ -0,0 +1,104 @@
+"""
+Metrics overhead: cost per recording call (counter, labelled counter, histogram,
+stage() context manager) from 1 and 8 threads, and the cost of publishing and
+rendering a realistic state. Pure in-process; Redis is only used with --redis-url.
+
+    python benchmarks/bench_metrics.py [--ops 200000 --redis-url redis://localhost:6379/15]
+
+A /chat turn records ~60 values, so multiply the per-call cost by 60 to compare with
+the turn's latency.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from coverlyze.utils import metrics  # noqa: E402
+
+CALLS = {
+    "inc()": lambda: metrics.inc("bench_total"),
+    "inc(3 labels)": lambda: metrics.inc("bench_total", route="chat", model="gpt-4o", result="ok"),
+    "observe()": lambda: metrics.observe("bench_seconds", 0.042),
+    "observe(2 labels)": lambda: metrics.observe("bench_seconds", 0.042, route="chat", model="gpt-4o"),
+}
+
+
+def _stage():
+    with metrics.stage("bench"):
+        pass
+
+
+CALLS["stage()"] = _stage
+
+
+def per_call_ns(fn, ops: int, threads: int) -> float:
+    per_thread = ops // threads
+
+    def work():
+        for _ in range(per_thread):
+            fn()
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    t0 = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return (time.perf_counter() - t0) / (per_thread * threads) * 1e9
+
+
+def realistic_state(series: int = 150):
+    """Roughly what a busy worker holds: counters and histograms across routes/stages/tiers."""
+    for i in range(series):
+        metrics.inc("bench_requests_total", 100, route=f"r{i % 10}", result=f"x{i}")
+        metrics.observe("bench_stage_seconds", 0.01 * (i % 50), stage=f"s{i}")
+        metrics.gauge("bench_inflight", i % 7, pool=f"p{i % 5}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--ops", type=int, default=200_000)
+    ap.add_argument("--redis-url", default=None)
+    args = ap.parse_args()
+
+    for name, fn in CALLS.items():
+        one = per_call_ns(fn, args.ops, 1)
+        eight = per_call_ns(fn, args.ops, 8)
+        print(f"{name:18s}: {one:6.0f} ns/call (1 thread) | {eight:6.0f} ns/call (8 threads)")
+
+    realistic_state()
+    n = 200
+    t0 = time.perf_counter()
+    for _ in range(n):
+        state = metrics.export_state()
+    export_ms = (time.perf_counter() - t0) / n * 1000
+    merged = metrics.merge_states([state] * 4)
+    t0 = time.perf_counter()
+    for _ in range(n):
+        text = metrics.render_prometheus(merged)
+    render_ms = (time.perf_counter() - t0) / n * 1000
+    print(f"export_state: {export_ms:.2f} ms | render 4 processes: {render_ms:.2f} ms "
+          f"({len(text.splitlines())} lines)")
+
+    if args.redis_url:
+        import redis
+        r = redis.from_url(args.redis_url)
+        t0 = time.perf_counter()
+        for _ in range(n):
+            metrics.publish(r, namespace="benchmetrics")
+        publish_ms = (time.perf_counter() - t0) / n * 1000
+        t0 = time.perf_counter()
+        for _ in range(20):
+            metrics.collect(r, namespace="benchmetrics")
+        collect_ms = (time.perf_counter() - t0) / 20 * 1000
+        print(f"publish (every METRICS_PUSH_S, off the request path): {publish_ms:.2f} ms | "
+              f"collect (per scrape): {collect_ms:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
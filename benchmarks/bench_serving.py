@@ -0,0 +1,130 @@
+"""
+Serving benchmark: sync (threaded) vs async (gevent) gunicorn workers under many
+concurrent /chat requests. The LLM and embeddings come from the local fake OpenAI
+server, retrieval from a local snapshot (RAG_BACKEND=local); Redis is required for sessions.
+
+    python benchmarks/bench_serving.py [--redis-url redis://localhost:6379/15 --concurrency 200 --requests 400]
+
+Both modes run 2 workers; sync mode has 2 threads each. Reports throughput, p50/p99
+latency and the peak number of LLM calls in flight.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def build_snapshot(openai_base_url: str) -> str:
+    """Ingest the synthetic eval corpus into in-memory Qdrant and export it for RAG_BACKEND=local."""
+    from openai import OpenAI
+    from qdrant_client import QdrantClient
+    from coverlyze.services.ingest import ingest_directory
+    from coverlyze.services.local_index import export_snapshot
+    from eval_retrieval import synthetic_corpus
+
+    docs, out = tempfile.mkdtemp(prefix="bench-docs-"), tempfile.mkdtemp(prefix="bench-index-")
+    synthetic_corpus(docs)
+    qc = QdrantClient(":memory:")
+    ingest_directory(docs, qc=qc, collection="bench", upsert_concurrency=1,
+                     openai_client=OpenAI(base_url=openai_base_url, api_key="fake", max_retries=0))
+    export_snapshot(qc, "bench", out)
+    return out
+
+
+def start_server(mode: str, port: int, env: dict) -> subprocess.Popen:
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}", "wsgi:app"],
+        cwd=ROOT, env={**os.environ, **env, "SERVING_MODE": mode},
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    import httpx
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/healthz", timeout=1).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{mode} server did not become healthy")
+
+
+async def load(url: str, concurrency: int, total: int) -> tuple[list[float], int, float]:
+    import httpx
+    latencies, errors = [], 0
+    sem = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=600, limits=limits) as client:
+        async def one(i: int):
+            nonlocal errors
+            async with sem:
+                t0 = time.perf_counter()
+                try:
+                    r = await client.post(url, json={"message": f"What are the MA minimum limits? ({i % 20})"})
+                    ok = r.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append(time.perf_counter() - t0)
+                errors += not ok
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        return latencies, errors, time.perf_counter() - t0
+
+
+def pct(sorted_vals: list[float], q: float) -> float:
+    return sorted_vals[min(len(sorted_vals) - 1, int(q * len(sorted_vals)))]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--redis-url", default="redis://localhost:6379/15")
+    ap.add_argument("--concurrency", type=int, default=200)
+    ap.add_argument("--requests", type=int, default=400)
+    ap.add_argument("--llm-latency", type=float, default=1.0)
+    ap.add_argument("--modes", default="sync,async")
+    args = ap.parse_args()
+
+    from coverlyze.services.embeddings_fake import FakeEmbeddingsServer
+    fake = FakeEmbeddingsServer(dim=64, latency_s=0.02, chat_latency_s=args.llm_latency).start()
+    try:
+        env = {"OPENAI_BASE_URL": fake.base_url, "OPENAI_API_KEY": "fake", "REDIS_URL": args.redis_url,
+               "RAG_BACKEND": "local", "RAG_LOCAL_INDEX_DIR": build_snapshot(fake.base_url),
+               "VISION_BACKEND": "fake", "FLASK_SECRET_KEY": "bench", "WEB_WORKERS": "2", "WEB_THREADS": "2"}
+        for mode in args.modes.split(","):
+            port = free_port()
+            proc = start_server(mode, port, env)
+            try:
+                fake.max_concurrent = 0
+                lat, errors, wall = asyncio.run(load(f"http://127.0.0.1:{port}/chat", args.concurrency, args.requests))
+                lat.sort()
+                print(f"{mode:5s}: {args.requests} requests at concurrency {args.concurrency} in {wall:.1f}s "
+                      f"({args.requests / wall:.1f} req/s) | p50 {pct(lat, 0.5):.2f}s p99 {pct(lat, 0.99):.2f}s | "
+                      f"errors {errors} | peak LLM calls in flight {fake.max_concurrent}")
+            finally:
+                proc.terminate()
+                proc.wait(timeout=30)
+    finally:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
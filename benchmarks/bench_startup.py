@@ -0,0 +1,127 @@
+"""
+Startup benchmark: import time, create_app time and time-to-first-request, and which
+heavy client stacks a web process has loaded. Then gunicorn with and without
+preload_app (WEB_PRELOAD): launch to first healthy response, and the first /chat.
+The LLM and embeddings come from the local fake OpenAI server, retrieval from a local
+snapshot (RAG_BACKEND=local); Redis is required for sessions.
+
+    python benchmarks/bench_startup.py [--redis-url redis://localhost:6379/15 --runs 5]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+
+STACKS = {"vision": "google.cloud.vision_v1", "storage": "google.cloud.storage", "grpc": "grpc",
+          "qdrant": "qdrant_client", "openai": "openai"}
+
+
+def probe():
+    """Runs in a fresh interpreter: time import, create_app and the first two /chat requests."""
+    t0 = time.perf_counter()
+    from coverlyze import create_app
+    t_import = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    app = create_app()
+    t_create = time.perf_counter() - t0
+    loaded_at_start = [name for name, mod in STACKS.items() if mod in sys.modules]
+
+    client = app.test_client()
+    client.get("/")
+    chat_s = []
+    for _ in range(2):
+        t0 = time.perf_counter()
+        r = client.post("/chat", json={"message": "What are the MA minimum limits?"})
+        chat_s.append(time.perf_counter() - t0)
+        assert r.status_code == 200, r.data
+    print(json.dumps({"import_s": t_import, "create_app_s": t_create, "first_chat_s": chat_s[0],
+                      "second_chat_s": chat_s[1], "loaded_at_start": loaded_at_start,
+                      "loaded_after_chat": [name for name, mod in STACKS.items() if mod in sys.modules]}))
+
+
+def run_probes(env: dict, runs: int) -> list[dict]:
+    out = []
+    for _ in range(runs):
+        res = subprocess.run([sys.executable, os.path.abspath(__file__), "--probe"], cwd=ROOT,
+                             env={**os.environ, **env}, capture_output=True, text=True, check=True)
+        out.append(json.loads(res.stdout.strip().splitlines()[-1]))
+    return out
+
+
+def gunicorn_first_request(preload: bool, env: dict) -> tuple[float, float]:
+    """Seconds from launch to first healthy /healthz, and the first /chat after that."""
+    import httpx
+    from bench_serving import free_port
+    port = free_port()
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}", "wsgi:app"],
+        cwd=ROOT, env={**os.environ, **env, "WEB_PRELOAD": "1" if preload else "0"},
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if time.perf_counter() - t0 > 60:
+                raise RuntimeError("server did not become healthy")
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/healthz", timeout=1).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                time.sleep(0.02)
+        healthy = time.perf_counter() - t0
+        t1 = time.perf_counter()
+        r = httpx.post(f"http://127.0.0.1:{port}/chat", json={"message": "What are the MA minimum limits?"}, timeout=60)
+        r.raise_for_status()
+        return healthy, time.perf_counter() - t1
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--redis-url", default="redis://localhost:6379/15")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--probe", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.probe:
+        return probe()
+
+    from bench_serving import build_snapshot
+    from coverlyze.services.embeddings_fake import FakeEmbeddingsServer
+    fake = FakeEmbeddingsServer(dim=64, latency_s=0.0, chat_latency_s=0.0).start()
+    try:
+        env = {"OPENAI_BASE_URL": fake.base_url, "OPENAI_API_KEY": "fake", "REDIS_URL": args.redis_url,
+               "RAG_BACKEND": "local", "RAG_LOCAL_INDEX_DIR": build_snapshot(fake.base_url),
+               "RAG_PREFETCH": "0", "FLASK_SECRET_KEY": "bench", "WEB_WORKERS": "2", "WEB_THREADS": "2"}
+
+        probes = run_probes(env, args.runs)
+        med = {k: statistics.median(p[k] for p in probes)
+               for k in ("import_s", "create_app_s", "first_chat_s", "second_chat_s")}
+        print(f"process ({args.runs} runs, median): import {med['import_s'] * 1000:.0f}ms | "
+              f"create_app {med['create_app_s'] * 1000:.0f}ms | first /chat {med['first_chat_s'] * 1000:.0f}ms | "
+              f"second /chat {med['second_chat_s'] * 1000:.0f}ms")
+        print(f"  loaded at start: {probes[0]['loaded_at_start'] or 'none'} | "
+              f"after /chat: {probes[0]['loaded_after_chat'] or 'none'}")
+
+        for preload in (False, True):
+            runs = [gunicorn_first_request(preload, env) for _ in range(max(1, args.runs // 2))]
+            healthy = statistics.median(r[0] for r in runs)
+            first = statistics.median(r[1] for r in runs)
+            print(f"gunicorn preload={'on ' if preload else 'off'}: launch -> healthy {healthy * 1000:.0f}ms | "
+                  f"first /chat {first * 1000:.0f}ms")
+    finally:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
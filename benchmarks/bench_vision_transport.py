@@ -0,0 +1,87 @@
+"""
+Vision OCR transport benchmark against the offline fakes (no GCP needed).
+
+    python benchmarks/bench_vision_transport.py [--pages 4 --big-pages 400]
+
+Compares, for a short scan, the in-memory batch_annotate_files path with the GCS
+async pipeline, and for a long scan, shard download concurrency 1 vs N. Cleanup
+time is reported separately because it now runs on a background thread.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+os.environ["VISION_BACKEND"] = "fake"
+
+
+def make_pdf(n_pages: int) -> bytes:
+    """Blank pages are enough: the fake Vision client only needs the page count."""
+    from pdfminer.pdfpage import PDFPage  # noqa: F401  (ensures pdfminer is importable)
+    objs = ["<< /Type /Catalog /Pages 2 0 R >>", None]
+    kids = []
+    for i in range(n_pages):
+        kids.append(f"{3 + i} 0 R")
+        objs.append("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>")
+    objs[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {n_pages} >>"
+    out, offsets = BytesIO(), []
+    out.write(b"%PDF-1.4\n")
+    for i, body in enumerate(objs, start=1):
+        offsets.append(out.tell())
+        out.write(f"{i} 0 obj\n{body}\nendobj\n".encode())
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n".encode())
+    for off in offsets:
+        out.write(f"{off:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objs) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+def timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - t0, result
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pages", type=int, default=4)
+    ap.add_argument("--big-pages", type=int, default=400)
+    ap.add_argument("--concurrency", type=int, default=8)
+    args = ap.parse_args()
+
+    from coverlyze import create_app
+    from coverlyze.services import ocr
+    from coverlyze.services.vision_fake import fake_google_clients
+
+    app = create_app()
+    # Latencies roughly shaped like production: result shards are a few MB each.
+    vision, storage = fake_google_clients(vision_opts={"request_latency_s": 0.3, "per_page_s": 0.005},
+                                          storage_opts={"download_latency_s": 0.25, "delete_latency_s": 0.05})
+    app.config.update(GCS_INPUT_BUCKET="in", GCS_OUTPUT_BUCKET="out", VISION_CLIENT=vision, STORAGE_CLIENT=storage)
+    with app.app_context():
+
+        small = make_pdf(args.pages)
+        pages = list(range(1, args.pages + 1))
+        t_inline, _ = timed(ocr._vision_inline_pages, small, pages, 60)
+        t_gcs, _ = timed(ocr._vision_async_pages, small, 60, True)
+        print(f"short scan ({args.pages} pages): inline {t_inline:.2f}s | GCS async {t_gcs:.2f}s")
+
+        big = make_pdf(args.big_pages)
+        for conc in (1, args.concurrency):
+            app.config["VISION_IO_CONCURRENCY"] = conc
+            ocr._io_executor = None
+            t, by_page = timed(ocr._vision_async_pages, big, 600, True)
+            t_clean, _ = timed(lambda: ocr._deleter.submit(lambda: None).result())
+            print(f"long scan ({args.big_pages} pages, {len(by_page)} returned): "
+                  f"download concurrency {conc}: {t:.2f}s on request path, cleanup drained +{t_clean:.2f}s, "
+                  f"objects left {storage.object_count()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Offline retrieval evaluation: recall@k and latency, dense-only vs hybrid (dense + bm25).
+
+    python benchmarks/eval_retrieval.py --queries eval.jsonl [-k 5]     # app's Qdrant/OpenAI config
+    python benchmarks/eval_retrieval.py --synthetic                     # in-memory Qdrant + fake embeddings
+
+Each line of the queries file is a JSON object:
+    {"query": "...", "state": "MA", "line": "auto", "coverages_any": ["pip"], "section": null,
+     "relevant": ["MA/auto_manual.txt#12", ...]}      # or
+    {"query": "...", "state": "MA", "relevant_terms": ["part 4", "property damage"]}
+With "relevant", recall is the share of listed chunks retrieved; with "relevant_terms"
+a query scores 1 if any retrieved chunk contains one of the terms.
+
+--synthetic exercises the whole path offline. Its dense branch uses hash-seeded fake
+vectors, so only the sparse/fusion side is meaningful there; compare real numbers
+against the production collection.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+
+# coverage: (section title, body, query, term that marks the relevant chunk)
+COVERAGE_TEXT = {
+    "bodily_injury": ("Part 1 bodily injury", "Compulsory bodily injury to others is {a}/{b} per person/accident.",
+                      "bodily injury minimum", "compulsory bodily injury"),
+    "property_damage": ("Part 4 property damage", "Damage to someone else's property requires {c} in PD liability.",
+                        "Part 4 limit", "pd liability"),
+    "pip": ("Part 2 personal injury protection", "PIP pays up to {c} for medical expenses regardless of fault.",
+            "PIP", "pip pays"),
+    "um": ("Part 3 uninsured motorist", "UM coverage must match the compulsory limits of {a}/{b}.",
+           "is UM required", "um coverage must"),
+    "medpay": ("Part 6 medical payments", "Med pay is optional and written in increments of {d}.",
+               "med pay increments", "med pay is optional"),
+}
+DISTRACTORS = ("Surcharge", "Driver training credit", "Garaging address", "Cancellation notice",
+               "Premium financing", "Antique vehicles", "Towing and labor", "Rental reimbursement")
+FILLER = ("The insurer shall file forms and rates with the Division. Agents should review the policy "
+          "declarations with the insured at each renewal and document any changes. ")
+
+
+def synthetic_corpus(root: str, states=("MA", "NH", "CT")) -> list[dict]:
+    queries = []
+    for n, st in enumerate(states):
+        os.makedirs(os.path.join(root, st), exist_ok=True)
+        a, b, c, d = 20 + 5 * n, 40 + 10 * n, 5000 * (n + 1), 500 * (n + 1)
+        with open(os.path.join(root, st, "auto_manual.txt"), "w") as f:
+            for cov, (title, body, query, term) in COVERAGE_TEXT.items():
+                f.write(f"{title}\n\n{FILLER * 3}{body.format(a=a, b=b, c=f'${c:,}', d=f'${d:,}')} {FILLER * 3}\n\n")
+                for topic in DISTRACTORS:
+                    f.write(f"{topic}\n\n{topic} rules for {st} auto policies. {FILLER * 4}\n\n")
+                queries.append({"query": query, "state": st, "relevant_terms": [term]})
+    return queries
+
+
+def recall(chunks: list[dict], q: dict) -> float:
+    if q.get("relevant"):
+        got = {f"{c['metadata']['source']}#{c['metadata']['chunk_index']}" for c in chunks}
+        return len(got & set(q["relevant"])) / len(q["relevant"])
+    terms = [t.lower() for t in q.get("relevant_terms") or []]
+    return float(any(t in (c["text"] or "").lower() for c in chunks for t in terms))
+
+
+def evaluate(queries: list[dict], k: int, modes=("dense", "hybrid")) -> dict:
+    from coverlyze.services.embeddings import embed_texts
+    from coverlyze.services.rag import search
+
+    out = {}
+    for mode in modes:
+        recalls, latencies = [], []
+        for q in queries:
+            vec = embed_texts([q["query"]])[0]  # embedding cost excluded: both modes share it
+            t0 = time.perf_counter()
+            chunks = search(q["query"], state=q.get("state"), top_k=k, line=q.get("line"), topic=None,
+                            coverages_any=q.get("coverages_any"), section=q.get("section"),
+                            allow_fallbacks=False, strict_state=bool(q.get("state")), query_vector=vec, mode=mode)
+            latencies.append(time.perf_counter() - t0)
+            recalls.append(recall(chunks, q))
+        latencies.sort()
+        out[mode] = {
+            f"recall@{k}": round(statistics.mean(recalls), 3) if recalls else None,
+            "p50_ms": round(1000 * latencies[len(latencies) // 2], 1) if latencies else None,
+            "p95_ms": round(1000 * latencies[int(len(latencies) * 0.95) - 1 if len(latencies) > 1 else 0], 1)
+            if latencies else None,
+        }
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--queries")
+    ap.add_argument("-k", type=int, default=5)
+    ap.add_argument("--synthetic", action="store_true")
+    args = ap.parse_args()
+    if not args.queries and not args.synthetic:
+        ap.error("pass --queries FILE or --synthetic")
+
+    from coverlyze import create_app
+    app = create_app()
+    server = None
+    with app.app_context():
+        if args.synthetic:
+            from openai import OpenAI
+            from qdrant_client import QdrantClient
+            from coverlyze.services.embeddings_fake import FakeEmbeddingsServer
+            from coverlyze.services.ingest import ingest_directory
+
+            server = FakeEmbeddingsServer(dim=64, latency_s=0.0).start()
+            app.config.update(OPENAI_CLIENT=OpenAI(base_url=server.base_url, api_key="fake", max_retries=0),
+                              QDRANT_CLIENT=QdrantClient(":memory:"), QDRANT_COLLECTION="eval_guidelines")
+            root = tempfile.mkdtemp(prefix="eval-guidelines-")
+            queries = synthetic_corpus(root)
+            ingest_directory(root, qc=app.config["QDRANT_CLIENT"], collection="eval_guidelines",
+                             openai_client=app.config["OPENAI_CLIENT"], upsert_concurrency=1)
+        else:
+            with open(args.queries) as f:
+                queries = [json.loads(line) for line in f if line.strip()]
+        try:
+            results = evaluate(queries, args.k)
+        finally:
+            if server:
+                server.stop()
+    print(f"{len(queries)} queries, k={args.k}")
+    for mode, r in results.items():
+        print(f"  {mode:7s} " + "  ".join(f"{name} {val}" for name, val in r.items()))
+
+
+if __name__ == "__main__":
+    main()
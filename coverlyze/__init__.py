@@ -7,10 +7,15 @@ import os
 from flask import Flask
 from flask_session import Session
 
+from .cli import register_cli
 from .config import Config
 from .extensions import init_extensions, redis_client
 from .routes.main import bp as main_bp
 from .routes.chat import bp as chat_bp
+from .routes.jobs import bp as jobs_bp
+from .routes.metrics import bp as metrics_bp
+from .utils.profiling import init_profiling
+from .utils.sessions import init_sessions
 
 logger = logging.getLogger(__name__)
 
@@ -34,13 +39,18 @@ def create_app() -> Flask:
         SESSION_COOKIE_SECURE=False if os.getenv("FLASK_DEBUG") else True,
     )
     Session(app)
+    init_sessions(app)  # documents by digest, compressed blobs, no rewrite when unchanged
 
     # Init other singletons
     init_extensions(app)
+    init_profiling(app)  # slow-request log; X-Profile / armed paths get profiled
 
     # Blueprints
     app.register_blueprint(main_bp)
     app.register_blueprint(chat_bp)
+    app.register_blueprint(jobs_bp)
+    app.register_blueprint(metrics_bp)
+    register_cli(app)
 
     # Basic health check
     @app.get("/healthz")
@@ -0,0 +1,133 @@
+"""
+Maintenance commands, run with the app's environment:
+
+    flask --app wsgi warm-embeddings queries.txt --state MA --state NH
+    flask --app wsgi ingest-guidelines ./guidelines [--prune] [--qdrant-path ./qdrant-local]
+    flask --app wsgi export-index [--out var/rag_index]
+    flask --app wsgi warm-phrasings [--variants 6] [--force]
+    flask --app wsgi profile-token [--mode sample|cprofile] [--ttl 600]
+    flask --app wsgi profile-arm /upload [--count 1] [--ttl 3600]
+"""
+from __future__ import annotations
+
+import click
+from flask import Flask
+from flask.cli import with_appcontext
+
+
+@click.command("warm-embeddings")
+@click.argument("queries_file", type=click.File("r"), required=False)
+@click.option("--state", "states", multiple=True, help="Also warm '<STATE> <query>' as rag_retrieve builds it.")
+@click.option("--seeds/--no-seeds", default=True, help="Include the per-topic RAG seed queries.")
+@with_appcontext
+def warm_embeddings_command(queries_file, states, seeds):
+    """Pre-embed frequent queries (one per line) into the embedding cache."""
+    from .services.embeddings import warm_embedding_cache
+    from .services.rag import SEED_QUERIES, rag_query_text
+
+    base = [line.strip() for line in queries_file or [] if line.strip() and not line.startswith("#")]
+    if seeds:
+        topics = list(SEED_QUERIES)
+        base += [rag_query_text(None, t) for t in topics]
+    queries = list(base)
+    for st in states:
+        queries += [rag_query_text(st, None, q) for q in base]
+    stats = warm_embedding_cache(queries)
+    click.echo(f"{stats['queries']} queries: {stats['embedded']} embedded, {stats['already_cached']} already cached")
+
+
+@click.command("ingest-guidelines")
+@click.argument("root", type=click.Path(exists=True, file_okay=False))
+@click.option("--state", "default_state", help="State for files whose path doesn't name one.")
+@click.option("--collection", help="Qdrant collection (default QDRANT_COLLECTION).")
+@click.option("--force", is_flag=True, help="Re-embed every file, not just changed ones.")
+@click.option("--prune", is_flag=True, help="Delete documents no longer under ROOT.")
+@click.option("--qdrant-path", type=click.Path(file_okay=False), help="Use local (on-disk) Qdrant at this path.")
+@with_appcontext
+def ingest_guidelines_command(root, default_state, collection, force, prune, qdrant_path):
+    """Chunk, tag, embed and upsert state guideline documents into Qdrant."""
+    from flask import current_app
+    from .services.ingest import ingest_directory
+
+    cfg = current_app.config
+    if qdrant_path:
+        from qdrant_client import QdrantClient
+        qc = QdrantClient(path=qdrant_path)
+    else:
+        qc = cfg["QDRANT_CLIENT"]
+    stats = ingest_directory(root, qc=qc, collection=collection or cfg.get("QDRANT_COLLECTION", "state_guidelines"),
+                             default_state=default_state, force=force, prune=prune,
+                             upsert_batch=cfg.get("QDRANT_UPSERT_BATCH", 128),
+                             upsert_concurrency=cfg.get("QDRANT_UPSERT_CONCURRENCY", 4))
+    emb = stats["embed"]
+    click.echo(f"{stats['files']} files: {stats['ingested']} ingested ({stats['chunks']} chunks), "
+               f"{stats['unchanged']} unchanged, {stats['emptied']} emptied, {stats['pruned']} pruned in {stats['seconds']}s"
+               + (f"; embedding {emb['texts_per_s']} texts/s" if emb else ""))
+
+
+@click.command("export-index")
+@click.option("--out", help="Snapshot root (default RAG_LOCAL_INDEX_DIR).")
+@click.option("--collection", help="Qdrant collection (default QDRANT_COLLECTION).")
+@click.option("--keep", default=2, show_default=True, help="Snapshot versions to keep on disk.")
+@with_appcontext
+def export_index_command(out, collection, keep):
+    """Export the Qdrant collection to a local memory-mapped snapshot (RAG_BACKEND=local)."""
+    from flask import current_app
+    from .services.local_index import export_snapshot, prune_snapshots
+
+    cfg = current_app.config
+    root = out or cfg.get("RAG_LOCAL_INDEX_DIR", "var/rag_index")
+    manifest = export_snapshot(cfg["QDRANT_CLIENT"], collection or cfg.get("QDRANT_COLLECTION", "state_guidelines"), root)
+    prune_snapshots(root, keep=keep)
+    click.echo(f"exported version {manifest['version']} (dim {manifest['dim']}): {manifest['states']}")
+
+
+@click.command("warm-phrasings")
+@click.option("--variants", type=int, help="Phrasings per question (default PHRASING_VARIANTS).")
+@click.option("--force", is_flag=True, help="Rebuild pools that already exist.")
+@with_appcontext
+def warm_phrasings_command(variants, force):
+    """Pre-generate the umbrella question phrasings so the flow never waits on the LLM."""
+    from .services.phrasing import warm_phrasings
+
+    stats = warm_phrasings(n=variants, force=force)
+    click.echo(f"{stats['built']} pools built, {stats['skipped']} already present")
+
+
+@click.command("profile-token")
+@click.option("--mode", type=click.Choice(["sample", "cprofile"]), default="sample", show_default=True)
+@click.option("--ttl", default=600, show_default=True, help="Seconds the token stays valid.")
+@with_appcontext
+def profile_token_command(mode, ttl):
+    """Print an X-Profile header that profiles any request carrying it (needs PROFILE_SECRET)."""
+    from flask import current_app
+    from .utils.profiling import PROFILE_HEADER, sign_token
+
+    secret = current_app.config.get("PROFILE_SECRET", "")
+    if not secret:
+        raise click.ClickException("PROFILE_SECRET is not set")
+    click.echo(f"{PROFILE_HEADER}: {sign_token(secret, mode, ttl)}")
+
+
+@click.command("profile-arm")
+@click.argument("path")
+@click.option("--count", default=1, show_default=True, help="Requests to profile; 0 disarms.")
+@click.option("--ttl", default=3600, show_default=True, help="Seconds before the arming lapses.")
+@with_appcontext
+def profile_arm_command(path, count, ttl):
+    """Profile the next COUNT requests to PATH on every process (mode PROFILE_MODE)."""
+    from flask import current_app
+    from .utils.profiling import arm
+
+    arm(current_app.config["SESSION_REDIS"], path, count, ttl)
+    click.echo(f"{path}: next {count} requests profiled into {current_app.config.get('PROFILE_DIR')}"
+               if count > 0 else f"{path}: disarmed")
+
+
+def register_cli(app: Flask):
+    app.cli.add_command(warm_embeddings_command)
+    app.cli.add_command(ingest_guidelines_command)
+    app.cli.add_command(export_index_command)
+    app.cli.add_command(warm_phrasings_command)
+    app.cli.add_command(profile_token_command)
+    app.cli.add_command(profile_arm_command)
@@ -10,6 +10,10 @@ class Config:
     # Redis
     REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 
+    # Sessions (uploaded documents are stored once by digest, outside the session blob)
+    SESSION_COMPRESS_MIN_BYTES = int(os.getenv("SESSION_COMPRESS_MIN_BYTES", "1024"))
+    DOCSTORE_CACHE_MAX_ITEMS = int(os.getenv("DOCSTORE_CACHE_MAX_ITEMS", "64"))
+
     # OpenAI
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 
@@ -22,6 +26,109 @@ class Config:
     QDRANT_URL = os.getenv("QDRANT_URL", "")
     QDRANT_API_KEY = os.getenv("QDRANT_API_KEY", "")
     QDRANT_COLLECTION = os.getenv("QDRANT_COLLECTION", "state_guidelines")
+    QDRANT_UPSERT_BATCH = int(os.getenv("QDRANT_UPSERT_BATCH", "128"))
+    QDRANT_UPSERT_CONCURRENCY = int(os.getenv("QDRANT_UPSERT_CONCURRENCY", "4"))
 
     # RAG
     RAG_TOP_K = int(os.getenv("RAG_TOP_K", "8"))
+    RAG_RETRIEVAL_MODE = os.getenv("RAG_RETRIEVAL_MODE", "dense")  # dense | hybrid (needs bm25 vectors from ingest)
+    RAG_HYBRID_PREFETCH = int(os.getenv("RAG_HYBRID_PREFETCH", "4"))  # per-branch candidates = k * this
+    RAG_BACKEND = os.getenv("RAG_BACKEND", "qdrant")  # qdrant | local (memory-mapped snapshot, dense only)
+    RAG_LOCAL_INDEX_DIR = os.getenv("RAG_LOCAL_INDEX_DIR", "var/rag_index")
+    RAG_LOCAL_INDEX_CHECK_S = float(os.getenv("RAG_LOCAL_INDEX_CHECK_S", "10"))
+    RAG_CACHE_TTL_S = int(os.getenv("RAG_CACHE_TTL_S", str(24 * 3600)))
+    RAG_CACHE_MAX_ITEMS = int(os.getenv("RAG_CACHE_MAX_ITEMS", "512"))
+    RAG_SEMANTIC_THRESHOLD = float(os.getenv("RAG_SEMANTIC_THRESHOLD", "0.95"))  # >=1 disables the semantic tier
+    RAG_SEMANTIC_MAX_ENTRIES = int(os.getenv("RAG_SEMANTIC_MAX_ENTRIES", "256"))  # per filter bucket
+    RAG_SEMANTIC_LOCAL_BUCKETS = int(os.getenv("RAG_SEMANTIC_LOCAL_BUCKETS", "16"))  # mirrored in-process (LRU)
+    RAG_PREFETCH = os.getenv("RAG_PREFETCH", "1") not in ("0", "false", "False")  # warm the cache after /upload
+    RAG_PREFETCH_CONCURRENCY = int(os.getenv("RAG_PREFETCH_CONCURRENCY", "2"))
+    RAG_PREFETCH_MAX_PENDING = int(os.getenv("RAG_PREFETCH_MAX_PENDING", "32"))
+    RAG_PREFETCH_TTL_S = int(os.getenv("RAG_PREFETCH_TTL_S", "600"))
+
+    # LLM model routing (route=model overrides; routes: chat, chat_simple, dec_summary, phrasing, memory)
+    LLM_ROUTES = os.getenv("LLM_ROUTES", "")
+    LLM_FAST_MODEL = os.getenv("LLM_FAST_MODEL", "gpt-4o-mini")
+    LLM_FALLBACK_MIN_S = float(os.getenv("LLM_FALLBACK_MIN_S", "8"))  # fewer seconds left -> LLM_FAST_MODEL
+    LLM_TOKENS_PER_S = float(os.getenv("LLM_TOKENS_PER_S", "40"))  # max_tokens is cut to what fits the time left
+    LLM_MIN_TOKENS = int(os.getenv("LLM_MIN_TOKENS", "200"))
+
+    # Per-request deadline for chat turns (bounded by the gunicorn worker timeout, WEB_TIMEOUT_S)
+    WEB_TIMEOUT_S = int(os.getenv("WEB_TIMEOUT_S", "60"))
+    CHAT_DEADLINE_S = float(os.getenv("CHAT_DEADLINE_S", "45"))
+    CHAT_LLM_RESERVE_S = float(os.getenv("CHAT_LLM_RESERVE_S", "15"))  # retrieval must leave this for the answer
+    RAG_MIN_BUDGET_S = float(os.getenv("RAG_MIN_BUDGET_S", "1"))  # less left -> skip embedding/search, cache only
+
+    # OpenAI HTTP transport (read when the shared client is built; timeouts per call)
+    OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "0"))  # 0 = size to worker concurrency
+    OPENAI_CONNECT_TIMEOUT_S = float(os.getenv("OPENAI_CONNECT_TIMEOUT_S", "3"))
+    OPENAI_POOL_TIMEOUT_S = float(os.getenv("OPENAI_POOL_TIMEOUT_S", "5"))  # wait for a free pooled connection
+    OPENAI_READ_TIMEOUTS = os.getenv("OPENAI_READ_TIMEOUTS", "")  # "chat=30,embeddings=10,..." per call site
+    OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))  # 429/5xx/connect errors, jittered backoff
+    OPENAI_BREAKER_FAILURES = int(os.getenv("OPENAI_BREAKER_FAILURES", "5"))
+    OPENAI_BREAKER_RESET_S = float(os.getenv("OPENAI_BREAKER_RESET_S", "30"))
+
+    # Metrics: each process publishes to Redis; /metrics sums the processes of this host
+    METRICS_PUSH_S = float(os.getenv("METRICS_PUSH_S", "5"))
+    METRICS_RETAIN_S = int(os.getenv("METRICS_RETAIN_S", "3600"))  # keep an exited process's counters this long
+
+    # Profiling (opt-in, per request) and the slow-request log (always on)
+    PROFILE_SECRET = os.getenv("PROFILE_SECRET", "")  # signs X-Profile headers; empty = header ignored
+    PROFILE_MODE = os.getenv("PROFILE_MODE", "sample")  # for armed paths: sample | cprofile
+    PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+    PROFILE_DIR = os.getenv("PROFILE_DIR", "var/profiles")
+    PROFILE_MAX_ACTIVE = int(os.getenv("PROFILE_MAX_ACTIVE", "2"))  # concurrent profiles per process
+    PROFILE_POLL_S = float(os.getenv("PROFILE_POLL_S", "5"))  # how often a process re-reads armed paths
+    SLOW_REQUEST_S = float(os.getenv("SLOW_REQUEST_S", "10"))
+    SLOW_JOB_S = float(os.getenv("SLOW_JOB_S", "30"))
+    SLOW_REQUEST_IGNORE = tuple(e for e in os.getenv("SLOW_REQUEST_IGNORE", "jobs.job_events").split(",") if e)
+    SLOW_LOG_KEEP = int(os.getenv("SLOW_LOG_KEEP", "200"))
+
+    # Prompt packing (context sections share what's left after instructions + user message)
+    PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+
+    # Umbrella question phrasings (pre-generated pools, no LLM call per turn)
+    PHRASING_VARIANTS = int(os.getenv("PHRASING_VARIANTS", "6"))
+    PHRASING_CACHE_TTL_S = int(os.getenv("PHRASING_CACHE_TTL_S", str(30 * 24 * 3600)))
+
+    # Conversation memory (recent turns verbatim + background-compacted summary)
+    MEMORY_RECENT_TURNS = int(os.getenv("MEMORY_RECENT_TURNS", "4"))
+    MEMORY_COMPACT_TOKENS = int(os.getenv("MEMORY_COMPACT_TOKENS", "1200"))  # turns above this get summarized
+    MEMORY_MAX_TOKENS = int(os.getenv("MEMORY_MAX_TOKENS", "3000"))  # hard cap; oldest turns dropped past it
+    MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "400"))
+    MEMORY_COMPACT_WORKERS = int(os.getenv("MEMORY_COMPACT_WORKERS", "2"))
+
+    # Query embedding cache (float32 vectors; ~12KB each for text-embedding-3-large)
+    EMBED_CACHE_MAX_ITEMS = int(os.getenv("EMBED_CACHE_MAX_ITEMS", "1024"))
+    EMBED_CACHE_TTL_S = int(os.getenv("EMBED_CACHE_TTL_S", str(30 * 24 * 3600)))
+
+    # Bulk embedding (embed_many)
+    EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+    EMBED_BATCH_MAX_TOKENS = int(os.getenv("EMBED_BATCH_MAX_TOKENS", "100000"))
+    EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+    EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "3"))
+
+    # Extraction cache (pdfplumber + Vision results keyed by content digest)
+    OCR_CACHE_MAX_ITEMS = int(os.getenv("OCR_CACHE_MAX_ITEMS", "512"))
+    OCR_CACHE_TTL_S = int(os.getenv("OCR_CACHE_TTL_S", str(7 * 24 * 3600)))
+    VISION_EMPTY_TTL_S = int(os.getenv("VISION_EMPTY_TTL_S", "600"))  # blank Vision pages, degraded documents
+
+    # Background jobs (/upload)
+    UPLOAD_ASYNC = os.getenv("UPLOAD_ASYNC", "1") not in ("0", "false", "False")
+    JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "redis")  # redis | local
+    JOB_LOCAL_WORKERS = int(os.getenv("JOB_LOCAL_WORKERS", "2"))
+    JOB_TTL_S = int(os.getenv("JOB_TTL_S", str(24 * 3600)))
+    JOB_HEARTBEAT_S = float(os.getenv("JOB_HEARTBEAT_S", "10"))  # a worker silent for 3x this is presumed dead
+    JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "2"))  # runs of a job whose worker died mid-way
+    # Each /jobs/<id>/events stream holds a thread under SERVING_MODE=sync: keep them short (the page
+    # reconnects) and few per process (beyond the cap the page polls /jobs/<id>). 0 = no cap.
+    JOB_SSE_TIMEOUT_S = int(os.getenv("JOB_SSE_TIMEOUT_S", "25"))
+    JOB_SSE_MAX_STREAMS = int(os.getenv("JOB_SSE_MAX_STREAMS", "0" if os.getenv("SERVING_MODE") == "async"
+                                        else str(max(1, int(os.getenv("WEB_THREADS", "2")) // 2))))
+
+    # Page-selective OCR
+    OCR_PROCESS_WORKERS = int(os.getenv("OCR_PROCESS_WORKERS", "2"))  # <=1 disables the process pool
+    OCR_PARALLEL_MIN_PAGES = int(os.getenv("OCR_PARALLEL_MIN_PAGES", "4"))
+    VISION_INLINE_MAX_PAGES = int(os.getenv("VISION_INLINE_MAX_PAGES", "10"))
+    VISION_INLINE_MAX_BYTES = int(os.getenv("VISION_INLINE_MAX_BYTES", str(10 * 1024 * 1024)))
+    VISION_IO_CONCURRENCY = int(os.getenv("VISION_IO_CONCURRENCY", "8"))
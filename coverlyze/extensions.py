@@ -1,25 +1,67 @@
+"""
+Process-wide clients, built on first use in the process that uses them.
+
+Nothing heavy is imported here: openai, qdrant_client and the Google Vision/Storage
+stack load when their client is first needed, so web pods that never OCR never load
+gRPC. app.config holds LazyClient stand-ins rather than clients, and the cached OpenAI,
+Qdrant and Google clients are dropped after fork, so a preloaded master (gunicorn
+preload_app) hands its workers no sockets or gRPC channels; each worker builds its own.
+The Redis client is kept: it is also held by app.config["SESSION_REDIS"] and the session
+interface, and redis-py already discards its inherited connections after fork.
+"""
 from __future__ import annotations
 
 import json
 import logging
 import os
-from typing import Optional
+from typing import TYPE_CHECKING, Callable, Optional
 
 import redis
 from flask import current_app
-from google.cloud import storage
-from google.cloud import vision_v1 as vision
-from google.oauth2 import service_account
-from openai import OpenAI
-from qdrant_client import QdrantClient
+
+if TYPE_CHECKING:
+    from google.cloud import storage
+    from google.cloud import vision_v1 as vision
+    from openai import OpenAI
+    from qdrant_client import QdrantClient
 
 logger = logging.getLogger(__name__)
 
-_openai_client: Optional[OpenAI] = None
-_qdrant_client: Optional[QdrantClient] = None
+_openai_client: Optional["OpenAI"] = None
+_qdrant_client: Optional["QdrantClient"] = None
 _redis_client: Optional[redis.Redis] = None
-_vision_client: Optional[vision.ImageAnnotatorClient] = None
-_storage_client: Optional[storage.Client] = None
+_vision_client: Optional["vision.ImageAnnotatorClient"] = None
+_storage_client: Optional["storage.Client"] = None
+_google_init_failed = False  # don't rebuild (and re-log) on every LazyClient access
+
+
+def _reset_after_fork():
+    global _openai_client, _qdrant_client, _vision_client, _storage_client, _google_init_failed
+    _openai_client = _qdrant_client = _vision_client = _storage_client = None
+    _google_init_failed = False
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class LazyClient:
+    """Stands in for a client in app.config: resolves it through `factory` on each use."""
+
+    def __init__(self, factory: Callable[[], object], name: str):
+        self._factory = factory
+        self._name = name
+
+    def __getattr__(self, attr):
+        client = self._factory()
+        if client is None:
+            raise RuntimeError(f"{self._name} client not initialized")
+        return getattr(client, attr)
+
+    def __bool__(self) -> bool:
+        return self._factory() is not None
+
+    def __repr__(self) -> str:
+        return f"<LazyClient {self._name}>"
 
 
 def redis_client() -> redis.Redis:
@@ -29,26 +71,39 @@ def redis_client() -> redis.Redis:
     return _redis_client
 
 
-def openai_client() -> OpenAI:
+def openai_client() -> "OpenAI":
     global _openai_client
     if _openai_client is None:
-        _openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        from .services.openai_http import build_openai_client
+        _openai_client = build_openai_client(api_key=os.getenv("OPENAI_API_KEY"))
     return _openai_client
 
 
-def qdrant_client() -> QdrantClient:
+def qdrant_client() -> "QdrantClient":
     global _qdrant_client
     if _qdrant_client is None:
+        from qdrant_client import QdrantClient
         _qdrant_client = QdrantClient(url=os.getenv("QDRANT_URL"), api_key=os.getenv("QDRANT_API_KEY"))
     return _qdrant_client
 
 
 def google_clients():
-    global _vision_client, _storage_client
+    """(vision, storage), or (None, None) if they failed to build; a failure is retried only after fork."""
+    global _vision_client, _storage_client, _google_init_failed
     if _vision_client and _storage_client:
         return _vision_client, _storage_client
+    if _google_init_failed:
+        return None, None
+
+    if os.getenv("VISION_BACKEND") == "fake":
+        from .services.vision_fake import fake_google_clients
+        _vision_client, _storage_client = fake_google_clients()
+        return _vision_client, _storage_client
 
     try:
+        from google.cloud import storage
+        from google.cloud import vision_v1 as vision
+        from google.oauth2 import service_account
         info = json.loads(os.getenv("GOOGLE_SERVICE_ACCOUNT_JSON", "{}"))
         creds = service_account.Credentials.from_service_account_info(info) if info else None
         _vision_client = vision.ImageAnnotatorClient(credentials=creds) if creds else vision.ImageAnnotatorClient()
@@ -56,15 +111,15 @@ def google_clients():
     except Exception as e:
         logger.error("Failed to init Google clients: %s", e)
         _vision_client, _storage_client = None, None
+        _google_init_failed = True
 
     return _vision_client, _storage_client
 
 
 def init_extensions(app):
-    # attach helpful handles on app.config
-    app.config["OPENAI_CLIENT"] = openai_client()
-    app.config["QDRANT_CLIENT"] = qdrant_client()
-    app.config["SESSION_REDIS"] = redis_client()
-    vc, sc = google_clients()
-    app.config["VISION_CLIENT"] = vc
-    app.config["STORAGE_CLIENT"] = sc
+    # helpful handles on app.config; clients are built on first use, per process
+    app.config["OPENAI_CLIENT"] = LazyClient(openai_client, "openai")
+    app.config["QDRANT_CLIENT"] = LazyClient(qdrant_client, "qdrant")
+    app.config["SESSION_REDIS"] = redis_client()  # connects lazily; redis-py resets its pool after fork
+    app.config["VISION_CLIENT"] = LazyClient(lambda: google_clients()[0], "vision")
+    app.config["STORAGE_CLIENT"] = LazyClient(lambda: google_clients()[1], "storage")
@@ -4,17 +4,29 @@ import json
 import logging
 import random
 import re
+import time
 from datetime import timedelta
 
-from flask import Blueprint, current_app, jsonify, request, session
+from flask import Blueprint, Response, current_app, g, jsonify, request, session, stream_with_context
 
 from ..extensions import openai_client, qdrant_client
-from ..services.llm import build_messages, convert_markdown_to_html, llm_phrase, with_instruction
-from ..services.dec_parser import extract_dec_page_data, parse_minimums_from_chunks
-from ..services.ocr import extract_text_smart
-from ..services.rag import rag_retrieve
+from ..services.llm import MarkdownStreamConverter, build_messages, convert_markdown_to_html
+from ..services.dec_parser import parse_minimums_from_chunks
+from ..services.jobs import job_queue
+from ..services.llm_router import chat_route, complete, route_stats
+from ..services.memory import apply_compaction, record_turn
+from ..services.openai_http import http_stats, is_provider_outage
+from ..services.phrasing import phrase
+from ..services.prefetch import prefetch_stats, record_first_turn, start_prefetch, turn_request
+from ..services.rag import rag_cache_stats, rag_retrieve_many
+from ..services.upload_pipeline import run_upload_pipeline
+from ..utils import metrics
+from ..utils.cache import cache_stats, clear_local_caches
+from ..utils.profiling import current_profile_mode
+from ..utils.deadline import DeadlineExceeded, budget_stage, make_deadline, remaining
 from ..utils.chat_flow import (UMBRELLA_QUESTIONS, absorb_umbrella_answers_from_text,
                                estimate_umbrella_premium, next_missing_slot)
+from ..utils.sessions import save_session_now, session_stats
 from ..utils.state import infer_state, infer_state_debug
 
 logger = logging.getLogger(__name__)
@@ -41,6 +53,27 @@ def generate_fake_rates(base_premium):
     return {c: round(base * (1 + random.uniform(-0.1, 0.1)), 2) for c in carriers}
 
 
+def apply_upload_result(result: dict) -> dict:
+    """Copy a finished upload pipeline result into the caller's session."""
+    extracted_data = result.get("extracted_data") or {}
+    session["extracted_text"] = result.get("extracted_text", "")
+    session["extracted_data"] = extracted_data
+
+    premium = extracted_data.get("policy_info", {}).get("full_term_premium", "1200")
+    session["fake_quotes"] = generate_fake_rates(premium)
+
+    # warm the RAG cache for the questions this policy is likely to prompt
+    session["rag_prefetch"] = start_prefetch(session.sid, infer_state(session.get("user_profile") or {}, session),
+                                             extracted_data)
+
+    auto_summary = result.get("auto_summary")
+    session.setdefault("chat_history", [])
+    session["chat_history"].append(("assistant", auto_summary))
+    session["dec_summary"] = auto_summary
+    return {"success": True, "extracted_data": extracted_data, "fake_quotes": session["fake_quotes"],
+            "auto_summary": auto_summary, "ocr_report": result.get("ocr_report", [])}
+
+
 # --------- routes ----------
 @bp.post("/upload")
 def upload_file():
@@ -51,133 +84,261 @@ def upload_file():
         if not f.filename.lower().endswith(".pdf"):
             return jsonify({"error": "Please upload a PDF file"}), 400
 
-        extracted_text = extract_text_smart(f)
-        session["extracted_text"] = extracted_text
+        pdf_bytes = f.read()
+        if not current_app.config.get("UPLOAD_ASYNC", True):
+            return jsonify(apply_upload_result(run_upload_pipeline(pdf_bytes)))
 
-        extracted_data = extract_dec_page_data(extracted_text)
-        session["extracted_data"] = extracted_data
+        # Extraction/OCR/summary run in a worker; the client follows /jobs/<id>/events.
+        job_id = job_queue().enqueue("upload", pdf_bytes, owner=session.sid, filename=f.filename,
+                                     profile=current_profile_mode())
+        session["upload_job"] = job_id
+        return jsonify({"success": True, "job_id": job_id, "status_url": f"/jobs/{job_id}",
+                        "events_url": f"/jobs/{job_id}/events"}), 202
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
 
-        premium = extracted_data.get("policy_info", {}).get("full_term_premium", "1200")
-        session["fake_quotes"] = generate_fake_rates(premium)
 
-        # quick summary with LLM (optional)
-        client = openai_client()
-        messages = [
-            {"role": "system", "content": with_instruction("You are a professional insurance agent.",
-                                                           "Output valid HTML with a Coverage Analysis table.")},
-            {"role": "user", "content": f"Analyze this declarations page and provide recommendations in HTML:\n\n{extracted_text}"}
-        ]
-        try:
-            resp = client.chat.completions.create(model="gpt-4o", messages=messages, max_tokens=1200, temperature=0.6)
-            auto_summary = resp.choices[0].message.content
-        except Exception as e:
-            auto_summary = f"<p><em>Summary unavailable:</em> {e}</p>"
+def _record_turn(user_message: str, reply: str, summary_reply: str | None = None):
+    session["chat_history"].append(("assistant", reply))
+    record_turn(session, user_message, summary_reply or reply)
+    session["chat_history"] = session["chat_history"][-12:]
+
+
+def _begin_chat_turn(user_message: str, deadline: float | None = None) -> tuple[str | None, list | None]:
+    """
+    Runs everything before the main LLM call. Returns (reply, None) when the turn is
+    answered without it (umbrella flow, already recorded), else (None, messages).
+    Retrieval has to finish CHAT_LLM_RESERVE_S before the deadline, leaving that for the answer.
+    """
+    session.setdefault("chat_history", [])
+    apply_compaction(session)
+    session.setdefault("active_flow", None)
+    session.setdefault("umbrella_slots", {})
+
+    session["chat_history"].append(("user", user_message))
+    metrics.note(message_chars=len(user_message), history_turns=len(session["chat_history"]))
+
+    # enter umbrella flow if asked
+    if session["active_flow"] is None and re.search(r"\b(umbrella|pup|excess liability)\b", user_message, re.I):
+        session["active_flow"] = "umbrella"
+
+    # UMBRELLA FLOW
+    if session.get("active_flow") == "umbrella":
+        slots = session.get("umbrella_slots", {})
+        slots = absorb_umbrella_answers_from_text(slots, user_message)
+        missing = next_missing_slot(slots)
+        if missing:
+            session["umbrella_slots"] = slots
+            q = UMBRELLA_QUESTIONS[missing]
+            phrased = phrase(q)
+            _record_turn(user_message, phrased)
+            return phrased, None
+
+        one_m, two_m = estimate_umbrella_premium(slots)
+        session["active_flow"] = None
+        session["umbrella_slots"] = slots
+        html = (
+            "<h4>Umbrella Quote Estimate</h4>"
+            "<table><thead><tr><th>Limit</th><th>Estimated Annual Premium</th></tr></thead>"
+            f"<tbody><tr><td>$1,000,000</td><td>${one_m}</td></tr>"
+            f"<tr><td>$2,000,000</td><td>${two_m}</td></tr></tbody></table>"
+            "<p>Want me to generate a firm quote with specific carriers?</p>"
+        )
+        _record_turn(user_message, html, summary_reply="[umbrella table]")
+        return html, None
+
+    # General path — RAG
+    user_profile = session.get("user_profile") or {"preferred_tone": "concise, respectful"}
+    session_state = infer_state(user_profile, session)
+    target_cov = detect_target_coverage(user_message)
+
+    tiers, t0 = [], time.perf_counter()
+    rag_deadline = deadline - current_app.config.get("CHAT_LLM_RESERVE_S", 15) if deadline is not None else None
+    with budget_stage("rag", deadline):
+        retrieved_context = rag_retrieve_many([turn_request(session_state, user_message, session.get("active_flow"))],
+                                              tiers=tiers, deadline=rag_deadline)[0]
+    if "rag_prefetch" in session:
+        record_first_turn(session.pop("rag_prefetch"), tiers[0], time.perf_counter() - t0)
+
+    state_norm = session_state.upper() if session_state else None
+    allow_fallback = False
+    if target_cov and state_norm:
+        joined = "\n".join(retrieved_context).lower()
+        need_terms_map = {
+            "property_damage": ["property damage", "part 4", "pd liability"],
+            "bodily_injury": ["bodily injury", "part 1", "part 5", "bi liability"],
+            "um": ["uninsured", "um"], "uim": ["underinsured", "uim"],
+            "pip": ["pip", "personal injury protection"], "medpay": ["medical payments", "med pay"],
+        }
+        need_terms = need_terms_map.get(target_cov, [])
+        if not any(t in joined for t in need_terms):
+            allow_fallback = True
+
+    g.prompt_stats = {}
+    with budget_stage("prompt", deadline):
+        messages = build_messages(
+            user_message=user_message, session_obj=session, user_profile=user_profile,
+            retrieved_context=retrieved_context, flow_state=session.get("active_flow"),
+            allow_pretraining_fallback=allow_fallback, state_norm=state_norm, target_cov=target_cov,
+            stats=g.prompt_stats
+        )
+    metrics.note(context_sections=len(retrieved_context), prompt_tokens=g.prompt_stats.get("prompt_tokens"))
+    return None, messages
 
-        session.setdefault("chat_history", [])
-        session["chat_history"].append(("assistant", auto_summary))
-        session["dec_summary"] = auto_summary
 
-        return jsonify({"success": True, "extracted_data": extracted_data, "fake_quotes": session["fake_quotes"],
-                        "auto_summary": auto_summary})
-    except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
+def _turn_deadline(started: float) -> float:
+    """The turn's deadline: CHAT_DEADLINE_S after it started, always a few seconds inside the worker timeout."""
+    cfg = current_app.config
+    budget = min(cfg.get("CHAT_DEADLINE_S", 45), cfg.get("WEB_TIMEOUT_S", 60) - 5)
+    return make_deadline(budget, started)
+
+
+DEGRADED_REPLY = ("<p>I'm having trouble reaching my answer service right now, so I can't give you a "
+                  "reliable answer this moment. Please try again in a minute — your conversation is saved.</p>")
+
+
+def _is_degradable(e: Exception) -> bool:
+    return isinstance(e, DeadlineExceeded) or is_provider_outage(e)
+
+
+def _degraded_reply(endpoint: str, e: Exception) -> str:
+    """Reply when the model provider is down or rate limiting (breaker open, timeouts, 429/5xx) or time ran out."""
+    logger.warning("%s degraded: %s: %s", endpoint, type(e).__name__, e)
+    metrics.inc("chat_degraded_total", endpoint=endpoint, reason=type(e).__name__)
+    session.setdefault("chat_history", []).append(("assistant", DEGRADED_REPLY))
+    return DEGRADED_REPLY
+
+
+def _log_turn(endpoint: str, llm_s: float):
+    """Per-turn prompt size (as packed) and main LLM call latency."""
+    st = g.get("prompt_stats") or {}
+    metrics.observe("chat_llm_seconds", llm_s, endpoint=endpoint)
+    logger.info("%s turn: prompt_tokens=%s sections=%s deduped=%s llm_s=%.3f", endpoint, st.get("prompt_tokens"),
+                st.get("used"), st.get("chunks_deduped"), llm_s)
 
 
 @bp.post("/chat")
 def chat():
+    started = time.perf_counter()
     try:
         data = request.get_json() or {}
         user_message = (data.get("message") or "").strip()
         if not user_message:
             return jsonify({"error": "No message provided"}), 400
 
-        session.setdefault("chat_history", [])
-        session.setdefault("running_summary", "")
-        session.setdefault("active_flow", None)
-        session.setdefault("umbrella_slots", {})
-
-        session["chat_history"].append(("user", user_message))
-
-        # enter umbrella flow if asked
-        if session["active_flow"] is None and re.search(r"\b(umbrella|pup|excess liability)\b", user_message, re.I):
-            session["active_flow"] = "umbrella"
-
-        # UMBRELLA FLOW
-        if session.get("active_flow") == "umbrella":
-            slots = session.get("umbrella_slots", {})
-            slots = absorb_umbrella_answers_from_text(slots, user_message)
-            missing = next_missing_slot(slots)
-            if missing:
-                session["umbrella_slots"] = slots
-                q = UMBRELLA_QUESTIONS[missing]
-                phrased = llm_phrase("Keep tone warm, professional, concise.", q)
-                session["chat_history"].append(("assistant", phrased))
-                session["running_summary"] += f"\n- U: {user_message[:160]} | A: {phrased[:160]}"
-                session["chat_history"] = session["chat_history"][-12:]
-                return jsonify({"success": True, "response": phrased})
-
-            one_m, two_m = estimate_umbrella_premium(slots)
-            session["active_flow"] = None
-            session["umbrella_slots"] = slots
-            html = (
-                "<h4>Umbrella Quote Estimate</h4>"
-                "<table><thead><tr><th>Limit</th><th>Estimated Annual Premium</th></tr></thead>"
-                f"<tbody><tr><td>$1,000,000</td><td>${one_m}</td></tr>"
-                f"<tr><td>$2,000,000</td><td>${two_m}</td></tr></tbody></table>"
-                "<p>Want me to generate a firm quote with specific carriers?</p>"
-            )
-            session["chat_history"].append(("assistant", html))
-            session["running_summary"] += f"\n- U: {user_message[:160]} | A: [umbrella table]"
-            session["chat_history"] = session["chat_history"][-12:]
-            return jsonify({"success": True, "response": html})
-
-        # General path — RAG
-        user_profile = session.get("user_profile") or {"preferred_tone": "concise, respectful"}
-        session_state = infer_state(user_profile, session)
-        target_cov = detect_target_coverage(user_message)
-
-        retrieved_context = rag_retrieve(
-            state=session_state, topic=session.get("active_flow") or "general", k=5,
-            line=("auto" if (session.get("active_flow") or "general") == "auto_adjust" else None),
-            coverage=None, coverages_any=None, section=None, user_query=user_message
-        )
-
-        state_norm = session_state.upper() if session_state else None
-        allow_fallback = False
-        if target_cov and state_norm:
-            joined = "\n".join(retrieved_context).lower()
-            need_terms_map = {
-                "property_damage": ["property damage", "part 4", "pd liability"],
-                "bodily_injury": ["bodily injury", "part 1", "part 5", "bi liability"],
-                "um": ["uninsured", "um"], "uim": ["underinsured", "uim"],
-                "pip": ["pip", "personal injury protection"], "medpay": ["medical payments", "med pay"],
-            }
-            need_terms = need_terms_map.get(target_cov, [])
-            if not any(t in joined for t in need_terms):
-                allow_fallback = True
-
-        messages = build_messages(
-            user_message=user_message, session_obj=session, user_profile=user_profile,
-            retrieved_context=retrieved_context, flow_state=session.get("active_flow"),
-            allow_pretraining_fallback=allow_fallback, state_norm=state_norm, target_cov=target_cov
-        )
-
-        client = openai_client()
-        resp = client.chat.completions.create(model="gpt-4o", messages=messages, max_tokens=1000, temperature=0.4)
-        reply = (resp.choices[0].message.content or "").strip()
-        reply = convert_markdown_to_html(reply)
-        session["chat_history"].append(("assistant", reply))
-        session["running_summary"] += f"\n- U: {user_message[:160]} | A: {reply[:160]}"
-        session["chat_history"] = session["chat_history"][-12:]
-
+        deadline = _turn_deadline(started)
+        reply, messages = _begin_chat_turn(user_message, deadline)
+        if reply is None:
+            t_llm = time.perf_counter()
+            with budget_stage("llm", deadline):
+                resp = complete(chat_route(user_message), messages, client=openai_client(), deadline=deadline,
+                                max_tokens=1000, temperature=0.4)
+            _log_turn("chat", time.perf_counter() - t_llm)
+            reply = (resp.choices[0].message.content or "").strip()
+            reply = convert_markdown_to_html(reply)
+            _record_turn(user_message, reply)
+
+        # a blocking reply's first token arrives with the whole answer
+        metrics.observe("chat_ttft_seconds", time.perf_counter() - started, endpoint="chat")
         return jsonify({"success": True, "response": reply})
     except Exception as e:
+        if _is_degradable(e):
+            return jsonify({"success": True, "response": _degraded_reply("chat", e), "degraded": True})
         logger.exception("chat error")
         error_msg = f"Error processing chat: {e}"
         session.setdefault("chat_history", []).append(("assistant", error_msg))
         return jsonify({"error": error_msg}), 500
 
 
+def _sse(event: str, payload: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+@bp.post("/chat/stream")
+def chat_stream():
+    """Same turn as /chat, but the answer is streamed as SSE `token` events, then `done`."""
+    started = time.perf_counter()
+    data = request.get_json() or {}
+    user_message = (data.get("message") or "").strip()
+    if not user_message:
+        return jsonify({"error": "No message provided"}), 400
+    degraded, deadline = False, _turn_deadline(started)
+    try:
+        reply, messages = _begin_chat_turn(user_message, deadline)
+    except Exception as e:
+        if not _is_degradable(e):
+            logger.exception("chat error")
+            error_msg = f"Error processing chat: {e}"
+            session.setdefault("chat_history", []).append(("assistant", error_msg))
+            return jsonify({"error": error_msg}), 500
+        reply, messages, degraded = _degraded_reply("chat_stream", e), None, True
+
+    def ms(seconds: float) -> int:
+        return int(seconds * 1000)
+
+    def stream():
+        if reply is not None:
+            ttft = time.perf_counter() - started
+            metrics.observe("chat_ttft_seconds", ttft, endpoint="chat_stream")
+            yield _sse("token", {"html": reply})
+            yield _sse("done", {"response": reply, "ttft_ms": ms(ttft), "total_ms": ms(ttft), "degraded": degraded})
+            return
+
+        converter, parts, ttft = MarkdownStreamConverter(), [], None
+        t_llm = time.perf_counter()
+        try:
+            with budget_stage("llm", deadline):
+                completion = complete(chat_route(user_message), messages, client=openai_client(),
+                                      deadline=deadline, stream=True, max_tokens=1000, temperature=0.4)
+                for chunk in completion:
+                    if remaining(deadline) == 0:
+                        # out of budget mid-answer: end with what has been streamed
+                        metrics.inc("deadline_degrades_total", stage="llm", action="truncated")
+                        completion.close()
+                        break
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if not delta:
+                        continue
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                        metrics.observe("chat_ttft_seconds", ttft, endpoint="chat_stream")
+                    parts.append(delta)
+                    html = converter.feed(delta)
+                    if html:
+                        yield _sse("token", {"html": html})
+                tail = converter.flush()
+                if tail:
+                    yield _sse("token", {"html": tail})
+        except Exception as e:
+            if _is_degradable(e):
+                # whatever was already streamed stays on screen; the notice follows it
+                notice = _degraded_reply("chat_stream", e)
+                save_session_now()
+                yield _sse("token", {"html": notice})
+                yield _sse("done", {"response": notice, "ttft_ms": ms(ttft or 0), "total_ms": ms(time.perf_counter() - started),
+                                    "degraded": True})
+                return
+            logger.exception("chat stream error")
+            error_msg = f"Error processing chat: {e}"
+            session["chat_history"].append(("assistant", error_msg))
+            save_session_now()
+            yield _sse("error", {"error": error_msg})
+            return
+
+        _log_turn("chat_stream", time.perf_counter() - t_llm)
+        # History and conversation memory are written once, after the stream completes.
+        full = convert_markdown_to_html("".join(parts).strip())
+        _record_turn(user_message, full)
+        save_session_now()
+        total = time.perf_counter() - started
+        metrics.observe("chat_stream_total_seconds", total)
+        yield _sse("done", {"response": full, "ttft_ms": ms(ttft or total), "total_ms": ms(total),
+                            "prompt_tokens": (g.get("prompt_stats") or {}).get("prompt_tokens")})
+
+    return Response(stream_with_context(stream()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @bp.get("/debug_ma_limits")
 def debug_ma_limits():
     try:
@@ -188,15 +349,16 @@ def debug_ma_limits():
             "MA state minimum auto insurance",
             "Massachusetts bodily injury property damage limits"
         ]
+        requests_ = [{"state": "MA", "topic": "general", "k": 5, "user_query": q} for q in test_queries]
+        requests_.append({"state": None, "topic": "general", "k": 5, "user_query": "Massachusetts minimum limits"})
+        *per_query, chunks_no = rag_retrieve_many(requests_)
         results = {}
-        for q in test_queries:
-            chunks = rag_retrieve(state="MA", topic="general", k=5, user_query=q)
+        for q, chunks in zip(test_queries, per_query):
             results[q] = {
                 "chunks_found": len(chunks),
                 "chunks": [c[:300] + "..." for c in chunks],
                 "parsed_minimums": parse_minimums_from_chunks(chunks)
             }
-        chunks_no = rag_retrieve(state=None, topic="general", k=5, user_query="Massachusetts minimum limits")
         return jsonify({
             "inferred_state": st, "state_debug_info": dbg, "user_profile": user_profile,
             "test_results": results, "no_state_chunks": len(chunks_no),
@@ -206,10 +368,27 @@ def debug_ma_limits():
         return jsonify({"error": str(e)}), 500
 
 
+@bp.get("/debug_cache")
+def debug_cache():
+    return jsonify({**cache_stats(), "rag_tiers": rag_cache_stats(), "rag_prefetch": prefetch_stats(),
+                    "sessions": session_stats()})
+
+
+@bp.get("/debug_llm")
+def debug_llm():
+    return jsonify({**route_stats(), "http": http_stats()})
+
+
+@bp.get("/debug_metrics")
+def debug_metrics():
+    return jsonify(metrics.snapshot())
+
+
 @bp.post("/clear_cache")
 def clear_cache():
     try:
         current_app.config["SESSION_REDIS"].flushdb()
+        clear_local_caches()
         return jsonify({"success": True, "message": "Cache cleared"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -235,14 +414,15 @@ def rag_search_route():
     q_coverage = request.args.get("coverage")
     q_coverages_any = request.args.getlist("coverages_any") or None
     q_section = request.args.get("section")
-    q = request.args.get("q")
-
-    chunks = rag_retrieve(state=q_state, topic=q_topic, k=q_k, line=q_line, coverage=q_coverage,
-                          coverages_any=q_coverages_any, section=q_section, user_query=q)
-    return jsonify({
-        "state": q_state, "topic": q_topic, "k": q_k, "line": q_line, "coverage": q_coverage,
-        "coverages_any": q_coverages_any, "section": q_section, "q": q, "chunks": chunks
-    })
+    qs = request.args.getlist("q") or [None]
+
+    params = {"state": q_state, "topic": q_topic, "k": q_k, "line": q_line, "coverage": q_coverage,
+              "coverages_any": q_coverages_any, "section": q_section}
+    results = rag_retrieve_many([{**params, "user_query": q} for q in qs])
+    body = {**params, "q": qs[0], "chunks": results[0]}
+    if len(qs) > 1:
+        body["results"] = [{"q": q, "chunks": chunks} for q, chunks in zip(qs, results)]
+    return jsonify(body)
 
 
 @bp.get("/debug_qdrant")
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+
+from flask import Blueprint, Response, current_app, jsonify, session, stream_with_context
+
+from ..services.jobs import TERMINAL_STATUSES, job_queue
+from .chat import apply_upload_result
+
+bp = Blueprint("jobs", __name__)
+
+_streams = 0  # open /jobs/<id>/events streams in this process
+_streams_lock = threading.Lock()
+
+
+def _owned_job(job_id: str):
+    record = job_queue().get(job_id)
+    if not record or record.get("owner") != session.sid:
+        return None
+    return record
+
+
+@bp.get("/jobs/<job_id>")
+def job_status(job_id):
+    record = _owned_job(job_id)
+    if record is None:
+        return jsonify({"error": "Job not found"}), 404
+    out = {k: record.get(k) for k in ("id", "status", "stage", "error", "created_at", "updated_at", "elapsed_s")}
+    if record.get("profile_id"):
+        out["profile_id"] = record["profile_id"]  # profiled upload: files under PROFILE_DIR on the worker
+    if record["status"] != "done":
+        return jsonify(out)
+
+    # First poll after completion attaches the result to this session.
+    if session.get("upload_job") == job_id:
+        out.update(apply_upload_result(record.get("result") or {}))
+        session.pop("upload_job", None)
+    else:
+        result = record.get("result") or {}
+        out.update({"success": True, "extracted_data": result.get("extracted_data"),
+                    "fake_quotes": session.get("fake_quotes", {}), "auto_summary": result.get("auto_summary"),
+                    "ocr_report": result.get("ocr_report", [])})
+    return jsonify(out)
+
+
+@bp.get("/jobs/<job_id>/events")
+def job_events(job_id):
+    if _owned_job(job_id) is None:
+        return jsonify({"error": "Job not found"}), 404
+    q = job_queue()
+    cfg = current_app.config
+    max_s = cfg.get("JOB_SSE_TIMEOUT_S", 25)
+    max_streams = cfg.get("JOB_SSE_MAX_STREAMS", 0)
+    global _streams
+    with _streams_lock:
+        full = bool(max_streams) and _streams >= max_streams
+        if not full:
+            _streams += 1
+    if full:
+        # every stream pins a worker thread in sync mode; the page falls back to polling /jobs/<id>
+        return jsonify({"error": "Too many open event streams", "status_url": f"/jobs/{job_id}"}), 503, \
+            {"Retry-After": "2"}
+
+    released = False
+
+    def release():
+        # from the generator's finally and from call_on_close: a stream never iterated still frees its slot
+        global _streams
+        nonlocal released
+        with _streams_lock:
+            if not released:
+                released = True
+                _streams -= 1
+
+    def stream():
+        try:
+            since, started, last_beat = 0, time.monotonic(), time.monotonic()
+            while time.monotonic() - started < max_s:
+                events = q.events(job_id, since=since, wait_s=1.0)
+                for ev in events:
+                    yield f"event: stage\ndata: {json.dumps(ev)}\n\n"
+                    if ev.get("stage") in TERMINAL_STATUSES:
+                        return
+                since += len(events)
+                if time.monotonic() - last_beat > 15:
+                    last_beat = time.monotonic()
+                    yield ": keep-alive\n\n"
+            # not finished yet: the client reconnects
+            yield f"event: timeout\ndata: {json.dumps({'job_id': job_id})}\n\n"
+        finally:
+            release()
+
+    response = Response(stream_with_context(stream()), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.call_on_close(release)
+    return response
@@ -4,6 +4,7 @@ import io, json
 
 from ..services.ocr import extract_text_smart
 from ..services.dec_parser import extract_dec_page_data
+from ..services.prefetch import cancel_prefetch
 from ..services.llm import build_messages
 from ..extensions import openai_client
 
@@ -13,9 +14,9 @@ bp = Blueprint("main", __name__)
 
 @bp.get("/")
 def index():
+    cancel_prefetch(session.sid)
     session.clear()
     session["chat_history"] = []
-    session["running_summary"] = ""
     return render_template("index.html")
 
 
@@ -30,6 +31,7 @@ def get_chat_history():
 
 @bp.get("/clear_session")
 def clear_session():
+    cancel_prefetch(session.sid)
     session.clear()
     return jsonify({"success": True})
 
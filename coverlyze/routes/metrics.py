@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import logging
+
+from flask import Blueprint, Response, current_app, jsonify, request
+
+from ..extensions import redis_client
+from ..utils import metrics
+from ..utils.profiling import recent_slow
+
+logger = logging.getLogger(__name__)
+bp = Blueprint("metrics", __name__)
+
+
+def start_metrics_publisher(app):
+    metrics.start_publisher(redis_client, push_s=app.config.get("METRICS_PUSH_S", 5),
+                            retain_s=app.config.get("METRICS_RETAIN_S", 3600))
+
+
+@bp.before_app_request
+def _ensure_publisher():
+    # per process, so a worker forked from a preloaded master starts its own
+    start_metrics_publisher(current_app)
+
+
+@bp.get("/metrics")
+def prometheus_metrics():
+    """Prometheus text format, summed over every process on this host (web workers and job workers)."""
+    cfg = current_app.config
+    try:
+        state = metrics.collect(redis_client(), push_s=cfg.get("METRICS_PUSH_S", 5),
+                                retain_s=cfg.get("METRICS_RETAIN_S", 3600))
+    except Exception as e:
+        logger.warning("metrics aggregation failed, serving this process only: %s", e)
+        state = metrics.merge_states([metrics.export_state()])
+    return Response(metrics.render_prometheus(state), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+@bp.get("/debug_slow")
+def debug_slow():
+    """Recent requests/jobs over SLOW_REQUEST_S / SLOW_JOB_S, newest first, with stage timings and input sizes."""
+    return jsonify(recent_slow(redis_client(), limit=request.args.get("limit", 50, type=int)))
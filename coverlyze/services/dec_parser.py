@@ -1,60 +1,169 @@
 from __future__ import annotations
+import logging
 import re
+import time
 
+logger = logging.getLogger(__name__)
 
-def extract_dec_page_data(extracted_text: str) -> dict:
+
+# Every quantifier that can run across the document is bounded, so each pattern costs
+# O(window) per anchor and the whole parse stays linear in the text length.
+_DATE = r"\d{1,2}[/-]\d{1,2}[/-]\d{2,4}"
+_RE_DATE = re.compile(_DATE)
+_RE_DASH = re.compile(r"[-–—]")
+_RE_TERM = re.compile(r"Term:?", re.I)
+_RE_POLICY_NUMBER = re.compile(r"Policy\s{0,10}#?:?\s{0,10}([A-Z0-9\-]+)", re.I)
+_RE_PREMIUM = re.compile(r"(?:Full\s{0,10}Term\s{0,10}Premium|Premium):?\s{0,10}\$?([\d,]+\.?\d{0,2})", re.I)
+_RE_INSURED_NAME = re.compile(r"(?:Name|Insured):?\s{0,10}([A-Z][A-Za-z\s,.'-]{0,120}?)(?:\n|Email|Address)", re.I)
+_RE_EMAIL = re.compile(r"Email:?\s{0,10}([a-zA-Z0-9._%+-]{1,64}@[a-zA-Z0-9.-]{1,253}\.[A-Za-z]{2,})", re.I)
+_RE_ADDRESS = re.compile(r"Address:?\s{0,10}(\d+.{0,200}?(?:[A-Z]{2}|Mass|MA)\s{0,5}\d{5})", re.I | re.S)
+
+# Section boundaries, found in a single scan: a vehicle header or the drivers section.
+_RE_BOUNDARY = re.compile(r"(?P<veh>Veh\s{0,10}#?\s{0,10}\d+)|(?P<drv>Drivers?)", re.I)
+_RE_DRIVER = re.compile(r"Driver\s{0,10}#?\s{0,10}(\d+)\s{0,10}([A-Z][A-Za-z\s]{0,80})\s{0,10}(\d{1,2}/\d{1,2}/\d{4})", re.I)
+
+_RE_YMM = re.compile(r"(\d{4})[ ,]*([A-Z]+)[ ,]*([A-Za-z0-9\s/\-]+)")
+_RE_VIN = re.compile(r"([A-HJ-NPR-Z0-9]{17})")
+_RE_VEH_PREMIUM = re.compile(r"Vehicle\s*Premium:?:?\s*\$?([\d,]+\.?\d{0,2})", re.I)
+_RE_BI = re.compile(r"(?:Optional\s*)?bodily\s*injury[:\s]*(\d{1,3})[,\s]*(\d{1,3})", re.I)
+_RE_COLL = re.compile(r"Collision[:\s]*(\d+)", re.I)
+_RE_COMP = re.compile(r"Comprehensive[:\s]*(\d+)", re.I)
+_RE_RENTAL = re.compile(r"(?:Rental|Car\s*Rental|Transportation)[:\s]*\$?(\d+)(?:/day)?(?:\s*for\s*(\d+)\s*days?)?", re.I)
+_RE_ROADSIDE = re.compile(r"(?:Roadside|Emergency\s*Road|Towing)[:\s]*(\$?\d+|Yes|No|Included|Declined)", re.I)
+_RE_UM = re.compile(r"(?:Uninsured|UM)[:\s]*(\d{1,3})[,\s]*(\d{1,3})", re.I)
+
+HEADER_SLACK = 400          # longest bounded header match, so a search near the boundary isn't cut off
+MAX_VEHICLE_BLOCK = 20_000  # a single vehicle section never needs more than this
+MAX_PARSE_CHARS = 2_000_000
+PARSE_TIME_BUDGET_S = 2.0
+
+
+def _find_term(t: str):
+    """
+    Linear equivalent of r"Term:?.*?(DATE).*?[-–—].*?(DATE)" (re.S): only the first
+    "Term" and the first date after it can ever lead to a match, because every later
+    candidate has strictly less text after it.
+    """
+    m = _RE_TERM.search(t)
+    start = _RE_DATE.search(t, m.end()) if m else None
+    dash = _RE_DASH.search(t, start.end()) if start else None
+    end = _RE_DATE.search(t, dash.end()) if dash else None
+    return (start.group(0), end.group(0)) if end else None
+
+
+def _segment(t: str) -> tuple[str, list[str], list[int]]:
+    """
+    One pass over the section boundaries. Returns the header (policy/insured) text,
+    the vehicle blocks, and the offsets where "Driver" sections start. A vehicle
+    block runs from the first ':' on its header line to the next boundary.
+    """
+    bounds = [(m.lastgroup, m.start(), m.end()) for m in _RE_BOUNDARY.finditer(t)]
+    header = t[:bounds[0][1]] if bounds else t
+    vehicles, drivers, pos = [], [], 0
+    for i, (kind, start, end) in enumerate(bounds):
+        if kind == "drv":
+            drivers.append(start)
+        if kind != "veh" or start < pos:
+            continue
+        eol = t.find("\n", end)
+        colon = t.find(":", end, eol if eol != -1 else len(t))
+        if colon == -1:
+            continue
+        block_end = next((b[1] for b in bounds[i + 1:] if b[1] > colon), len(t))
+        vehicles.append(t[colon + 1:min(block_end, colon + 1 + MAX_VEHICLE_BLOCK)])
+        pos = block_end
+    return header, vehicles, drivers
+
+
+def _parse_vehicle(vb: str) -> dict:
+    year_make_model = _RE_YMM.search(vb)
+    vin = _RE_VIN.search(vb)
+    vehicle_premium = _RE_VEH_PREMIUM.search(vb)
+    bi = _RE_BI.search(vb)
+    coll = _RE_COLL.search(vb)
+    comp = _RE_COMP.search(vb)
+    rental = _RE_RENTAL.search(vb)
+    roadside = _RE_ROADSIDE.search(vb)
+    um = _RE_UM.search(vb)
+    return {
+        "year": year_make_model.group(1) if year_make_model else "",
+        "make": year_make_model.group(2) if year_make_model else "",
+        "model": year_make_model.group(3).strip() if year_make_model else "",
+        "vin": vin.group(1) if vin else "",
+        "vehicle_premium": vehicle_premium.group(1) if vehicle_premium else "",
+        "bodily_injury": f"{bi.group(1)}/{bi.group(2)}" if bi else "",
+        "collision_deductible": coll.group(1) if coll else "",
+        "comprehensive_deductible": comp.group(1) if comp else "",
+        "rental_coverage": (f"${rental.group(1)}/day for {rental.group(2) or '30'} days" if rental else ""),
+        "roadside_assistance": roadside.group(1) if roadside else "",
+        "uninsured_motorist": f"{um.group(1)}/{um.group(2)}" if um else "",
+    }
+
+
+def extract_dec_page_data(extracted_text: str, time_budget_s: float = PARSE_TIME_BUDGET_S) -> dict:
+    """
+    Segment the document once (header / vehicle blocks / driver sections), then run
+    precompiled, bounded patterns inside each section. If the time budget runs out the
+    fields found so far are returned with "parse_truncated": True.
+    """
+    deadline = time.monotonic() + time_budget_s
     data = {"policy_info": {}, "insured": {}, "vehicles": [], "drivers": []}
     t = (extracted_text or "")
+    if len(t) > MAX_PARSE_CHARS:
+        logger.warning("dec page text truncated from %d to %d chars", len(t), MAX_PARSE_CHARS)
+        t = t[:MAX_PARSE_CHARS]
+        data["parse_truncated"] = True
+
+    header, vehicle_blocks, driver_starts = _segment(t)
+
+    def field(rx):
+        # Header first (where these fields live); whole text only if nothing starts there.
+        m = rx.search(t, 0, len(header) + HEADER_SLACK)
+        if m and m.start() < len(header):
+            return m
+        return rx.search(t) if len(header) < len(t) else None
 
-    policy_number = re.search(r"Policy\s*#?:?\s*([A-Z0-9\-]+)", t, re.I)
-    policy_term = re.search(r"Term:?.*?(\d{1,2}[/-]\d{1,2}[/-]\d{2,4}).*?[-–—].*?(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})", t, re.I | re.S)
-    premium = re.search(r"(?:Full\s*Term\s*Premium|Premium):?\s*\$?([\d,]+\.?\d{0,2})", t, re.I)
+    policy_number = field(_RE_POLICY_NUMBER)
+    policy_term = _find_term(t)
+    premium = field(_RE_PREMIUM)
 
     if policy_number:
         data["policy_info"]["policy_number"] = policy_number.group(1)
     if policy_term:
-        data["policy_info"]["start_date"] = policy_term.group(1)
-        data["policy_info"]["end_date"] = policy_term.group(2)
+        data["policy_info"]["start_date"] = policy_term[0]
+        data["policy_info"]["end_date"] = policy_term[1]
     if premium:
         data["policy_info"]["full_term_premium"] = premium.group(1)
 
-    insured_name = re.search(r"(?:Name|Insured):?\s*([A-Z][A-Za-z\s,.'-]+?)(?:\n|Email|Address)", t, re.I)
-    email = re.search(r"Email:?\s*([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[A-Za-z]{2,})", t, re.I)
-    address = re.search(r"Address:?[\s\n]*(\d+.*?(?:[A-Z]{2}|Mass|MA)\s*\d{5})", t, re.I | re.S)
+    insured_name = field(_RE_INSURED_NAME)
+    email = field(_RE_EMAIL)
+    address = field(_RE_ADDRESS)
 
     data["insured"]["name"] = insured_name.group(1).strip() if insured_name else ""
     data["insured"]["email"] = email.group(1).strip() if email else ""
     data["insured"]["address"] = address.group(1).strip() if address else ""
 
-    vehicle_blocks = re.findall(r"Veh\s*#?\s*\d+.*?:([\s\S]*?)(?=Veh\s*#?\s*\d+|Drivers?|$)", t, re.I)
     for vb in vehicle_blocks:
-        year_make_model = re.search(r"(\d{4})[ ,]*([A-Z]+)[ ,]*([A-Za-z0-9\s/\-]+)", vb)
-        vin = re.search(r"([A-HJ-NPR-Z0-9]{17})", vb)
-        vehicle_premium = re.search(r"Vehicle\s*Premium:?:?\s*\$?([\d,]+\.?\d{0,2})", vb, re.I)
-        bi = re.search(r"(?:Optional\s*)?bodily\s*injury[:\s]*(\d{1,3})[,\s]*(\d{1,3})", vb, re.I)
-        coll = re.search(r"Collision[:\s]*(\d+)", vb, re.I)
-        comp = re.search(r"Comprehensive[:\s]*(\d+)", vb, re.I)
-        rental = re.search(r"(?:Rental|Car\s*Rental|Transportation)[:\s]*\$?(\d+)(?:/day)?(?:\s*for\s*(\d+)\s*days?)?", vb, re.I)
-        roadside = re.search(r"(?:Roadside|Emergency\s*Road|Towing)[:\s]*(\$?\d+|Yes|No|Included|Declined)", vb, re.I)
-        um = re.search(r"(?:Uninsured|UM)[:\s]*(\d{1,3})[,\s]*(\d{1,3})", vb, re.I)
-
-        data["vehicles"].append({
-            "year": year_make_model.group(1) if year_make_model else "",
-            "make": year_make_model.group(2) if year_make_model else "",
-            "model": year_make_model.group(3).strip() if year_make_model else "",
-            "vin": vin.group(1) if vin else "",
-            "vehicle_premium": vehicle_premium.group(1) if vehicle_premium else "",
-            "bodily_injury": f"{bi.group(1)}/{bi.group(2)}" if bi else "",
-            "collision_deductible": coll.group(1) if coll else "",
-            "comprehensive_deductible": comp.group(1) if comp else "",
-            "rental_coverage": (f"${rental.group(1)}/day for {rental.group(2) or '30'} days" if rental else ""),
-            "roadside_assistance": roadside.group(1) if roadside else "",
-            "uninsured_motorist": f"{um.group(1)}/{um.group(2)}" if um else "",
-        })
-
-    driver_blocks = re.findall(r"Driver\s*#?\s*(\d+)\s*([A-Z][A-Za-z\s]+)\s*(\d{1,2}/\d{1,2}/\d{4})", t, re.I)
-    for db in driver_blocks:
-        data["drivers"].append({"driver_number": db[0], "name": db[1].strip(), "dob": db[2]})
+        if time.monotonic() > deadline:
+            return _out_of_budget(data)
+        data["vehicles"].append(_parse_vehicle(vb))
+
+    pos = 0
+    for start in driver_starts:
+        if start < pos:
+            continue
+        if time.monotonic() > deadline:
+            return _out_of_budget(data)
+        db = _RE_DRIVER.match(t, start)
+        if db:
+            data["drivers"].append({"driver_number": db.group(1), "name": db.group(2).strip(), "dob": db.group(3)})
+            pos = db.end()
+    return data
+
+
+def _out_of_budget(data: dict) -> dict:
+    logger.warning("dec page parse exceeded its time budget; returning partial data")
+    data["parse_truncated"] = True
     return data
 
 
@@ -1,9 +1,211 @@
 from __future__ import annotations
-from typing import List
-from flask import current_app
 
+import hashlib
+import logging
+import re
+import time
+import unicodedata
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List
 
-def embed_texts(texts: List[str]) -> List[list[float]]:
+from flask import current_app, has_app_context
+
+from ..utils import metrics
+from ..utils.cache import TieredCache
+from .openai_http import call_timeout
+
+logger = logging.getLogger(__name__)
+
+EMBED_MODEL = "text-embedding-3-large"
+
+# OpenAI caps a request at 2048 inputs and ~300k tokens; stay well under both by default.
+EMBED_BATCH_SIZE = 256
+EMBED_BATCH_MAX_TOKENS = 100_000
+
+_cache: TieredCache | None = None
+_WS = re.compile(r"\s+")
+
+
+def embedding_cache() -> TieredCache:
+    """Query embeddings keyed by model + normalized text; values are packed float32."""
+    global _cache
+    if _cache is None:
+        cfg = current_app.config
+        _cache = TieredCache("emb", max_items=cfg.get("EMBED_CACHE_MAX_ITEMS", 1024),
+                             ttl_s=cfg.get("EMBED_CACHE_TTL_S", 30 * 24 * 3600))
+    return _cache
+
+
+def normalize_text(text: str) -> str:
+    return _WS.sub(" ", unicodedata.normalize("NFKC", text or "")).strip()
+
+
+def _cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+
+def pack_vector(vec) -> bytes:
+    return array("f", vec).tobytes()
+
+
+def unpack_vector(raw: bytes) -> list[float] | None:
+    if not raw or len(raw) % 4:
+        return None
+    a = array("f")
+    a.frombytes(raw)
+    return a.tolist()
+
+
+def _embed_remote(texts: List[str], model: str, deadline: float | None = None) -> List[list[float]]:
     client = current_app.config["OPENAI_CLIENT"]
-    resp = client.embeddings.create(model="text-embedding-3-large", input=texts)
+    with metrics.timer("embedding_request_seconds", model=model), metrics.stage("embeddings"):
+        resp = client.embeddings.create(model=model, input=texts, timeout=call_timeout("embeddings", deadline))
     return [d.embedding for d in resp.data]
+
+
+def embed_texts(texts: List[str], model: str = EMBED_MODEL, use_cache: bool = True,
+                deadline: float | None = None) -> List[list[float]]:
+    """
+    Embed texts, serving repeats from the embedding cache. Cached and fresh vectors
+    both come back float32-rounded so a hit and a miss give identical results.
+    With a deadline, the embedding request's timeouts are cut to the time left.
+    """
+    norm = [normalize_text(t) for t in texts]
+    if not use_cache:
+        return _embed_remote(norm, model, deadline)
+
+    cache = embedding_cache()
+    keys = [_cache_key(model, t) for t in norm]
+    out = [unpack_vector(raw) for raw in cache.get_many(keys)]
+
+    missing: dict[str, str] = {}
+    for key, text, vec in zip(keys, norm, out):
+        if vec is None:
+            missing.setdefault(key, text)
+    n_miss = sum(v is None for v in out)
+    metrics.inc("embedding_cache_lookups_total", len(keys) - n_miss, result="hit")
+    metrics.inc("embedding_cache_lookups_total", n_miss, result="miss")
+
+    if missing:
+        fresh = dict(zip(missing, (pack_vector(v) for v in _embed_remote(list(missing.values()), model, deadline))))
+        cache.set_many(fresh)
+        out = [vec if vec is not None else unpack_vector(fresh[key]) for key, vec in zip(keys, out)]
+    return out
+
+
+def warm_embedding_cache(queries: Iterable[str], model: str = EMBED_MODEL, batch_size: int = 64) -> dict:
+    """Pre-embed frequent queries. Returns {"queries", "already_cached", "embedded"}."""
+    cache = embedding_cache()
+    uniq = list(dict.fromkeys(q for q in (normalize_text(q) for q in queries) if q))
+    embedded = 0
+    for i in range(0, len(uniq), batch_size):
+        batch = uniq[i:i + batch_size]
+        raws = cache.get_many([_cache_key(model, t) for t in batch])
+        todo = [t for t, raw in zip(batch, raws) if unpack_vector(raw) is None]
+        if todo:
+            vecs = _embed_remote(todo, model)
+            cache.set_many({_cache_key(model, t): pack_vector(v) for t, v in zip(todo, vecs)})
+            embedded += len(todo)
+    logger.info("warmed embedding cache: %d queries, %d embedded", len(uniq), embedded)
+    return {"queries": len(uniq), "already_cached": len(uniq) - embedded, "embedded": embedded}
+
+
+def approx_tokens(text: str) -> int:
+    """Cheap token estimate (~4 chars/token for English) used only for batch sizing."""
+    return len(text) // 4 + 1
+
+
+def _cfg(name: str, default):
+    return current_app.config.get(name, default) if has_app_context() else default
+
+
+def _batches(texts: Iterable[str], batch_size: int, max_tokens: int) -> Iterator[tuple[list[str], int]]:
+    """Split lazily into (batch, approx_tokens) by item count and token budget."""
+    batch, tokens = [], 0
+    for text in texts:
+        t = approx_tokens(text)
+        if batch and (len(batch) >= batch_size or tokens + t > max_tokens):
+            yield batch, tokens
+            batch, tokens = [], 0
+        batch.append(text)
+        tokens += t
+    if batch:
+        yield batch, tokens
+
+
+def _embed_batch(client, batch: list[str], model: str, max_retries: int, backoff_s: float) -> list[list[float]]:
+    for attempt in range(max_retries + 1):
+        try:
+            t0 = time.perf_counter()
+            with metrics.stage("embeddings_bulk"):
+                resp = client.embeddings.create(model=model, input=batch, timeout=call_timeout("embeddings_bulk"))
+            metrics.observe("embedding_request_seconds", time.perf_counter() - t0, model=model)
+            data = sorted(resp.data, key=lambda d: d.index)
+            if len(data) != len(batch):
+                raise ValueError(f"expected {len(batch)} embeddings, got {len(data)}")
+            return [d.embedding for d in data]
+        except Exception as e:
+            if attempt >= max_retries:
+                raise
+            metrics.inc("embedding_batch_retries_total", model=model)
+            delay = backoff_s * (2 ** attempt)
+            logger.warning("embedding batch of %d failed (%s); retry %d/%d in %.1fs",
+                           len(batch), e, attempt + 1, max_retries, delay)
+            time.sleep(delay)
+
+
+def embed_many(texts: Iterable[str], *, model: str = EMBED_MODEL, batch_size: int | None = None,
+               max_batch_tokens: int | None = None, concurrency: int | None = None,
+               max_retries: int | None = None, backoff_s: float = 0.5, client=None,
+               stats: dict | None = None) -> Iterator[list[float]]:
+    """
+    Embed a large (possibly lazy) stream of texts, yielding one vector per input in order.
+
+    Input is split by item count and approximate token budget; up to `concurrency`
+    batches are in flight at once and nothing further is read until the oldest one is
+    yielded, so memory stays bounded. Failed batches are retried with exponential
+    backoff; a batch that still fails raises. Pass `stats={}` to receive
+    texts/tokens/batches, seconds, texts_per_s and tokens_per_s.
+    No caching: this is for bulk indexing, not queries (see embed_texts).
+    """
+    client = client or current_app.config["OPENAI_CLIENT"]
+    batch_size = max(1, batch_size or _cfg("EMBED_BATCH_SIZE", EMBED_BATCH_SIZE))
+    max_batch_tokens = max(1, max_batch_tokens or _cfg("EMBED_BATCH_MAX_TOKENS", EMBED_BATCH_MAX_TOKENS))
+    concurrency = max(1, concurrency or _cfg("EMBED_CONCURRENCY", 4))
+    max_retries = _cfg("EMBED_MAX_RETRIES", 3) if max_retries is None else max_retries
+
+    st = stats if stats is not None else {}
+    st.update(texts=0, tokens=0, batches=0, seconds=0.0, texts_per_s=0.0, tokens_per_s=0.0)
+    t0 = time.perf_counter()
+    inflight: deque = deque()
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed")
+    try:
+        for batch, tokens in _batches((normalize_text(t) for t in texts), batch_size, max_batch_tokens):
+            inflight.append((pool.submit(_embed_batch, client, batch, model, max_retries, backoff_s), len(batch), tokens))
+            if len(inflight) >= concurrency:
+                yield from _drain_one(inflight, st)
+        while inflight:
+            yield from _drain_one(inflight, st)
+    finally:
+        for fut, _, _ in inflight:
+            fut.cancel()
+        pool.shutdown(wait=False, cancel_futures=True)
+        st["seconds"] = round(time.perf_counter() - t0, 3)
+        if st["seconds"]:
+            st["texts_per_s"] = round(st["texts"] / st["seconds"], 1)
+            st["tokens_per_s"] = round(st["tokens"] / st["seconds"], 1)
+        metrics.inc("embedding_texts_total", st["texts"], model=model)
+        metrics.inc("embedding_tokens_total", st["tokens"], model=model)
+        logger.info("embed_many: %d texts in %d batches, %.1fs (%.1f texts/s, %.0f tokens/s)",
+                    st["texts"], st["batches"], st["seconds"], st["texts_per_s"], st["tokens_per_s"])
+
+
+def _drain_one(inflight: deque, st: dict) -> Iterator[list[float]]:
+    fut, n, tokens = inflight.popleft()
+    vecs = fut.result()
+    st["texts"] += n
+    st["tokens"] += tokens
+    st["batches"] += 1
+    yield from vecs
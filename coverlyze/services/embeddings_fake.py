@@ -0,0 +1,151 @@
+"""
+Local stand-in for the OpenAI embeddings endpoint, for testing and benchmarking
+embed_many without network access. Serves POST /v1/embeddings on a loopback port;
+vectors are deterministic per input text. Latency and failures are simulated.
+POST /v1/chat/completions (plain and stream=true) answers with canned text after
+chat_latency_s, for serving benchmarks.
+
+    server = FakeEmbeddingsServer(dim=64, latency_s=0.05, fail_every=7).start()
+    client = OpenAI(base_url=server.base_url, api_key="fake", max_retries=0)
+    ...
+    server.stop()
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def fake_vector(text: str, dim: int) -> list[float]:
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    return [rng.uniform(-1.0, 1.0) for _ in range(dim)]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "_Server"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status: int, body: dict):
+        raw = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def do_POST(self):
+        fake = self.server.fake
+        path = self.path.rstrip("/")
+        if path not in ("/v1/embeddings", "/v1/chat/completions"):
+            return self._reply(404, {"error": {"message": "not found"}})
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        if path == "/v1/chat/completions":
+            return self._chat(fake, body)
+        inputs = body.get("input") or []
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        n = fake._enter(len(inputs))
+        try:
+            time.sleep(fake.latency_s + fake.per_item_s * len(inputs))
+        finally:
+            fake._exit()
+        if fake.fail_every and n % fake.fail_every == 0:
+            return self._reply(500, {"error": {"message": "simulated failure", "type": "server_error"}})
+        tokens = sum(len(t) // 4 + 1 for t in inputs)
+        self._reply(200, {
+            "object": "list",
+            "model": body.get("model", "fake"),
+            "data": [{"object": "embedding", "index": i, "embedding": fake_vector(t, fake.dim)}
+                     for i, t in enumerate(inputs)],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def _chat(self, fake: "FakeEmbeddingsServer", body: dict):
+        fake._enter(0, chat=True)
+        try:
+            time.sleep(fake.chat_latency_s)
+        finally:
+            fake._exit()
+        words = fake.chat_reply.split(" ")
+        prompt = sum(len(str(m.get("content") or "")) // 4 + 1 for m in body.get("messages") or [])
+        usage = {"prompt_tokens": prompt, "completion_tokens": len(words), "total_tokens": prompt + len(words)}
+        base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": body.get("model", "fake")}
+        if not body.get("stream"):
+            return self._reply(200, {**base, "object": "chat.completion", "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": fake.chat_reply}, "finish_reason": "stop"}],
+                "usage": usage})
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for i, w in enumerate(words):
+            delta = {"content": w if i == 0 else f" {w}"}
+            chunk = {**base, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            chunk = {**base, "object": "chat.completion.chunk", "choices": [], "usage": usage}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+    fake: "FakeEmbeddingsServer"
+
+
+class FakeEmbeddingsServer:
+    def __init__(self, dim: int = 64, latency_s: float = 0.05, per_item_s: float = 0.0,
+                 fail_every: int = 0, host: str = "127.0.0.1", port: int = 0,
+                 chat_latency_s: float = 1.0, chat_reply: str = "Massachusetts requires **20/40/5** minimum limits."):
+        self.dim = dim
+        self.chat_latency_s = chat_latency_s
+        self.chat_reply = chat_reply
+        self.latency_s = latency_s
+        self.per_item_s = per_item_s
+        self.fail_every = fail_every  # every Nth embeddings request returns 500 (0 = never)
+        self.requests = 0  # embeddings requests
+        self.chat_requests = 0
+        self.max_batch = 0
+        self.concurrent = 0
+        self.max_concurrent = 0
+        self._lock = threading.Lock()
+        self._httpd = _Server((host, port), _Handler)
+        self._httpd.fake = self
+        self._thread: threading.Thread | None = None
+
+    def _enter(self, n_inputs: int, chat: bool = False) -> int:
+        """Count a request. Chat completions are counted apart so they don't shift fail_every."""
+        with self._lock:
+            if chat:
+                self.chat_requests += 1
+            else:
+                self.requests += 1
+            self.max_batch = max(self.max_batch, n_inputs)
+            self.concurrent += 1
+            self.max_concurrent = max(self.max_concurrent, self.concurrent)
+            return self.requests
+
+    def _exit(self):
+        with self._lock:
+            self.concurrent -= 1
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeEmbeddingsServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-embeddings", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
@@ -0,0 +1,353 @@
+"""
+Offline ingestion of state guideline documents into the Qdrant collection that
+services/rag.search reads. Payload schema per point:
+
+    text, state, source, chunk_index, line, coverages, section, doc_digest
+
+Layout: <root>/<STATE>/<file> or <root>/<STATE>_<name>.<ext> (.txt, .md, .pdf).
+Run with `flask --app wsgi ingest-guidelines <root>`; files whose SHA-256 matches
+the stored doc_digest are skipped, so re-runs only re-embed what changed. The digest
+on chunk 0 is only set once all of a file's chunks are written and its old tail is
+deleted, so a run that fails partway re-ingests that file next time.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import re
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator
+
+from ..utils.state import US_STATES
+from . import sparse
+from .embeddings import EMBED_MODEL, embed_many
+
+logger = logging.getLogger(__name__)
+
+DOC_EXTENSIONS = (".txt", ".md", ".pdf")
+PAYLOAD_INDEX_FIELDS = ("state", "line", "coverages", "section", "source", "doc_digest")
+CHUNK_MAX_CHARS = 1500
+CHUNK_OVERLAP_CHARS = 200
+
+LINE_KEYWORDS = {
+    "umbrella": ("umbrella", "excess liability", "personal liability umbrella"),
+    "home": ("homeowner", "dwelling", "ho-3", "ho3", "ho-5", "condo", "renters"),
+    "auto": ("auto", "vehicle", "motorist", "collision", "driver"),
+}
+COVERAGE_PATTERNS = {
+    "bodily_injury": r"(?i:\bbodily injury\b)|\bBI\b",
+    "property_damage": r"(?i:\bproperty damage\b)|\bPD\b",
+    "uim": r"(?i:\bunderinsured\b)|\bUIM\b",
+    "um": r"(?i:\buninsured\b)|\bUM\b",
+    "pip": r"(?i:\bpersonal injury protection\b)|\bPIP\b",
+    "medpay": r"(?i:\bmedical payments\b|\bmed ?pay\b)",
+    "comprehensive": r"(?i:\bcomprehensive\b|\bother than collision\b)",
+    "collision": r"(?i:\bcollision\b)",
+    "dwelling": r"(?i:\bdwelling\b|\bcoverage a\b)",
+    "personal_liability": r"(?i:\bpersonal liability\b|\bcoverage e\b)",
+}
+SECTION_KEYWORDS = (
+    ("minimum_limits", ("minimum limit", "minimum liability", "financial responsibility", "compulsory")),
+    ("eligibility", ("eligib", "ineligible", "acceptable risk")),
+    ("underwriting", ("underwriting", "inspection", "prior insurance")),
+    ("rating", ("rating", "premium", "surcharge", "discount", "rate ")),
+    ("exclusions", ("exclusion", "excluded", "not covered")),
+    ("definitions", ("definition", " means ")),
+    ("forms", ("endorsement", "form ")),
+    ("claims", ("claim", "loss settlement")),
+)
+
+_COVERAGE_RES = {k: re.compile(p) for k, p in COVERAGE_PATTERNS.items()}
+_STATE_PREFIX = re.compile(r"^([A-Za-z]{2})(?:[_\-\s.]|$)")
+
+
+def file_digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def state_for_path(rel: Path, default: str | None = None) -> str | None:
+    """State from the first directory (MA/...) or a filename prefix (MA_auto.pdf)."""
+    for part in (rel.parts[0] if len(rel.parts) > 1 else None, rel.name):
+        m = _STATE_PREFIX.match(part or "")
+        if m and m.group(1).upper() in US_STATES:
+            return m.group(1).upper()
+    return default.upper() if default else None
+
+
+def iter_guideline_files(root: Path, default_state: str | None = None) -> Iterator[tuple[Path, str, str]]:
+    """Yield (path, source, state); source is the POSIX path relative to root."""
+    for path in sorted(root.rglob("*")):
+        if not path.is_file() or path.suffix.lower() not in DOC_EXTENSIONS:
+            continue
+        rel = path.relative_to(root)
+        state = state_for_path(rel, default_state)
+        if not state:
+            logger.warning("skipping %s: no state in path and no --state given", rel)
+            continue
+        yield path, rel.as_posix(), state
+
+
+def read_document(path: Path) -> str:
+    if path.suffix.lower() == ".pdf":
+        import pdfplumber
+        with pdfplumber.open(str(path)) as pdf:
+            return "\n\n".join(p.extract_text() or "" for p in pdf.pages)
+    return path.read_text(encoding="utf-8", errors="replace")
+
+
+def chunk_text(text: str, max_chars: int = CHUNK_MAX_CHARS, overlap: int = CHUNK_OVERLAP_CHARS) -> list[str]:
+    """
+    Paragraph-packed chunks of up to max_chars. Oversized paragraphs are split on
+    sentence/word boundaries; consecutive chunks share up to `overlap` trailing chars
+    unless the next chunk starts with a carried-over heading.
+    """
+    paras = [re.sub(r"[ \t]+", " ", p).strip() for p in re.split(r"\n\s*\n", text or "")]
+    pieces: list[str] = []
+    for p in filter(None, paras):
+        while len(p) > max_chars:
+            cut = max(p.rfind(". ", 0, max_chars), p.rfind(" ", 0, max_chars))
+            cut = cut + 1 if cut > max_chars // 2 else max_chars
+            pieces.append(p[:cut].strip())
+            p = p[cut:].strip()
+        if p:
+            pieces.append(p)
+
+    chunks: list[str] = []
+    cur: list[str] = []
+    size = 0
+    for piece in pieces:
+        if cur and size + 2 + len(piece) > max_chars:
+            # a short trailing paragraph is usually a heading; start the next chunk with it
+            carry = [cur.pop()] if len(cur) > 1 and len(cur[-1]) < 100 else []
+            chunks.append("\n\n".join(cur))
+            tail = chunks[-1][-overlap:] if overlap and not carry else ""
+            tail = tail[tail.find(" ") + 1:] if " " in tail else tail
+            cur = carry or ([tail] if tail and len(tail) + 2 + len(piece) <= max_chars else [])
+            size = sum(len(c) + 2 for c in cur)
+        cur.append(piece)
+        size += len(piece) + 2
+    if cur:
+        chunks.append("\n\n".join(cur))
+    return chunks
+
+
+def detect_line(text: str, default: str | None = None) -> str | None:
+    t = text.lower()
+    counts = {line: sum(t.count(k) for k in kws) for line, kws in LINE_KEYWORDS.items()}
+    best = max(counts, key=counts.get)
+    return best if counts[best] else default
+
+
+def detect_coverages(text: str) -> list[str]:
+    return [name for name, rx in _COVERAGE_RES.items() if rx.search(text)]
+
+
+def detect_section(text: str) -> str:
+    t = text[:400].lower()
+    for section, kws in SECTION_KEYWORDS:
+        if any(k in t for k in kws):
+            return section
+    return "general"
+
+
+def document_chunks(path: Path, source: str, state: str, digest: str) -> list[dict]:
+    text = read_document(path)
+    file_line = detect_line(source.replace("_", " ").replace("-", " "))
+    out = []
+    for i, chunk in enumerate(chunk_text(text)):
+        out.append({
+            "text": chunk,
+            "state": state,
+            "source": source,
+            "chunk_index": i,
+            "line": file_line or detect_line(chunk),
+            "coverages": detect_coverages(chunk),
+            "section": detect_section(chunk),
+            "doc_digest": digest,
+        })
+    return out
+
+
+def point_id(source: str, chunk_index: int) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"guideline:{source}#{chunk_index}"))
+
+
+def ensure_collection(qc, collection: str, dim: int) -> bool:
+    """Create the collection (dense + bm25 sparse) if missing. Returns whether it has the sparse vector."""
+    from qdrant_client.models import Distance, SparseVectorParams, VectorParams
+    sparse_cfg = {sparse.SPARSE_VECTOR_NAME: SparseVectorParams()}
+    try:
+        info = qc.get_collection(collection)
+    except Exception:
+        qc.create_collection(collection_name=collection,
+                             vectors_config=VectorParams(size=dim, distance=Distance.COSINE),
+                             sparse_vectors_config=sparse_cfg)
+        logger.info("created collection %s (dim=%d)", collection, dim)
+        info = None
+    has_sparse = info is None or sparse.SPARSE_VECTOR_NAME in (info.config.params.sparse_vectors or {})
+    if not has_sparse:
+        try:
+            qc.update_collection(collection_name=collection, sparse_vectors_config=sparse_cfg)
+            has_sparse = True
+            logger.info("added %s sparse vector to %s; re-ingest with --force to fill it",
+                        sparse.SPARSE_VECTOR_NAME, collection)
+        except Exception as e:
+            logger.warning("cannot add sparse vector to %s (%s); ingesting dense only", collection, e)
+    ensure_payload_indexes(qc, collection)
+    return has_sparse
+
+
+def ensure_payload_indexes(qc, collection: str):
+    from qdrant_client.models import PayloadSchemaType
+    for field in PAYLOAD_INDEX_FIELDS:
+        try:
+            qc.create_payload_index(collection_name=collection, field_name=field,
+                                    field_schema=PayloadSchemaType.KEYWORD)
+        except Exception as e:
+            logger.debug("payload index %s.%s: %s", collection, field, e)
+    try:
+        qc.create_payload_index(collection_name=collection, field_name="chunk_index",
+                                field_schema=PayloadSchemaType.INTEGER)
+    except Exception as e:
+        logger.debug("payload index %s.chunk_index: %s", collection, e)
+
+
+def stored_digests(qc, collection: str) -> dict[str, str]:
+    """{source: doc_digest} from each document's first chunk; empty if no collection."""
+    from qdrant_client.models import FieldCondition, Filter, MatchValue
+    try:
+        qc.get_collection(collection)
+    except Exception:
+        return {}
+    flt = Filter(must=[FieldCondition(key="chunk_index", match=MatchValue(value=0))])
+    out, offset = {}, None
+    while True:
+        points, offset = qc.scroll(collection_name=collection, scroll_filter=flt, limit=512, offset=offset,
+                                   with_payload=["source", "doc_digest"], with_vectors=False)
+        for p in points:
+            payload = p.payload or {}
+            if payload.get("source"):
+                out[payload["source"]] = payload.get("doc_digest")
+        if offset is None:
+            return out
+
+
+def _delete_source_chunks(qc, collection: str, source: str, from_index: int = 0):
+    from qdrant_client.models import FieldCondition, Filter, FilterSelector, MatchValue, Range
+    must = [FieldCondition(key="source", match=MatchValue(value=source))]
+    if from_index:
+        must.append(FieldCondition(key="chunk_index", range=Range(gte=from_index)))
+    qc.delete(collection_name=collection, points_selector=FilterSelector(filter=Filter(must=must)))
+
+
+def ingest_directory(root, *, qc, collection: str, openai_client=None, default_state: str | None = None,
+                     force: bool = False, prune: bool = False, model: str = EMBED_MODEL,
+                     upsert_batch: int = 128, upsert_concurrency: int = 4, embed_opts: dict | None = None) -> dict:
+    """
+    Chunk, tag, embed and upsert every changed document under root, streaming one
+    document at a time through embed_many so memory stays flat. Point ids are
+    derived from (source, chunk_index), so re-ingesting a file overwrites its points;
+    chunks past the new end are deleted afterwards. With prune, documents that no
+    longer exist under root are removed; a stored document that now yields no text is
+    always removed. BM25 corpus stats are rebuilt whenever the
+    collection changed. Returns counts and timings.
+    """
+    from qdrant_client.models import PointStruct, SparseVector
+
+    t0 = time.perf_counter()
+    root = Path(root)
+    stored = stored_digests(qc, collection)
+    stats = {"files": 0, "unchanged": 0, "ingested": 0, "emptied": 0, "chunks": 0, "pruned": 0}
+    seen: set[str] = set()
+    todo: list[tuple[Path, str, str, str]] = []
+    for path, source, state in iter_guideline_files(root, default_state):
+        stats["files"] += 1
+        seen.add(source)
+        digest = file_digest(path)
+        if not force and stored.get(source) == digest:
+            stats["unchanged"] += 1
+            continue
+        todo.append((path, source, state, digest))
+
+    pending: deque = deque()  # chunks handed to embed_many whose vectors haven't come back yet
+    n_by_source: dict[str, tuple[int, str]] = {}
+
+    def chunk_texts() -> Iterator[str]:
+        """Read changed files one at a time, so memory holds one document plus the chunks in flight."""
+        for path, source, state, digest in todo:
+            doc = document_chunks(path, source, state, digest)
+            if not doc:
+                logger.warning("no text extracted from %s", source)
+                if source in stored:  # its old chunks would keep being retrieved
+                    _delete_source_chunks(qc, collection, source)
+                    stats["emptied"] += 1
+                continue
+            stats["ingested"] += 1
+            n_by_source[source] = (len(doc), digest)
+            for c in doc:
+                pending.append(c)
+                yield c["text"]
+
+    embed_stats: dict = {}
+    ready = has_sparse = False
+    if todo:
+        # A first build has no stored BM25 stats: take avgdl from a chunking-only pass over the files.
+        avgdl = (sparse.load_stats(qc, collection, None) or sparse.corpus_stats(
+            c["text"] for path, source, state, digest in todo
+            for c in document_chunks(path, source, state, digest)))["avgdl"]
+        inflight: deque = deque()
+        batch: list = []
+        with ThreadPoolExecutor(max_workers=max(1, upsert_concurrency), thread_name_prefix="qdrant-upsert") as pool:
+            vectors = embed_many(chunk_texts(), model=model, client=openai_client,
+                                 stats=embed_stats, **(embed_opts or {}))
+            for vec in vectors:
+                c = pending.popleft()
+                if not ready:
+                    has_sparse = ensure_collection(qc, collection, len(vec))
+                    ready = True
+                vector = vec
+                if has_sparse:
+                    indices, values = sparse.doc_vector(c["text"], avgdl)
+                    vector = {"": vec, sparse.SPARSE_VECTOR_NAME: SparseVector(indices=indices, values=values)}
+                # chunk 0's digest marks the file done; set below once the whole file is written
+                payload = {**c, "doc_digest": None} if c["chunk_index"] == 0 else c
+                batch.append(PointStruct(id=point_id(c["source"], c["chunk_index"]), vector=vector, payload=payload))
+                stats["chunks"] += 1
+                if len(batch) >= upsert_batch:
+                    inflight.append(pool.submit(qc.upsert, collection_name=collection, points=batch, wait=True))
+                    batch = []
+                    if len(inflight) >= upsert_concurrency:
+                        inflight.popleft().result()
+            if batch:
+                inflight.append(pool.submit(qc.upsert, collection_name=collection, points=batch, wait=True))
+            for fut in inflight:
+                fut.result()
+
+        for source, (n, digest) in n_by_source.items():
+            if source in stored:
+                _delete_source_chunks(qc, collection, source, from_index=n)
+            qc.set_payload(collection_name=collection, payload={"doc_digest": digest},
+                           points=[point_id(source, 0)], wait=True)
+    if not ready and stored:
+        ensure_payload_indexes(qc, collection)
+
+    if prune:
+        for source in set(stored) - seen:
+            _delete_source_chunks(qc, collection, source)
+            stats["pruned"] += 1
+
+    if stats["ingested"] or stats["emptied"] or stats["pruned"] or (stored and not sparse.load_stats(qc, collection, None)):
+        sparse.rebuild_stats(qc, collection)
+
+    stats["seconds"] = round(time.perf_counter() - t0, 2)
+    stats["embed"] = embed_stats if stats["chunks"] else {}
+    logger.info("ingested %s into %s", stats, collection)
+    return stats
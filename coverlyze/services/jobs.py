@@ -0,0 +1,304 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+from typing import Callable, Optional
+
+from flask import current_app
+from redis.exceptions import WatchError
+
+from ..utils import profiling
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("done", "error")
+
+
+def _now() -> float:
+    return round(time.time(), 3)
+
+
+class RedisJobQueue:
+    """
+    Job queue + job store in Redis.
+      jobs:queue              list of pending job ids (LPUSH / BLMOVE)
+      jobs:processing:<w>     ids worker <w> has taken and not yet acked
+      jobs:alive:<w>          worker heartbeat (expires if the worker dies)
+      jobs:workers            ids of workers that may hold a processing list
+      job:<id>                JSON status record
+      job:<id>:events         list of JSON stage events (RPUSH, read with LRANGE from an offset)
+      job:<id>:blob           raw input bytes
+    A job taken by a worker that dies (crash, deploy kill) stays in its processing list;
+    requeue_orphans() puts it back once the worker's heartbeat has lapsed.
+    """
+
+    queue_key = "jobs:queue"
+    workers_key = "jobs:workers"
+
+    def __init__(self, redis, ttl_s: int = 24 * 3600, heartbeat_s: float = 10.0):
+        self.redis = redis
+        self.ttl_s = int(ttl_s)
+        self.heartbeat_s = heartbeat_s
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    def _processing_key(self, worker_id: str | None = None) -> str:
+        return f"jobs:processing:{worker_id or self.worker_id}"
+
+    def enqueue(self, kind: str, blob: bytes, **meta) -> str:
+        job_id = uuid.uuid4().hex
+        record = {"id": job_id, "kind": kind, "status": "queued", "stage": None, "error": None,
+                  "result": None, "created_at": _now(), "updated_at": _now(), **meta}
+        pipe = self.redis.pipeline()
+        pipe.setex(f"job:{job_id}", self.ttl_s, json.dumps(record))
+        pipe.setex(f"job:{job_id}:blob", self.ttl_s, blob)
+        pipe.lpush(self.queue_key, job_id)
+        pipe.execute()
+        self.emit(job_id, {"stage": "queued"})
+        return job_id
+
+    def dequeue(self, timeout_s: int = 5) -> Optional[str]:
+        """Move the oldest job into this worker's processing list; ack() it when finished."""
+        job_id = self.redis.blmove(self.queue_key, self._processing_key(), timeout_s, "RIGHT", "LEFT")
+        if not job_id:
+            return None
+        return job_id.decode("utf-8") if isinstance(job_id, bytes) else job_id
+
+    def ack(self, job_id: str):
+        self.redis.lrem(self._processing_key(), 1, job_id)
+
+    def heartbeat(self):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.setex(f"jobs:alive:{self.worker_id}", max(1, int(3 * self.heartbeat_s)), 1)
+        pipe.sadd(self.workers_key, self.worker_id)
+        pipe.execute()
+
+    def start_heartbeat(self, stopping: threading.Event) -> threading.Thread:
+        def run():
+            while not stopping.wait(self.heartbeat_s):
+                try:
+                    self.heartbeat()
+                except Exception as e:
+                    logger.warning("job worker heartbeat failed: %s", e)
+
+        self.heartbeat()
+        t = threading.Thread(target=run, name="job-heartbeat", daemon=True)
+        t.start()
+        return t
+
+    def retire(self):
+        """Clean shutdown: nothing in hand, so drop this worker's heartbeat and registration."""
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.delete(f"jobs:alive:{self.worker_id}")
+        pipe.srem(self.workers_key, self.worker_id)
+        pipe.execute()
+
+    def requeue_orphans(self) -> int:
+        """Put jobs held by workers whose heartbeat lapsed back at the head of the queue."""
+        moved = 0
+        for raw in self.redis.smembers(self.workers_key):
+            worker_id = raw.decode("utf-8") if isinstance(raw, bytes) else raw
+            if worker_id == self.worker_id or self.redis.exists(f"jobs:alive:{worker_id}"):
+                continue
+            while True:
+                job_id = self.redis.lmove(self._processing_key(worker_id), self.queue_key, "RIGHT", "RIGHT")
+                if job_id is None:
+                    break
+                job_id = job_id.decode("utf-8") if isinstance(job_id, bytes) else job_id
+                logger.warning("requeued job %s from dead worker %s", job_id, worker_id)
+                self.update(job_id, status="queued", stage="requeued")
+                self.emit(job_id, {"stage": "requeued"})
+                moved += 1
+            self.redis.srem(self.workers_key, worker_id)
+        return moved
+
+    def get(self, job_id: str) -> Optional[dict]:
+        raw = self.redis.get(f"job:{job_id}")
+        return json.loads(raw) if raw else None
+
+    def get_blob(self, job_id: str) -> Optional[bytes]:
+        return self.redis.get(f"job:{job_id}:blob")
+
+    def update(self, job_id: str, **fields) -> dict:
+        """Merge fields into the record; WATCH makes concurrent updates (worker, web) retry, not overwrite."""
+        key = f"job:{job_id}"
+        with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    raw = pipe.get(key)
+                    record = json.loads(raw) if raw else {"id": job_id}
+                    record.update(fields, updated_at=_now())
+                    pipe.multi()
+                    pipe.setex(key, self.ttl_s, json.dumps(record))
+                    if record.get("status") in TERMINAL_STATUSES:
+                        pipe.delete(f"job:{job_id}:blob")
+                    pipe.execute()
+                    return record
+                except WatchError:
+                    continue
+
+    def emit(self, job_id: str, event: dict):
+        key = f"job:{job_id}:events"
+        pipe = self.redis.pipeline()
+        pipe.rpush(key, json.dumps({**event, "ts": _now()}))
+        pipe.expire(key, self.ttl_s)
+        pipe.execute()
+
+    def events(self, job_id: str, since: int = 0, wait_s: float = 0.0) -> list[dict]:
+        deadline = time.monotonic() + wait_s
+        while True:
+            raw = self.redis.lrange(f"job:{job_id}:events", since, -1)
+            if raw or time.monotonic() >= deadline:
+                return [json.loads(r) for r in raw]
+            time.sleep(0.25)
+
+
+class LocalJobQueue:
+    """
+    In-process stand-in for RedisJobQueue (tests, local dev without Redis).
+    Jobs are run by daemon threads inside the web process.
+    """
+
+    def __init__(self, app=None, workers: int = 2):
+        self.app = app
+        self.workers = workers
+        self._q: queue.Queue[str] = queue.Queue()
+        self._records: dict[str, dict] = {}
+        self._blobs: dict[str, bytes] = {}
+        self._events: dict[str, list[dict]] = {}
+        self._cond = threading.Condition()
+        self._threads: list[threading.Thread] = []
+
+    def _ensure_workers(self):
+        if self.app is None or self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"local-job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                job_id = self._q.get()
+                process_job(self, job_id)
+
+    def enqueue(self, kind: str, blob: bytes, **meta) -> str:
+        job_id = uuid.uuid4().hex
+        with self._cond:
+            self._records[job_id] = {"id": job_id, "kind": kind, "status": "queued", "stage": None,
+                                     "error": None, "result": None, "created_at": _now(),
+                                     "updated_at": _now(), **meta}
+            self._blobs[job_id] = blob
+        self.emit(job_id, {"stage": "queued"})
+        self._q.put(job_id)
+        self._ensure_workers()
+        return job_id
+
+    def dequeue(self, timeout_s: int = 5) -> Optional[str]:
+        try:
+            return self._q.get(timeout=timeout_s)
+        except queue.Empty:
+            return None
+
+    def ack(self, job_id: str):
+        pass
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._cond:
+            rec = self._records.get(job_id)
+            return dict(rec) if rec else None
+
+    def get_blob(self, job_id: str) -> Optional[bytes]:
+        return self._blobs.get(job_id)
+
+    def update(self, job_id: str, **fields) -> dict:
+        with self._cond:
+            rec = self._records.setdefault(job_id, {"id": job_id})
+            rec.update(fields, updated_at=_now())
+            if rec.get("status") in TERMINAL_STATUSES:
+                self._blobs.pop(job_id, None)
+            return dict(rec)
+
+    def emit(self, job_id: str, event: dict):
+        with self._cond:
+            self._events.setdefault(job_id, []).append({**event, "ts": _now()})
+            self._cond.notify_all()
+
+    def events(self, job_id: str, since: int = 0, wait_s: float = 0.0) -> list[dict]:
+        with self._cond:
+            if len(self._events.get(job_id, [])) <= since and wait_s:
+                self._cond.wait(timeout=wait_s)
+            return list(self._events.get(job_id, [])[since:])
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def job_queue():
+    """Process-wide queue; JOB_QUEUE_BACKEND picks Redis (default) or the in-process stand-in."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            cfg = current_app.config
+            if cfg.get("JOB_QUEUE_BACKEND", "redis") == "local":
+                _queue = LocalJobQueue(current_app._get_current_object(), workers=cfg.get("JOB_LOCAL_WORKERS", 2))
+            else:
+                _queue = RedisJobQueue(cfg["SESSION_REDIS"], ttl_s=cfg.get("JOB_TTL_S", 24 * 3600),
+                                       heartbeat_s=cfg.get("JOB_HEARTBEAT_S", 10))
+    return _queue
+
+
+def _pipelines() -> dict[str, Callable]:
+    from .upload_pipeline import run_upload_pipeline
+    return {"upload": run_upload_pipeline}
+
+
+def process_job(q, job_id: str):
+    """Run one job to completion, publishing each stage as an event."""
+    record = q.get(job_id)
+    blob = q.get_blob(job_id)
+    if not record or blob is None:
+        logger.warning("job %s vanished before it could run", job_id)
+        return
+    pipeline = _pipelines().get(record.get("kind"))
+    if pipeline is None:
+        q.update(job_id, status="error", error=f"unknown job kind {record.get('kind')!r}")
+        q.emit(job_id, {"stage": "error", "error": "unknown job kind"})
+        return
+
+    attempts = record.get("attempts", 0) + 1
+    max_attempts = current_app.config.get("JOB_MAX_ATTEMPTS", 2)
+    if attempts > max_attempts:
+        # taken by workers that died every time: likely the input itself kills the worker
+        error = f"gave up after {max_attempts} attempts"
+        q.update(job_id, status="error", error=error)
+        q.emit(job_id, {"stage": "error", "error": error})
+        return
+
+    def emit(stage: str, **data):
+        q.update(job_id, status="running", stage=stage)
+        q.emit(job_id, {"stage": stage, **data})
+
+    started = time.monotonic()
+    try:
+        # a profiled /upload passes its mode on, so the profile covers the work done here
+        with profiling.traced(f"job {record.get('kind')}", mode=record.get("profile")) as run:
+            q.update(job_id, status="running", started_at=_now(), attempts=attempts,
+                     **({"profile_id": run.profile_id} if run.profile_id else {}))
+            result = pipeline(blob, emit)
+    except Exception as e:
+        logger.exception("job %s failed", job_id)
+        q.update(job_id, status="error", error=str(e))
+        q.emit(job_id, {"stage": "error", "error": str(e)})
+        return
+    elapsed = round(time.monotonic() - started, 3)
+    q.update(job_id, status="done", stage="done", result=result, elapsed_s=elapsed)
+    q.emit(job_id, {"stage": "done", "elapsed_s": elapsed})
@@ -1,8 +1,18 @@
 from __future__ import annotations
 
-import json
+import re
+import time
+
 from flask import current_app
 
+from ..utils import metrics
+from ..utils.tokens import count_tokens
+from .llm_router import complete
+from .memory import memory_text
+from .prompt_packer import compact_json, dedupe_chunks, pack_sections, rank_chunks
+
+PROMPT_TOKEN_BUCKETS = (500, 1000, 2000, 3000, 4000, 6000, 8000, 12000, 16000)
+
 AGENT_INSTRUCTION_PROMPT = r"""
 CRITICAL FORMATTING RULE: Always use HTML tags for emphasis in your responses:
 - Use <strong>text</strong> for bold (NEVER use **text**)
@@ -26,18 +36,56 @@ def with_instruction(*sections: str) -> str:
 
 
 def convert_markdown_to_html(text: str) -> str:
-    import re
     text = re.sub(r'\*\*(.*?)\*\*', r'<strong>\1</strong>', text or "")
     text = re.sub(r'(?<!\*)\*([^*]+?)\*(?!\*)', r'<em>\1</em>', text)
     return text
 
 
+_MD_EMPHASIS = re.compile(r'\*\*(.*?)\*\*|(?<!\*)\*([^*]+?)\*(?!\*)')
+
+
+class MarkdownStreamConverter:
+    """
+    Applies convert_markdown_to_html to a token stream. Text is released only up to
+    the first '*' whose emphasis span hasn't closed yet, so a marker is never split
+    across two emitted chunks. A stray '*' is released as a literal once more than
+    `max_hold` characters are waiting behind it.
+    """
+
+    def __init__(self, max_hold: int = 400):
+        self.max_hold = max_hold
+        self._buf = ""
+
+    def _safe_cut(self) -> int:
+        buf, pos = self._buf, 0
+        for m in _MD_EMPHASIS.finditer(buf):
+            stray = buf.find("*", pos, m.start())
+            if stray != -1:
+                return stray
+            if m.end() == len(buf):  # a following '*' could still change the match
+                return m.start()
+            pos = m.end()
+        stray = buf.find("*", pos)
+        return len(buf) if stray == -1 else stray
+
+    def feed(self, delta: str) -> str:
+        self._buf += delta or ""
+        cut = self._safe_cut()
+        if len(self._buf) - cut > self.max_hold:
+            cut += 1
+        out, self._buf = self._buf[:cut], self._buf[cut:]
+        return convert_markdown_to_html(out) if out else ""
+
+    def flush(self) -> str:
+        out, self._buf = self._buf, ""
+        return convert_markdown_to_html(out) if out else ""
+
+
 def llm_phrase(system_instructions: str, user_prompt: str) -> str:
-    client = current_app.config["OPENAI_CLIENT"]
     try:
-        resp = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
+        resp = complete(
+            "phrasing",
+            [
                 {"role": "system", "content": with_instruction(PHRASING_SYSTEM_BASE, system_instructions)},
                 {"role": "user", "content": user_prompt},
             ],
@@ -49,9 +97,26 @@ def llm_phrase(system_instructions: str, user_prompt: str) -> str:
         return user_prompt
 
 
+def summarize_dec_page(extracted_text: str) -> str:
+    messages = [
+        {"role": "system", "content": with_instruction("You are a professional insurance agent.",
+                                                       "Output valid HTML with a Coverage Analysis table.")},
+        {"role": "user", "content": f"Analyze this declarations page and provide recommendations in HTML:\n\n{extracted_text}"}
+    ]
+    try:
+        resp = complete("dec_summary", messages, max_tokens=1200, temperature=0.6)
+        return resp.choices[0].message.content
+    except Exception as e:
+        return f"<p><em>Summary unavailable:</em> {e}</p>"
+
+
 def build_messages(user_message, session_obj, user_profile, retrieved_context, flow_state,
                    allow_pretraining_fallback: bool = False, state_norm: str | None = None,
-                   target_cov: str | None = None):
+                   target_cov: str | None = None, stats: dict | None = None):
+    """
+    System + context + user messages for a chat turn. Context sections are packed into
+    PROMPT_TOKEN_BUDGET by prompt_packer; pass `stats={}` for per-section token counts.
+    """
     system_base = with_instruction(
         "You are Polly, a helpful insurance assistant.",
         "Use light HTML (<h4>, <ul><li>, <table>, <strong>, <em>).",
@@ -82,25 +147,45 @@ def build_messages(user_message, session_obj, user_profile, retrieved_context, f
         )
 
     profile_block = (
-        f"USER PROFILE:\n"
         f"- Name: {user_profile.get('name','')}\n"
         f"- State: {user_profile.get('state','')}\n"
         f"- Home owned: {user_profile.get('home_owned')}\n"
         f"- Asset band: {user_profile.get('asset_band')}\n"
-        f"- Tone: {user_profile.get('preferred_tone','')}\n"
+        f"- Tone: {user_profile.get('preferred_tone','')}"
     )
-
-    doc_block = "DECLARATIONS CONTEXT (if present):\n" + f"- Structured: {json.dumps(session_obj.get('extracted_data', {}))[:2000]}\n"
-
-    rag_block = "RETRIEVED GUIDELINES (authoritative):\n" + "\n".join([f"- {c[:300]}" for c in (retrieved_context or [])]) if retrieved_context else "RETRIEVED GUIDELINES: <none>"
-
-    messages = [
+    fixed = [
         {"role": "system", "content": system_base + "\n" + grounding_rules},
         {"role": "system", "content": "BEHAVIOR RULES:\n1) One question per turn.\n2) Stay in active flow if any.\n3) Use specific policy details when advising.\n4) If unsure, ask a short clarifying question."},
-        {"role": "system", "content": profile_block},
-        {"role": "system", "content": doc_block},
-        {"role": "system", "content": rag_block},
-        {"role": "system", "content": f"RUNNING SUMMARY:\n{(session_obj.get('running_summary','') or '')[:2000]}"},
+    ]
+
+    t0 = time.perf_counter()
+    chunks, deduped = dedupe_chunks(rank_chunks(list(retrieved_context or []), user_message))
+    budget = current_app.config.get("PROMPT_TOKEN_BUDGET", 6000)
+    headers = ("USER PROFILE:", "DECLARATIONS CONTEXT (if present):\n- Structured:",
+               "RETRIEVED GUIDELINES (authoritative):", "CONVERSATION MEMORY:")
+    fixed_tokens = sum(count_tokens(t) + 1 for t in (*(m["content"] for m in fixed), *headers, user_message))
+    packed, pack_stats = pack_sections({
+        "profile": {"text": profile_block},
+        "rag": {"items": chunks},
+        "declarations": {"text": compact_json(session_obj.get("extracted_data") or {})},
+        "memory": {"text": memory_text(session_obj), "keep": "tail"},  # recent turns sit at the end
+    }, budget - fixed_tokens)
+
+    messages = fixed + [
+        {"role": "system", "content": f"USER PROFILE:\n{packed['profile']}"},
+        {"role": "system", "content": f"DECLARATIONS CONTEXT (if present):\n- Structured: {packed['declarations'] or '{}'}"},
+        {"role": "system", "content": (f"RETRIEVED GUIDELINES (authoritative):\n{packed['rag']}"
+                                       if packed["rag"] else "RETRIEVED GUIDELINES: <none>")},
+        {"role": "system", "content": f"CONVERSATION MEMORY:\n{packed['memory'] or '<none>'}"},
         {"role": "user", "content": user_message},
     ]
+
+    prompt_tokens = sum(count_tokens(m["content"]) for m in messages)
+    metrics.observe("prompt_pack_seconds", time.perf_counter() - t0)
+    metrics.observe("prompt_tokens", prompt_tokens, buckets=PROMPT_TOKEN_BUCKETS)
+    metrics.inc("prompt_chunks_deduped_total", deduped)
+    for name, n in pack_stats["used"].items():
+        metrics.inc("prompt_section_tokens_total", n, section=name)
+    if stats is not None:
+        stats.update(pack_stats, prompt_tokens=prompt_tokens, chunks_deduped=deduped)
     return messages
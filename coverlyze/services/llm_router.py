@@ -0,0 +1,180 @@
+"""
+Model routing for chat completions.
+
+Every LLM call names a route (its call site / request class) and `complete` picks the
+model from the policy: DEFAULT_ROUTES, overridden by LLM_ROUTES ("route=model,..."). If
+the caller passes a deadline and fewer than LLM_FALLBACK_MIN_S seconds are left, the
+call goes to LLM_FAST_MODEL instead; with any deadline, the call's timeouts and
+max_tokens are fitted to the time left. Without one, each route gets its own read
+timeout (openai_http.call_timeout). Latency, tokens and estimated cost are recorded per
+route and model; `route_stats()` summarizes them for /debug_llm.
+"""
+from __future__ import annotations
+
+import re
+import time
+
+from flask import current_app
+
+from ..utils import metrics
+from ..utils.deadline import DeadlineExceeded, remaining
+from .openai_http import call_timeout
+
+DEFAULT_ROUTES = {
+    "chat": "gpt-4o",              # grounded RAG answers
+    "chat_simple": "gpt-4o-mini",  # greetings and thanks
+    "dec_summary": "gpt-4o",
+    "phrasing": "gpt-4o-mini",
+    "memory": "gpt-4o-mini",
+}
+
+# USD per 1M tokens (input, output); models not listed are recorded without cost
+PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+}
+
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+# Greetings and thanks only: "yes"/"ok"/"sounds good" often answer a question Polly just asked
+# ("Want me to compare your BI limits to the state minimum?") and need the grounded model.
+_SIMPLE_TURN = re.compile(
+    r"^(hi|hello|hey|good (morning|afternoon|evening)|thanks|thank you|thx|ty)"
+    r"( so much| very much)?( polly)?[\s!.]*$", re.I)
+
+
+def parse_routes(spec: str | None) -> dict[str, str]:
+    """'chat=gpt-4o,phrasing=gpt-4o-mini' -> {"chat": "gpt-4o", "phrasing": "gpt-4o-mini"}"""
+    out = {}
+    for part in (spec or "").split(","):
+        if "=" in part:
+            route, model = part.split("=", 1)
+            if route.strip() and model.strip():
+                out[route.strip()] = model.strip()
+    return out
+
+
+def chat_route(user_message: str) -> str:
+    """Request class of a chat turn: small talk goes to chat_simple, everything else to chat."""
+    return "chat_simple" if _SIMPLE_TURN.match((user_message or "").strip()) else "chat"
+
+
+def pick_model(route: str, deadline: float | None = None) -> str:
+    cfg = current_app.config
+    model = {**DEFAULT_ROUTES, **parse_routes(cfg.get("LLM_ROUTES"))}.get(route) or DEFAULT_ROUTES["chat"]
+    min_left = cfg.get("LLM_FALLBACK_MIN_S", 0)
+    fast = cfg.get("LLM_FAST_MODEL", "gpt-4o-mini")
+    if deadline is not None and min_left and model != fast and remaining(deadline) < min_left:
+        metrics.inc("llm_route_fallbacks_total", route=route, model=fast)
+        return fast
+    return model
+
+
+def _record(route: str, model: str, seconds: float, usage, error: Exception | None = None):
+    metrics.inc("llm_requests_total", route=route, model=model, result="error" if error else "ok")
+    metrics.observe("llm_request_seconds", seconds, route=route, model=model)
+    metrics.observe("stage_seconds", seconds, stage="llm")
+    metrics.trace_stage("llm", seconds)
+    if error is not None:
+        metrics.inc("stage_errors_total", stage="llm", error=type(error).__name__)
+    if usage is None:
+        return
+    prompt = getattr(usage, "prompt_tokens", 0) or 0
+    completion = getattr(usage, "completion_tokens", 0) or 0
+    metrics.observe("llm_call_tokens", prompt, buckets=TOKEN_BUCKETS, route=route, kind="prompt")
+    metrics.observe("llm_call_tokens", completion, buckets=TOKEN_BUCKETS, route=route, kind="completion")
+    metrics.inc("llm_tokens_total", prompt, route=route, model=model, kind="prompt")
+    metrics.inc("llm_tokens_total", completion, route=route, model=model, kind="completion")
+    price = PRICES.get(model)
+    if price:
+        metrics.inc("llm_cost_usd_total", (prompt * price[0] + completion * price[1]) / 1e6, route=route, model=model)
+
+
+def fit_max_tokens(max_tokens: int, deadline: float | None) -> int:
+    """Shrink max_tokens so the answer can finish in the time left (LLM_TOKENS_PER_S), not below LLM_MIN_TOKENS."""
+    left = remaining(deadline)
+    if left is None:
+        return max_tokens
+    cfg = current_app.config
+    fit = max(int(cfg.get("LLM_MIN_TOKENS", 200)), int(left * cfg.get("LLM_TOKENS_PER_S", 40)))
+    if fit < max_tokens:
+        metrics.inc("deadline_degrades_total", stage="llm", action="max_tokens")
+        return fit
+    return max_tokens
+
+
+def _stream(route: str, model: str, t0: float, completion):
+    usage, ok, error = None, False, None
+    try:
+        for chunk in completion:
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+            yield chunk
+        ok = True
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        if not ok and hasattr(completion, "close"):
+            completion.close()  # stopped early: release the pooled connection now
+        # a stream the caller stopped early (deadline) is not an error
+        _record(route, model, time.perf_counter() - t0, usage, error)
+
+
+def complete(route: str, messages: list[dict], *, client=None, deadline: float | None = None,
+             stream: bool = False, **params):
+    """
+    chat.completions.create with the routed model. Returns the response, or for
+    stream=True an iterator of chunks (usage is requested and recorded at the end).
+    With a deadline, the call's timeouts and max_tokens are fitted to the time left.
+    """
+    if remaining(deadline) == 0:
+        metrics.inc("deadline_degrades_total", stage="llm", action="expired")
+        raise DeadlineExceeded(f"no time left for the {route} call")
+    client = client or current_app.config["OPENAI_CLIENT"]
+    model = pick_model(route, deadline)
+    params.setdefault("timeout", call_timeout(route, deadline))
+    if deadline is not None and "max_tokens" in params:
+        params["max_tokens"] = fit_max_tokens(params["max_tokens"], deadline)
+    t0 = time.perf_counter()
+    try:
+        if stream:
+            completion = client.chat.completions.create(model=model, messages=messages, stream=True,
+                                                        stream_options={"include_usage": True}, **params)
+            return _stream(route, model, t0, completion)
+        resp = client.chat.completions.create(model=model, messages=messages, **params)
+    except Exception as e:
+        _record(route, model, time.perf_counter() - t0, None, e)
+        raise
+    _record(route, model, time.perf_counter() - t0, getattr(resp, "usage", None))
+    return resp
+
+
+def route_stats() -> dict:
+    """Per route and model: requests, errors, latency, tokens and estimated cost."""
+    snap = metrics.snapshot()
+    counters, hists = snap["counters"], snap["histograms"]
+    out: dict = {}
+
+    def entry(labels: str) -> dict:
+        d = dict(kv.split("=", 1) for kv in labels.split(","))
+        return out.setdefault(d["route"], {}).setdefault(d["model"], {
+            "requests": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0})
+
+    for labels, n in counters.get("llm_requests_total", {}).items():
+        e = entry(labels)
+        e["requests"] += int(n)
+        if "result=error" in labels:
+            e["errors"] += int(n)
+    for labels, n in counters.get("llm_tokens_total", {}).items():
+        kind = "prompt_tokens" if "kind=prompt" in labels else "completion_tokens"
+        entry(labels)[kind] += int(n)
+    for labels, usd in counters.get("llm_cost_usd_total", {}).items():
+        entry(labels)["cost_usd"] = round(usd, 6)
+    for labels, h in hists.get("llm_request_seconds", {}).items():
+        entry(labels).update(avg_s=h["avg"], p95_s=h["p95"])
+    fallbacks = counters.get("llm_route_fallbacks_total", {})
+    return {"routes": out, "fallbacks": {k: int(v) for k, v in fallbacks.items()}}
@@ -0,0 +1,218 @@
+"""
+Local, memory-mapped vector index: a Qdrant-free serving path for rag.search.
+
+A snapshot is exported from Qdrant into a versioned directory:
+
+    <root>/CURRENT                      name of the live version
+    <root>/<version>/manifest.json      collection, dim, per-state counts
+    <root>/<version>/<STATE>.npy        float32 (count x dim), rows L2-normalized
+    <root>/<version>/<STATE>.meta.json  payload columns (low-cardinality ones dictionary-encoded)
+
+Matrices are opened with np.load(mmap_mode="r"), so gunicorn workers share one copy
+through the page cache. Writing a new version and swapping CURRENT is picked up by
+every worker within RAG_LOCAL_INDEX_CHECK_S, without a restart.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DICT_COLUMNS = ("source", "line", "section")
+PLAIN_COLUMNS = ("text", "chunk_index", "coverages")
+
+
+def _encode_column(values: list) -> dict:
+    uniq = sorted({v for v in values if v is not None})
+    code = {v: i for i, v in enumerate(uniq)}
+    return {"values": uniq, "codes": [code.get(v, -1) for v in values]}
+
+
+def export_snapshot(qc, collection: str, root, batch: int = 1024) -> dict:
+    """Scroll every point (with vector) out of Qdrant into a new version under root and make it live."""
+    root = Path(root)
+    version = time.strftime("%Y%m%dT%H%M%S")
+    tmp = root / f".{version}.tmp"
+    tmp.mkdir(parents=True, exist_ok=True)
+
+    by_state: dict[str, dict] = {}
+    dim = None
+    offset = None
+    while True:
+        points, offset = qc.scroll(collection_name=collection, limit=batch, offset=offset,
+                                   with_payload=True, with_vectors=True)
+        for p in points:
+            vec = p.vector.get("", None) if isinstance(p.vector, dict) else p.vector
+            if vec is None:
+                continue
+            payload = p.payload or {}
+            st = by_state.setdefault(payload.get("state") or "_none", {"vecs": [], "payloads": []})
+            st["vecs"].append(np.asarray(vec, dtype=np.float32))
+            st["payloads"].append(payload)
+            dim = dim or len(vec)
+        if offset is None:
+            break
+
+    counts = {}
+    for state, st in by_state.items():
+        mat = np.vstack(st["vecs"])
+        norms = np.linalg.norm(mat, axis=1, keepdims=True)
+        mat /= np.where(norms == 0, 1, norms)
+        np.save(tmp / f"{state}.npy", mat)
+        cols = {c: _encode_column([p.get(c) for p in st["payloads"]]) for c in DICT_COLUMNS}
+        cols.update({c: [p.get(c) for p in st["payloads"]] for c in PLAIN_COLUMNS})
+        with open(tmp / f"{state}.meta.json", "w", encoding="utf-8") as f:
+            json.dump({"count": len(mat), "columns": cols}, f, separators=(",", ":"))
+        counts[state] = len(mat)
+        st.clear()
+
+    manifest = {"version": version, "collection": collection, "dim": dim, "states": counts,
+                "exported_at": time.time()}
+    with open(tmp / "manifest.json", "w") as f:
+        json.dump(manifest, f)
+    final = root / version
+    if final.exists():
+        shutil.rmtree(final)
+    tmp.rename(final)
+    _write_current(root, version)
+    logger.info("exported %s (%s) to %s", collection, counts, final)
+    return manifest
+
+
+def _write_current(root: Path, version: str):
+    tmp = root / ".CURRENT.tmp"
+    tmp.write_text(version)
+    os.replace(tmp, root / "CURRENT")
+
+
+def prune_snapshots(root, keep: int = 2):
+    """Delete all but the newest `keep` versions (never the live one)."""
+    root = Path(root)
+    live = (root / "CURRENT").read_text().strip() if (root / "CURRENT").exists() else None
+    versions = sorted(d.name for d in root.iterdir() if d.is_dir() and not d.name.startswith("."))
+    for name in versions[:-keep] if keep else versions:
+        if name != live:
+            shutil.rmtree(root / name, ignore_errors=True)
+
+
+class _StateIndex:
+    def __init__(self, path: Path, state: str):
+        self.matrix = np.load(path / f"{state}.npy", mmap_mode="r")
+        with open(path / f"{state}.meta.json", encoding="utf-8") as f:
+            cols = json.load(f)["columns"]
+        self.dict_cols = {c: (cols[c]["values"], np.asarray(cols[c]["codes"], dtype=np.int32)) for c in DICT_COLUMNS}
+        self.text = cols["text"]
+        self.chunk_index = cols["chunk_index"]
+        self.coverages = cols["coverages"]
+        self._coverage_sets = None
+
+    def _mask(self, line, coverages_any, section):
+        mask = None
+        for col, want in (("line", line), ("section", section)):
+            if not want:
+                continue
+            values, codes = self.dict_cols[col]
+            m = codes == (values.index(want) if want in values else -2)
+            mask = m if mask is None else mask & m
+        if coverages_any:
+            if self._coverage_sets is None:
+                self._coverage_sets = [set(c or []) for c in self.coverages]
+            want = set(coverages_any)
+            m = np.fromiter((bool(s & want) for s in self._coverage_sets), dtype=bool, count=len(self.text))
+            mask = m if mask is None else mask & m
+        return mask
+
+    def payload(self, i: int, state: str) -> dict:
+        def dv(col):
+            values, codes = self.dict_cols[col]
+            return values[codes[i]] if codes[i] >= 0 else None
+        return {"text": self.text[i], "state": None if state == "_none" else state, "source": dv("source"),
+                "chunk_index": self.chunk_index[i], "line": dv("line"), "coverages": self.coverages[i],
+                "section": dv("section")}
+
+    def search(self, q: np.ndarray, top_k: int, line, coverages_any, section) -> list[tuple[int, float]]:
+        if not len(self.text):
+            return []
+        scores = self.matrix @ q
+        mask = self._mask(line, coverages_any, section)
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+        k = min(top_k, len(scores))
+        idx = np.argpartition(-scores, k - 1)[:k]
+        idx = idx[np.argsort(-scores[idx])]
+        return [(int(i), float(scores[i])) for i in idx if scores[i] != -np.inf]
+
+
+class LocalIndex:
+    """Reader for the live snapshot under root; reloads when CURRENT changes."""
+
+    def __init__(self, root, check_interval_s: float = 10.0):
+        self.root = Path(root)
+        self.check_interval_s = check_interval_s
+        self.version: str | None = None
+        self.manifest: dict = {}
+        self._states: dict[str, _StateIndex] = {}
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _current(self) -> str | None:
+        try:
+            return (self.root / "CURRENT").read_text().strip() or None
+        except OSError:
+            return None
+
+    def maybe_reload(self):
+        now = time.monotonic()
+        if self._checked_at and now - self._checked_at < self.check_interval_s:
+            return
+        with self._lock:
+            self._checked_at = now
+            version = self._current()
+            if not version or version == self.version:
+                return
+            path = self.root / version
+            try:
+                with open(path / "manifest.json") as f:
+                    manifest = json.load(f)
+                states = {st: _StateIndex(path, st) for st in manifest["states"]}
+            except Exception as e:
+                logger.warning("local index %s unusable (%s); keeping %s", path, e, self.version)
+                return
+            self.version, self.manifest, self._states = version, manifest, states
+            logger.info("local index loaded version %s (%s)", version, manifest.get("states"))
+
+    @property
+    def ready(self) -> bool:
+        self.maybe_reload()
+        return bool(self._states)
+
+    def has_state(self, state: str | None) -> bool:
+        return self.ready and (state is None or state in self._states)
+
+    def search(self, vec, *, state: str | None, top_k: int, line: str | None = None,
+               coverages_any: list[str] | None = None, section: str | None = None) -> list[tuple[object, float]]:
+        """Cosine top-k as (hit, score) pairs; hit has .id and .payload like a Qdrant ScoredPoint."""
+        q = np.asarray(vec, dtype=np.float32)
+        n = float(np.linalg.norm(q))
+        if n:
+            q = q / n
+        states = self._states
+        targets = [state] if state else list(states)
+        scored = []
+        for st in targets:
+            idx = states.get(st)
+            if idx is None:
+                continue
+            for i, score in idx.search(q, top_k, line, coverages_any, section):
+                scored.append((SimpleNamespace(id=f"{st}:{i}", payload=idx.payload(i, st)), score))
+        scored.sort(key=lambda x: x[1], reverse=True)
+        return scored[:top_k]
@@ -0,0 +1,183 @@
+"""
+Conversation memory: recent turns verbatim, older turns folded into a summary.
+
+Kept in the session as {"summary", "turns": [[user, assistant], ...], "epoch", "pending_at"}.
+When the turns pass MEMORY_COMPACT_TOKENS, everything but the last MEMORY_RECENT_TURNS is
+handed to a background worker that merges it into the summary (the "memory" model route)
+and leaves the result in Redis (memsum:<sid>). The next request folds it in (apply_compaction)
+if the memory hasn't moved on. If compaction is slow or failing, turns past
+MEMORY_MAX_TOKENS are dropped on the request path, so the session stays bounded either way.
+"""
+from __future__ import annotations
+
+import html
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from ..utils import metrics
+from ..utils.tokens import count_tokens, truncate_tokens
+from .llm_router import complete
+
+logger = logging.getLogger(__name__)
+
+MEMORY_KEY = "memory"
+TURN_MAX_TOKENS = 300  # per side of a turn
+PENDING_RETRY_S = 120
+
+SUMMARY_PROMPT = (
+    "You maintain the memory of a conversation between an insurance customer and Polly, an "
+    "insurance assistant. Merge the new turns into the existing summary. Keep facts the "
+    "customer stated (state, vehicles, drivers, assets, limits, coverages asked about), "
+    "answers and numbers Polly gave, and open questions. Drop pleasantries. Plain text, "
+    "short bullet lines, at most {max_tokens} tokens."
+)
+
+_pool: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+_TAG = re.compile(r"<[^>]+>")
+_WS = re.compile(r"\s+")
+
+
+def _plain(text: str) -> str:
+    return _WS.sub(" ", html.unescape(_TAG.sub(" ", text or ""))).strip()
+
+
+def _cfg(name: str, default):
+    return current_app.config.get(name, default)
+
+
+def conversation_memory(sess) -> dict:
+    mem = sess.get(MEMORY_KEY)
+    if mem is None:
+        # sessions from before memory existed keep their running summary
+        mem = {"summary": _plain(sess.get("running_summary") or "")[-2000:], "turns": [], "epoch": 0,
+               "pending_at": None}
+        sess.pop("running_summary", None)
+    return mem
+
+
+def _turns_tokens(turns: list) -> int:
+    return sum(count_tokens(u) + count_tokens(a) for u, a in turns)
+
+
+def render_turns(turns: list) -> str:
+    return "\n".join(f"User: {u}\nPolly: {a}" for u, a in turns)
+
+
+def memory_text(sess) -> str:
+    """Summary then recent turns, as a prompt section body."""
+    mem = sess.get(MEMORY_KEY) or {}
+    parts = []
+    if mem.get("summary"):
+        parts.append(f"Earlier in this conversation:\n{mem['summary']}")
+    if mem.get("turns"):
+        parts.append(f"Recent turns:\n{render_turns(mem['turns'])}")
+    return "\n\n".join(parts)
+
+
+def record_turn(sess, user_message: str, reply: str):
+    """Append a turn and schedule compaction (or drop old turns) when over budget."""
+    mem = conversation_memory(sess)
+    mem["turns"].append([truncate_tokens(_plain(user_message), TURN_MAX_TOKENS),
+                         truncate_tokens(_plain(reply), TURN_MAX_TOKENS)])
+
+    recent = _cfg("MEMORY_RECENT_TURNS", 4)
+    tokens = _turns_tokens(mem["turns"])
+    if tokens > _cfg("MEMORY_COMPACT_TOKENS", 1200) and len(mem["turns"]) > recent:
+        stale = mem["pending_at"] is None or time.time() - mem["pending_at"] > PENDING_RETRY_S
+        if stale and _schedule(sess.sid, mem, len(mem["turns"]) - recent):
+            mem["pending_at"] = time.time()
+
+    # hard cap: keep the session bounded even if compaction never lands
+    max_tokens = _cfg("MEMORY_MAX_TOKENS", 3000)
+    while len(mem["turns"]) > 1 and _turns_tokens(mem["turns"]) > max_tokens:
+        mem["turns"].pop(0)
+        mem["epoch"] += 1  # any pending result no longer lines up with the turns
+        mem["pending_at"] = None
+        metrics.inc("memory_turns_dropped_total")
+    sess[MEMORY_KEY] = mem
+    metrics.observe("memory_tokens", count_tokens(memory_text(sess)),
+                    buckets=(100, 250, 500, 1000, 2000, 4000, 8000))
+
+
+def apply_compaction(sess):
+    """Fold a finished background summary into the session, if it still applies."""
+    mem = sess.get(MEMORY_KEY)
+    if not mem or mem.get("pending_at") is None:
+        return
+    try:
+        raw = current_app.config["SESSION_REDIS"].get(_result_key(sess.sid))
+    except Exception as e:
+        logger.debug("memory result read failed: %s", e)
+        return
+    if not raw:
+        return
+    result = json.loads(raw)
+    if result.get("epoch") != mem["epoch"]:
+        return
+    n = int(result["n"])
+    mem = {**mem, "summary": result["summary"], "turns": mem["turns"][n:], "epoch": mem["epoch"] + 1,
+           "pending_at": None}
+    sess[MEMORY_KEY] = mem
+    metrics.inc("memory_compactions_total", result="applied")
+
+
+def _result_key(sid: str) -> str:
+    return f"memsum:{sid}"
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=_cfg("MEMORY_COMPACT_WORKERS", 2),
+                                       thread_name_prefix="memory-compact")
+    return _pool
+
+
+def _schedule(sid: str | None, mem: dict, n: int) -> bool:
+    if not sid:
+        return False
+    app = current_app._get_current_object()
+    _executor().submit(_compact, app, sid, mem["epoch"], n, mem["summary"], [list(t) for t in mem["turns"][:n]])
+    metrics.inc("memory_compactions_total", result="scheduled")
+    return True
+
+
+def summarize_turns(summary: str, turns: list, max_tokens: int) -> str:
+    """Merge turns into the summary on the "memory" model route; extractive fallback on failure."""
+    prompt = f"EXISTING SUMMARY:\n{summary or '(none)'}\n\nNEW TURNS:\n{render_turns(turns)}"
+    try:
+        resp = complete("memory", [{"role": "system", "content": SUMMARY_PROMPT.format(max_tokens=max_tokens)},
+                                   {"role": "user", "content": prompt}],
+                        max_tokens=max_tokens, temperature=0.2)
+        out = (resp.choices[0].message.content or "").strip()
+        if out:
+            return truncate_tokens(out, max_tokens)
+    except Exception as e:
+        logger.warning("memory summarization failed, using extractive fallback: %s", e)
+        metrics.inc("memory_compactions_total", result="fallback")
+    lines = [summary] if summary else []
+    lines += [f"- U: {u[:160]} | A: {a[:160]}" for u, a in turns]
+    return truncate_tokens("\n".join(lines), max_tokens, keep="tail")
+
+
+def _compact(app, sid: str, epoch: int, n: int, summary: str, turns: list):
+    t0 = time.perf_counter()
+    with app.app_context():
+        try:
+            merged = summarize_turns(summary, turns, app.config.get("MEMORY_SUMMARY_TOKENS", 400))
+            app.config["SESSION_REDIS"].setex(_result_key(sid), 3600,
+                                              json.dumps({"epoch": epoch, "n": n, "summary": merged}))
+            metrics.inc("memory_compactions_total", result="done")
+        except Exception as e:
+            logger.warning("memory compaction failed: %s", e)
+            metrics.inc("memory_compactions_total", result="error")
+        metrics.observe("memory_compaction_seconds", time.perf_counter() - t0)
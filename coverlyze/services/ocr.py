@@ -1,11 +1,50 @@
 from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from io import BytesIO
+import hashlib
 import json
+import logging
+import multiprocessing
 import re
+import threading
 import uuid
 
 from flask import current_app
-from google.cloud.vision_v1 import AnnotateFileResponse
+
+from ..utils import metrics
+from ..utils.cache import TieredCache
+
+logger = logging.getLogger(__name__)
+
+PAGE_BREAK = "\n\n--- PAGE BREAK ---\n\n"
+VISION_PAGES_PER_REQUEST = 5  # batch_annotate_files accepts at most 5 pages per file request
+
+# Per-page quality thresholds: text is garbled when under 30% of its characters are alphanumeric
+# or over 30% of its words are single characters; short when under PAGE_MIN_CHARS characters
+PAGE_MIN_ALNUM_RATIO = 0.3
+PAGE_MAX_SINGLE_CHAR_RATIO = 0.3
+PAGE_MIN_CHARS = 40
+
+_cache: TieredCache | None = None
+_pool: ProcessPoolExecutor | None = None
+_pool_workers = 0  # size _pool was created with
+_io_executor: ThreadPoolExecutor | None = None
+_deleter: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def ocr_cache() -> TieredCache:
+    """Extraction cache keyed by content digests (whole PDF and individual pages)."""
+    global _cache
+    if _cache is None:
+        cfg = current_app.config
+        _cache = TieredCache("ocr", max_items=cfg.get("OCR_CACHE_MAX_ITEMS", 512),
+                             ttl_s=cfg.get("OCR_CACHE_TTL_S", 7 * 24 * 3600))
+    return _cache
+
+
+def _as_text(val) -> str:
+    return val.decode("utf-8") if isinstance(val, (bytes, bytearray)) else val
 
 
 def normalize_ocr_text(text: str) -> str:
@@ -20,33 +59,179 @@ def normalize_ocr_text(text: str) -> str:
     return text.strip()
 
 
-def needs_ocr(text: str) -> bool:
-    if not text or len(text.strip()) < 100:
-        return True
-    alnum = sum(c.isalnum() for c in text)
-    if alnum / max(1, len(text)) < 0.3:
-        return True
+def page_quality(text: str) -> dict:
+    """Score one page of pdfplumber text: alnum ratio, single-char word ratio, length."""
+    text = text or ""
+    stripped = text.strip()
     words = text.split()
-    single_chars = sum(1 for w in words if len(w) == 1)
-    if len(words) > 0 and single_chars / len(words) > 0.3:
-        return True
-    return False
+    alnum_ratio = sum(c.isalnum() for c in text) / max(1, len(text))
+    single_char_ratio = sum(1 for w in words if len(w) == 1) / max(1, len(words))
+    garbled = bool(stripped) and (alnum_ratio < PAGE_MIN_ALNUM_RATIO or single_char_ratio > PAGE_MAX_SINGLE_CHAR_RATIO)
+    return {
+        "chars": len(stripped),
+        "alnum_ratio": round(alnum_ratio, 3),
+        "single_char_ratio": round(single_char_ratio, 3),
+        "garbled": garbled,
+        "short": len(stripped) < PAGE_MIN_CHARS,
+    }
 
 
-def extract_text_with_pdfplumber(pdf_file) -> str:
+def _raw_stream(obj) -> bytes:
+    from pdfminer.pdftypes import resolve1
+    try:
+        return resolve1(obj).get_rawdata() or b""
+    except Exception:
+        return b""
+
+
+def _page_fingerprint(page) -> dict:
+    """
+    Digest + cheap structural hints for a page, without running layout analysis.
+    The digest is SHA-256 of the page's content stream(s) plus the XObjects it draws:
+    scanned pages usually share an identical "draw image" content stream, so the
+    image data has to be part of the key or every scan would collide.
+    """
+    from pdfminer.pdftypes import resolve1
+    po = page.page_obj
+    h = hashlib.sha256(repr(po.mediabox).encode())
+    content_len = 0
+    contents = po.contents if isinstance(po.contents, list) else [po.contents]
+    for s in contents or []:
+        raw = _raw_stream(s)
+        content_len += len(raw)
+        h.update(raw)
+    has_images = False
+    xobjects = resolve1((po.resources or {}).get("XObject")) or {}
+    for name in sorted(xobjects):
+        h.update(str(name).encode())
+        h.update(_raw_stream(xobjects[name]))
+        try:
+            subtype = resolve1(xobjects[name]).attrs.get("Subtype")
+            has_images = has_images or getattr(subtype, "name", subtype) == "Image"
+        except Exception:
+            pass
+    return {"digest": h.hexdigest(), "has_images": has_images, "content_len": content_len}
+
+
+def page_digest(page) -> str:
+    return _page_fingerprint(page)["digest"]
+
+
+def page_digests(pdf_bytes: bytes) -> list[str]:
     import pdfplumber
-    with pdfplumber.open(pdf_file) as pdf:
-        text = "\n".join([page.extract_text() or "" for page in pdf.pages])
-    return text
+    with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
+        return [page_digest(p) for p in pdf.pages]
+
+
+def _extract_page_texts(pdf_bytes: bytes, indices: list[int]) -> list[tuple[int, str]]:
+    """Process-pool task: run pdfplumber text extraction on a subset of pages."""
+    import pdfplumber
+    with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
+        return [(i, pdf.pages[i].extract_text() or "") for i in indices]
+
+
+def _process_pool() -> ProcessPoolExecutor | None:
+    global _pool, _pool_workers
+    workers = current_app.config.get("OCR_PROCESS_WORKERS", 0)
+    if workers <= 1:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # spawn: the parent may hold gRPC/HTTP clients that must not be forked
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+    return _pool
+
+
+def _reset_pool(broken: ProcessPoolExecutor):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _extract_missing(pdf_bytes: bytes, pdf, indices: list[int]) -> dict[int, str]:
+    pool = _process_pool()
+    if pool is None or len(indices) < current_app.config.get("OCR_PARALLEL_MIN_PAGES", 4):
+        return {i: pdf.pages[i].extract_text() or "" for i in indices}
+    n_chunks = min(len(indices), _pool_workers)
+    chunks = [indices[k::n_chunks] for k in range(n_chunks)]
+    out = {}
+    try:
+        for part in pool.map(_extract_page_texts, [pdf_bytes] * len(chunks), chunks):
+            out.update(part)
+    except Exception as e:
+        logger.warning("pdfplumber process pool failed (%s); extracting in-process", e)
+        _reset_pool(pool)
+        out = {i: pdf.pages[i].extract_text() or "" for i in indices}
+    return out
+
+
+def extract_pages_with_pdfplumber(pdf_file) -> tuple[list[str], list[dict]]:
+    """
+    Per-page pdfplumber text plus page fingerprints. Pages already seen are served
+    from the cache; the rest are extracted across the process pool.
+    """
+    import pdfplumber
+    pdf_file.seek(0)
+    pdf_bytes = pdf_file.read()
+    cache = ocr_cache()
+    with metrics.stage("pdfplumber"), pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
+        prints = [_page_fingerprint(p) for p in pdf.pages]
+        cached = cache.get_many([f"plumber:{fp['digest']}" for fp in prints])
+        missing = [i for i, hit in enumerate(cached) if hit is None]
+        fresh = _extract_missing(pdf_bytes, pdf, missing) if missing else {}
+    cache.set_many({f"plumber:{prints[i]['digest']}": fresh[i] for i in missing})
+    texts = [_as_text(hit) if hit is not None else fresh[i] for i, hit in enumerate(cached)]
+    return texts, prints
+
+
+def extract_text_with_pdfplumber(pdf_file) -> str:
+    texts, _ = extract_pages_with_pdfplumber(pdf_file)
+    return "\n".join(texts)
+
+
+def _io_pool() -> ThreadPoolExecutor:
+    """Shared thread pool for Vision requests and GCS shard downloads."""
+    global _io_executor
+    with _pool_lock:
+        if _io_executor is None:
+            _io_executor = ThreadPoolExecutor(max_workers=current_app.config.get("VISION_IO_CONCURRENCY", 8),
+                                              thread_name_prefix="vision-io")
+    return _io_executor
 
 
-def vision_pdf_ocr(pdf_bytes: bytes, timeout_s: int = 300, delete_after: bool = True) -> str:
+def _delete_blobs(blobs: list):
+    for blob in blobs:
+        try:
+            blob.delete()
+        except Exception as e:
+            logger.debug("GCS cleanup failed for %s: %s", getattr(blob, "name", blob), e)
+
+
+def _schedule_cleanup(blobs: list):
+    """Delete GCS objects off the request path on a single background thread."""
+    global _deleter
+    with _pool_lock:
+        if _deleter is None:
+            _deleter = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gcs-cleanup")
+    _deleter.submit(_delete_blobs, blobs)
+
+
+def _parse_shard(blob) -> dict[int, str]:
+    from google.cloud.vision_v1 import AnnotateFileResponse  # only OCR workers load the Vision stack
+    resp = AnnotateFileResponse.from_json(blob.download_as_bytes().decode("utf-8"))
+    return {r.context.page_number: (r.full_text_annotation.text if r.full_text_annotation else "")
+            for r in resp.responses}
+
+
+def _vision_async_pages(pdf_bytes: bytes, timeout_s: int, delete_after: bool) -> dict[int, str]:
+    """Full-document OCR through the GCS async batch pipeline. Returns {page_number: text}."""
     vc = current_app.config.get("VISION_CLIENT")
     sc = current_app.config.get("STORAGE_CLIENT")
     input_bucket = current_app.config.get("GCS_INPUT_BUCKET")
     output_bucket = current_app.config.get("GCS_OUTPUT_BUCKET")
-    if not vc or not sc:
-        raise RuntimeError("Google clients not initialized")
     if not input_bucket or not output_bucket:
         raise RuntimeError("GCS_INPUT_BUCKET/GCS_OUTPUT_BUCKET not configured")
 
@@ -67,37 +252,152 @@ def vision_pdf_ocr(pdf_bytes: bytes, timeout_s: int = 300, delete_after: bool =
         "input_config": {"gcs_source": gcs_source, "mime_type": "application/pdf"},
         "output_config": {"gcs_destination": {"uri": gcs_dest_uri}, "batch_size": 50},
     }
-    op = vc.async_batch_annotate_files(requests=[request])
-    op.result(timeout=timeout_s)
-
-    texts = []
-    for blob in current_app.config["STORAGE_CLIENT"].list_blobs(out_bkt, prefix=gcs_dest_prefix + "/"):
-        data = blob.download_as_bytes()
-        resp = AnnotateFileResponse.from_json(data.decode("utf-8"))
-        for r in resp.responses:
-            if r.full_text_annotation and r.full_text_annotation.text:
-                texts.append(r.full_text_annotation.text)
-    full = "\n\n--- PAGE BREAK ---\n\n".join(texts).strip()
-
-    if delete_after:
+    shards = []
+    try:
+        op = vc.async_batch_annotate_files(requests=[request])
+        op.result(timeout=timeout_s)
+
+        # Download + parse shards concurrently; the listing is reused for cleanup.
+        shards = list(sc.list_blobs(out_bkt, prefix=gcs_dest_prefix + "/"))
+        pages = {}
+        for part in _io_pool().map(_parse_shard, shards):
+            pages.update(part)
+    finally:
+        if delete_after:
+            if not shards:
+                # failed or timed out: remove whatever output Vision already wrote under the prefix
+                try:
+                    shards = list(sc.list_blobs(out_bkt, prefix=gcs_dest_prefix + "/"))
+                except Exception as e:
+                    logger.warning("cannot list %s for cleanup: %s", gcs_dest_uri, e)
+            _schedule_cleanup([in_blob] + shards)
+    return pages
+
+
+def _vision_inline_chunk(vc, pdf_bytes: bytes, pages: list[int], timeout_s: int) -> dict[int, str]:
+    request = {
+        "input_config": {"content": pdf_bytes, "mime_type": "application/pdf"},
+        "features": [{"type_": 1}],
+        "pages": pages,
+    }
+    resp = vc.batch_annotate_files(requests=[request], timeout=timeout_s)
+    out = {}
+    for file_resp in resp.responses:
+        for r in file_resp.responses:
+            out[r.context.page_number] = r.full_text_annotation.text if r.full_text_annotation else ""
+    return out
+
+
+def _vision_inline_pages(pdf_bytes: bytes, pages: list[int], timeout_s: int) -> dict[int, str]:
+    """OCR selected 1-based pages in memory (no GCS): 5-page requests issued concurrently."""
+    vc = current_app.config.get("VISION_CLIENT")
+    chunks = [pages[i:i + VISION_PAGES_PER_REQUEST] for i in range(0, len(pages), VISION_PAGES_PER_REQUEST)]
+    if len(chunks) == 1:
+        return _vision_inline_chunk(vc, pdf_bytes, chunks[0], timeout_s)
+    out = {}
+    futures = [_io_pool().submit(_vision_inline_chunk, vc, pdf_bytes, c, timeout_s) for c in chunks]
+    for fut in futures:
+        out.update(fut.result())
+    return out
+
+
+def vision_ocr_pages(pdf_bytes: bytes, pages: list[int] | None = None, *, digests: list[str] | None = None,
+                     timeout_s: int = 300, delete_after: bool = True) -> dict[int, str]:
+    """
+    OCR the given 1-based pages (default: all), serving cached pages from the page
+    cache. A small set of pages goes inline through batch_annotate_files; whole
+    scanned documents use the GCS async pipeline.
+    """
+    vc = current_app.config.get("VISION_CLIENT")
+    sc = current_app.config.get("STORAGE_CLIENT")
+    if not vc or not sc:
+        raise RuntimeError("Google clients not initialized")
+
+    cache = ocr_cache()
+    digests = digests or page_digests(pdf_bytes)
+    pages = pages or list(range(1, len(digests) + 1))
+    cached = dict(zip(pages, cache.get_many([f"vision:{digests[n - 1]}" for n in pages])))
+    missing = [n for n in pages if cached[n] is None]
+
+    if not missing:
+        fresh = {}
+    elif (len(missing) <= current_app.config.get("VISION_INLINE_MAX_PAGES", 10)
+          and len(pdf_bytes) <= current_app.config.get("VISION_INLINE_MAX_BYTES", 10 * 1024 * 1024)):
+        with metrics.stage("vision_ocr", path="inline"):
+            fresh = _vision_inline_pages(pdf_bytes, missing, timeout_s)
+    else:
+        with metrics.stage("vision_ocr", path="gcs"):
+            fresh = _vision_async_pages(pdf_bytes, timeout_s, delete_after)
+    # Pages Vision didn't return (failed chunk, partial GCS output) aren't cached; blank ones only
+    # briefly, so a transient error doesn't stick to the page for OCR_CACHE_TTL_S.
+    cache.set_many({f"vision:{digests[n - 1]}": fresh[n] for n in missing if fresh.get(n)})
+    cache.set_many({f"vision:{digests[n - 1]}": "" for n in missing if n in fresh and not fresh[n]},
+                   ttl_s=current_app.config.get("VISION_EMPTY_TTL_S", 600))
+    return {n: _as_text(cached[n]) if cached[n] is not None else fresh.get(n, "") for n in pages}
+
+
+def vision_pdf_ocr(pdf_bytes: bytes, timeout_s: int = 300, delete_after: bool = True,
+                   digests: list[str] | None = None) -> str:
+    by_page = vision_ocr_pages(pdf_bytes, digests=digests, timeout_s=timeout_s, delete_after=delete_after)
+    full = PAGE_BREAK.join(by_page[n] for n in sorted(by_page) if by_page[n]).strip()
+    return normalize_ocr_text(full)
+
+
+def _wants_vision(quality: dict, fp: dict) -> bool:
+    if quality["garbled"]:
+        return True
+    # Short text on a page that draws an image (scan) or has a non-trivial content
+    # stream but no extractable text (outlined glyphs). Short text-only pages stay.
+    return quality["short"] and (fp["has_images"] or (quality["chars"] == 0 and fp["content_len"] > 2048))
+
+
+def extract_text_smart_report(pdf_file) -> tuple[str, list[dict]]:
+    """
+    Page-selective extraction: pdfplumber on every page, Vision only on pages that
+    fail the quality score, stitched back in page order. Returns (text, per-page report).
+    """
+    pdf_file.seek(0)
+    pdf_bytes = pdf_file.read()
+    doc_key = f"doc:{hashlib.sha256(pdf_bytes).hexdigest()}"
+    cache = ocr_cache()
+    hit = cache.get(doc_key)
+    if hit is not None:
         try:
-            in_blob.delete()
-            for blob in current_app.config["STORAGE_CLIENT"].list_blobs(out_bkt, prefix=gcs_dest_prefix + "/"):
-                blob.delete()
-        except Exception:
+            doc = json.loads(_as_text(hit))
+            return doc["text"], doc["pages"]
+        except (ValueError, TypeError, KeyError):
             pass
 
-    return normalize_ocr_text(full)
+    texts, prints = extract_pages_with_pdfplumber(BytesIO(pdf_bytes))
+    report = []
+    for n, (txt, fp) in enumerate(zip(texts, prints), start=1):
+        q = page_quality(txt)
+        report.append({"page": n, "backend": "vision" if _wants_vision(q, fp) else "pdfplumber",
+                       "has_images": fp["has_images"], **q})
+
+    ocr_pages = [r["page"] for r in report if r["backend"] == "vision"]
+    by_page = {}
+    if ocr_pages:
+        try:
+            by_page = vision_ocr_pages(pdf_bytes, ocr_pages, digests=[fp["digest"] for fp in prints], timeout_s=300)
+        except Exception as e:
+            logger.warning("Vision OCR failed for pages %s: %s; keeping pdfplumber text", ocr_pages, e)
+    for r in report:
+        if r["backend"] == "vision" and not by_page.get(r["page"]):
+            r["backend"] = "pdfplumber"
+            r["vision_failed"] = True
+
+    parts = [by_page[r["page"]] if r["backend"] == "vision" else texts[r["page"] - 1] for r in report]
+    joiner = PAGE_BREAK if any(r["backend"] == "vision" for r in report) else "\n"
+    text = normalize_ocr_text(joiner.join(p for p in parts if p))
+    if text:
+        # A document with pages Vision failed on is kept only briefly, so a re-upload retries OCR.
+        degraded = any(r.get("vision_failed") for r in report)
+        cache.set(doc_key, json.dumps({"text": text, "pages": report}),
+                  ttl_s=current_app.config.get("VISION_EMPTY_TTL_S", 600) if degraded else None)
+    return text, report
 
 
 def extract_text_smart(pdf_file) -> str:
-    pdf_file.seek(0)
-    base = extract_text_with_pdfplumber(pdf_file)
-    if not needs_ocr(base):
-        return normalize_ocr_text(base)
-    pdf_file.seek(0)
-    text = vision_pdf_ocr(pdf_file.read(), timeout_s=300)
-    if not text:
-        pdf_file.seek(0)
-        return normalize_ocr_text(extract_text_with_pdfplumber(pdf_file))
+    text, _ = extract_text_smart_report(pdf_file)
     return text
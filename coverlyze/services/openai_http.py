@@ -0,0 +1,265 @@
+"""
+Shared HTTP transport for every OpenAI call (chat, embeddings).
+
+- one keep-alive pool per worker process, sized to its concurrency (OPENAI_MAX_CONNECTIONS,
+  or derived from SERVING_MODE / WEB_THREADS / WORKER_CONNECTIONS);
+- connect/read timeouts per call site (call_timeout), always below gunicorn's 60 s;
+- retries on 429/5xx and connection errors with full-jitter exponential backoff, honoring
+  Retry-After (the SDK's own retries are off so they don't multiply);
+- a circuit breaker: after OPENAI_BREAKER_FAILURES consecutive failures, calls fail fast
+  for OPENAI_BREAKER_RESET_S, then one trial call decides whether to close it again.
+
+In-flight requests, pool size, pool timeouts, retries and breaker state are metrics.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import random
+import threading
+import time
+
+import httpx
+import openai
+from flask import current_app, has_app_context
+from openai import OpenAI
+
+from ..config import Config
+from ..utils import metrics
+from ..utils.deadline import within
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# read timeout (s) per call site; connect timeout is OPENAI_CONNECT_TIMEOUT_S everywhere
+DEFAULT_READ_TIMEOUTS = {
+    "chat": 30.0, "chat_simple": 15.0, "phrasing": 20.0, "memory": 30.0,
+    "dec_summary": 90.0,  # runs in the job worker, not a web request
+    "embeddings": 10.0,  # query embeddings on the chat path
+    "embeddings_bulk": 60.0,  # ingest batches of up to EMBED_BATCH_MAX_TOKENS
+}
+
+
+def _cfg(name: str):
+    """app.config value, or the Config default (from the environment) outside an app context."""
+    default = getattr(Config, name)
+    return current_app.config.get(name, default) if has_app_context() else default
+
+
+class CircuitOpenError(httpx.TransportError):
+    """Raised instead of sending while the breaker is open."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open (fail fast) -> half_open (one trial) -> closed."""
+
+    STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+    def __init__(self, failures: int = 5, reset_s: float = 30.0, name: str = "openai"):
+        self.failures = max(1, failures)
+        self.reset_s = reset_s
+        self.name = name
+        self.state = "closed"
+        self._count = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+        self._publish()
+
+    def _publish(self):
+        metrics.gauge("openai_circuit_state", self.STATES[self.state], breaker=self.name)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_s:
+                self.state, self._trial = "half_open", False
+                self._publish()
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self._count = 0
+            if self.state != "closed":
+                logger.info("circuit %s closed", self.name)
+                self.state = "closed"
+                self._publish()
+
+    def failure(self):
+        with self._lock:
+            self._count += 1
+            if self.state == "half_open" or (self.state == "closed" and self._count >= self.failures):
+                if self.state != "open":
+                    logger.warning("circuit %s open after %d failures", self.name, self._count)
+                    metrics.inc("openai_circuit_opened_total", breaker=self.name)
+                self.state, self._opened_at = "open", time.monotonic()
+                self._publish()
+
+
+class _TrackedStream(httpx.SyncByteStream):
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if self._on_close:
+                self._on_close()
+                self._on_close = None
+
+
+class ResilientTransport(httpx.BaseTransport):
+    def __init__(self, *, max_connections: int, breaker: CircuitBreaker, max_retries: int = 2,
+                 backoff_s: float = 0.25, backoff_max_s: float = 4.0):
+        self.max_connections = max_connections
+        self.inner = httpx.HTTPTransport(limits=httpx.Limits(max_connections=max_connections,
+                                                             max_keepalive_connections=max_connections,
+                                                             keepalive_expiry=60.0))
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.backoff_s = backoff_s
+        self.backoff_max_s = backoff_max_s
+        metrics.gauge("openai_pool_max_connections", max_connections)
+
+    def _sleep_s(self, attempt: int, response: httpx.Response | None) -> float:
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        try:
+            if retry_after is not None:
+                return min(float(retry_after), self.backoff_max_s)
+        except ValueError:
+            pass
+        return random.uniform(0, min(self.backoff_max_s, self.backoff_s * 2 ** attempt))
+
+    @staticmethod
+    def _request_done():
+        metrics.gauge_add("openai_http_inflight", -1)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if not self.breaker.allow():
+            metrics.inc("openai_http_requests_total", result="circuit_open")
+            raise CircuitOpenError("OpenAI circuit breaker is open", request=request)
+        request.read()  # buffered body, so a retry can resend it
+        # retries (and their sleeps) fit inside the call's read timeout, which is cut to the request deadline
+        budget = (request.extensions.get("timeout") or {}).get("read")
+        t_start, attempt = time.monotonic(), 0
+
+        def can_retry(delay: float) -> bool:
+            return attempt < self.max_retries and (budget is None or time.monotonic() - t_start + delay < budget)
+
+        while True:
+            metrics.gauge_add("openai_http_inflight", 1)
+            try:
+                response = self.inner.handle_request(request)
+            except httpx.TransportError as e:
+                self._request_done()
+                reason = "pool_timeout" if isinstance(e, httpx.PoolTimeout) else type(e).__name__
+                metrics.inc("openai_http_requests_total", result=reason)
+                retryable = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError))
+                delay = self._sleep_s(attempt, None)
+                if not retryable or not can_retry(delay):
+                    self.breaker.failure()
+                    raise
+                metrics.inc("openai_http_retries_total", reason=reason)
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            status = response.status_code
+            metrics.inc("openai_http_requests_total", result=str(status))
+            delay = self._sleep_s(attempt, response) if status in RETRY_STATUSES else 0.0
+            if status in RETRY_STATUSES and can_retry(delay):
+                response.close()
+                self._request_done()
+                metrics.inc("openai_http_retries_total", reason=str(status))
+                time.sleep(delay)
+                attempt += 1
+                continue
+            if status in RETRY_STATUSES:
+                self.breaker.failure()
+            else:
+                self.breaker.success()
+            response.stream = _TrackedStream(response.stream, self._request_done)
+            return response
+
+    def close(self):
+        self.inner.close()
+
+
+def pool_size() -> int:
+    """OPENAI_MAX_CONNECTIONS, or this worker's request concurrency plus room for background pools."""
+    explicit = int(_cfg("OPENAI_MAX_CONNECTIONS"))
+    if explicit:
+        return explicit
+    # worker concurrency is gunicorn's setting (gunicorn.conf.py), so it comes from the environment
+    if os.getenv("SERVING_MODE", "sync") == "async":
+        return min(int(os.getenv("WORKER_CONNECTIONS", "500")), 100)
+    return int(os.getenv("WEB_THREADS", "2")) + int(_cfg("EMBED_CONCURRENCY")) + 4
+
+
+_breaker: CircuitBreaker | None = None
+
+
+def breaker() -> CircuitBreaker:
+    global _breaker
+    if _breaker is None:
+        _breaker = CircuitBreaker(failures=int(_cfg("OPENAI_BREAKER_FAILURES")),
+                                  reset_s=float(_cfg("OPENAI_BREAKER_RESET_S")))
+    return _breaker
+
+
+def build_openai_client(api_key: str | None = None) -> OpenAI:
+    transport = ResilientTransport(max_connections=pool_size(), breaker=breaker(),
+                                   max_retries=int(_cfg("OPENAI_MAX_RETRIES")))
+    http_client = httpx.Client(transport=transport, timeout=call_timeout("chat"))
+    return OpenAI(api_key=api_key, http_client=http_client, max_retries=0, timeout=call_timeout("chat"))
+
+
+def call_timeout(site: str, deadline: float | None = None) -> httpx.Timeout:
+    """
+    Timeout for a call site; OPENAI_READ_TIMEOUTS ("site=seconds,...") overrides the
+    defaults. With a request deadline, every phase is cut to the time left.
+    """
+    read = DEFAULT_READ_TIMEOUTS.get(site, DEFAULT_READ_TIMEOUTS["chat"])
+    for part in (_cfg("OPENAI_READ_TIMEOUTS") or "").split(","):
+        name, _, value = part.partition("=")
+        if name.strip() == site and value.strip():
+            read = float(value)
+    connect = float(_cfg("OPENAI_CONNECT_TIMEOUT_S"))
+    pool = float(_cfg("OPENAI_POOL_TIMEOUT_S"))
+    if deadline is not None:
+        read, connect, pool = (max(0.05, within(t, deadline)) for t in (read, connect, pool))
+    return httpx.Timeout(read, connect=connect, pool=pool)
+
+
+def is_provider_outage(e: Exception) -> bool:
+    """Connection failures, timeouts, open breaker, rate limits and 5xx; not our own 4xx bugs."""
+    if isinstance(e, (openai.APIConnectionError, httpx.TransportError)):  # the latter mid-stream
+        return True
+    return isinstance(e, openai.APIStatusError) and (e.status_code == 429 or e.status_code >= 500)
+
+
+def http_stats() -> dict:
+    """Breaker state, pool size and saturation, retries and responses by status, for /debug_llm."""
+    snap = metrics.snapshot()
+    counters, gauges = snap["counters"], snap["gauges"]
+    b = breaker()
+    inflight = gauges.get("openai_http_inflight", {}).get("", 0)
+    size = gauges.get("openai_pool_max_connections", {}).get("", 0)
+    return {
+        "breaker": {"state": b.state, "threshold": b.failures, "reset_s": b.reset_s,
+                    "opened_total": int(counters.get("openai_circuit_opened_total", {}).get(f"breaker={b.name}", 0))},
+        "pool": {"max_connections": int(size), "inflight": int(inflight),
+                 "utilization": round(inflight / size, 3) if size else None},
+        "requests": {k.split("=", 1)[1]: int(v) for k, v in counters.get("openai_http_requests_total", {}).items()},
+        "retries": {k.split("=", 1)[1]: int(v) for k, v in counters.get("openai_http_retries_total", {}).items()},
+    }
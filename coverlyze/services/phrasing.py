@@ -0,0 +1,123 @@
+"""
+Pre-generated phrasings for fixed flow questions (the umbrella slot questions).
+
+Each (question, tone) has a pool of variants in the "phrase" TieredCache, keyed by a
+digest of the phrasing prompts, the tone and the question text, so editing any of them
+starts a fresh pool. The hot path picks a random variant and never calls the LLM: on a
+miss it returns the plain question and fills the pool in the background (one builder per
+key across workers, via a Redis lock). `flask warm-phrasings` builds every pool up front.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from ..utils import metrics
+from ..utils.cache import TieredCache
+from ..utils.chat_flow import UMBRELLA_QUESTIONS
+from .llm import AGENT_INSTRUCTION_PROMPT, PHRASING_SYSTEM_BASE, with_instruction
+from .llm_router import complete
+
+logger = logging.getLogger(__name__)
+
+UMBRELLA_TONE = "Keep tone warm, professional, concise."
+
+VARIANTS_PROMPT = (
+    "Write {n} different ways to ask the message below, each a complete message on its own "
+    "line, keeping any example values in parentheses. No numbering, no quotes, nothing else."
+)
+
+PROMPT_DIGEST = hashlib.sha256((AGENT_INSTRUCTION_PROMPT + PHRASING_SYSTEM_BASE + VARIANTS_PROMPT)
+                               .encode("utf-8")).hexdigest()[:16]
+
+_cache: TieredCache | None = None
+_pool: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def phrase_cache() -> TieredCache:
+    global _cache
+    if _cache is None:
+        cfg = current_app.config
+        _cache = TieredCache("phrase", max_items=256, ttl_s=cfg.get("PHRASING_CACHE_TTL_S", 30 * 24 * 3600))
+    return _cache
+
+
+def pool_key(question: str, tone: str) -> str:
+    return hashlib.sha256(f"{PROMPT_DIGEST}\n{tone}\n{question}".encode("utf-8")).hexdigest()
+
+
+def _valid(variant: str, question: str) -> bool:
+    # same kind of message: a question, not wildly longer than the original
+    return bool(variant) and variant.endswith(("?", ")")) and len(variant) <= 3 * len(question) + 40
+
+
+def generate_variants(question: str, tone: str, n: int) -> list[str]:
+    """One LLM call for n phrasings; the plain question is always part of the pool."""
+    resp = complete(
+        "phrasing",
+        [
+            {"role": "system", "content": with_instruction(PHRASING_SYSTEM_BASE, tone)},
+            {"role": "user", "content": f"{VARIANTS_PROMPT.format(n=n)}\n\nMessage: {question}"},
+        ],
+        max_tokens=60 * n,
+        temperature=0.9,
+    )
+    lines = [ln.strip().lstrip("-•").strip() for ln in (resp.choices[0].message.content or "").splitlines()]
+    variants = [ln for ln in dict.fromkeys(lines) if _valid(ln, question)][:n]
+    return [question, *variants]
+
+
+def build_pool(question: str, tone: str, n: int | None = None) -> list[str]:
+    variants = generate_variants(question, tone, n or current_app.config.get("PHRASING_VARIANTS", 6))
+    phrase_cache().set(pool_key(question, tone), json.dumps(variants))
+    return variants
+
+
+def _build_in_background(app, question: str, tone: str, key: str):
+    with app.app_context():
+        redis = app.config["SESSION_REDIS"]
+        try:
+            if not redis.set(f"phraselock:{key}", 1, nx=True, ex=120):
+                return
+        except Exception:
+            pass
+        try:
+            build_pool(question, tone)
+            metrics.inc("phrasing_pools_built_total")
+        except Exception as e:
+            logger.warning("phrasing pool build failed: %s", e)
+
+
+def phrase(question: str, tone: str = UMBRELLA_TONE) -> str:
+    """A random pre-generated phrasing of question; the question itself until its pool exists."""
+    key = pool_key(question, tone)
+    raw = phrase_cache().get(key)
+    if raw:
+        metrics.inc("phrasing_lookups_total", result="hit")
+        return random.choice(json.loads(raw))
+    metrics.inc("phrasing_lookups_total", result="miss")
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="phrasing")
+    _pool.submit(_build_in_background, current_app._get_current_object(), question, tone, key)
+    return question
+
+
+def warm_phrasings(tone: str = UMBRELLA_TONE, n: int | None = None, force: bool = False) -> dict:
+    """Build the pool for every umbrella question (skipping existing ones unless force)."""
+    built = skipped = 0
+    for question in UMBRELLA_QUESTIONS.values():
+        if not force and phrase_cache().get(pool_key(question, tone)):
+            skipped += 1
+            continue
+        build_pool(question, tone, n)
+        built += 1
+    return {"built": built, "skipped": skipped}
@@ -0,0 +1,172 @@
+"""
+Speculative RAG prefetch after an upload.
+
+Once a dec page is parsed we know the insured's state and which coverages are on the
+policy, so the questions a first chat turn is likely to ask can be retrieved in the
+background. Requests use the same filters as the chat path (turn_request), so they land
+in the same RAG cache bucket: identical questions hit the exact tier, close paraphrases
+the semantic tier.
+
+Work runs on a small shared pool (RAG_PREFETCH_CONCURRENCY); when more than
+RAG_PREFETCH_MAX_PENDING sessions are waiting, new prefetches are dropped. Each session's
+prefetch holds a token in Redis (ragpf:<sid>); clearing the session deletes it, and the
+worker checks it between batches and stops.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from ..utils import metrics
+
+logger = logging.getLogger(__name__)
+
+CHAT_RAG_K = 5
+PREFETCH_BATCH = 4
+
+# asked after almost every upload
+BASE_QUESTIONS = (
+    "what are the state minimum auto liability limits",
+    "what underlying auto liability limits does an umbrella policy require",
+)
+
+# dec page vehicle field -> question asked when the policy carries that coverage
+COVERAGE_QUESTIONS = {
+    "bodily_injury": "bodily injury liability limits",
+    "uninsured_motorist": "uninsured and underinsured motorist coverage requirements",
+    "collision_deductible": "collision coverage and deductible",
+    "comprehensive_deductible": "comprehensive coverage and deductible",
+    "rental_coverage": "rental reimbursement coverage",
+}
+
+_pool: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+_pending = 0
+
+
+def turn_request(state: str | None, user_query: str | None, flow: str | None = None) -> dict:
+    """rag_retrieve kwargs for a general chat turn; prefetch must match them to share cache buckets."""
+    topic = flow or "general"
+    return {"state": state, "topic": topic, "k": CHAT_RAG_K, "line": "auto" if topic == "auto_adjust" else None,
+            "coverage": None, "coverages_any": None, "section": None, "user_query": user_query}
+
+
+def likely_questions(extracted_data: dict) -> list[str]:
+    """Base questions plus one per coverage found on any vehicle."""
+    vehicles = (extracted_data or {}).get("vehicles") or []
+    found = [q for field, q in COVERAGE_QUESTIONS.items() if any(v.get(field) for v in vehicles)]
+    return [*BASE_QUESTIONS, *found]
+
+
+def _token_key(sid: str) -> str:
+    return f"ragpf:{sid}"
+
+
+def _redis():
+    return current_app.config["SESSION_REDIS"]
+
+
+def _active(sid: str, token: str) -> bool:
+    try:
+        raw = _redis().get(_token_key(sid))
+    except Exception as e:
+        logger.debug("prefetch token check failed: %s", e)
+        return True
+    return raw is not None and (raw.decode() if isinstance(raw, bytes) else raw) == token
+
+
+def cancel_prefetch(sid: str | None):
+    """Stop any prefetch still running for this session."""
+    if not sid:
+        return
+    try:
+        _redis().delete(_token_key(sid))
+    except Exception as e:
+        logger.debug("prefetch cancel failed: %s", e)
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=current_app.config.get("RAG_PREFETCH_CONCURRENCY", 2),
+                                       thread_name_prefix="rag-prefetch")
+    return _pool
+
+
+def _run(app, sid: str, token: str, requests: list[dict]):
+    global _pending
+    from .rag import rag_retrieve_many
+    t0 = time.perf_counter()
+    result = "done"
+    try:
+        with app.app_context():
+            for i in range(0, len(requests), PREFETCH_BATCH):
+                if not _active(sid, token):
+                    result = "cancelled"
+                    break
+                rag_retrieve_many(requests[i:i + PREFETCH_BATCH])
+    except Exception as e:
+        result = "error"
+        logger.warning("rag prefetch failed: %s", e)
+    finally:
+        with _pool_lock:
+            _pending -= 1
+    metrics.inc("rag_prefetch_total", result=result)
+    metrics.observe("rag_prefetch_seconds", time.perf_counter() - t0)
+
+
+def start_prefetch(sid: str | None, state: str | None, extracted_data: dict) -> str:
+    """
+    Queue background retrievals for this session's likely first questions. Returns
+    "queued", "dropped" (pool saturated), or "off" (disabled / nothing to fetch).
+    A new prefetch for the same session supersedes the previous one.
+    """
+    global _pending
+    cfg = current_app.config
+    if not cfg.get("RAG_PREFETCH", True) or not sid or not state:
+        return "off"
+    requests = [turn_request(state, q) for q in likely_questions(extracted_data)]
+
+    with _pool_lock:
+        if _pending >= cfg.get("RAG_PREFETCH_MAX_PENDING", 32):
+            metrics.inc("rag_prefetch_total", result="dropped")
+            return "dropped"
+        _pending += 1
+
+    token = uuid.uuid4().hex
+    try:
+        _redis().setex(_token_key(sid), cfg.get("RAG_PREFETCH_TTL_S", 600), token)
+    except Exception as e:
+        logger.debug("prefetch token write failed: %s", e)
+    metrics.inc("rag_prefetch_total", result="queued")
+    _executor().submit(_run, current_app._get_current_object(), sid, token, requests)
+    return "queued"
+
+
+def record_first_turn(prefetch: str | None, tier: str | None, elapsed_s: float):
+    """First RAG turn after an upload: latency split by prefetch outcome, and which cache tier served it."""
+    prefetched = prefetch == "queued"
+    metrics.observe("rag_first_turn_seconds", elapsed_s, prefetched="yes" if prefetched else "no")
+    if prefetched:
+        metrics.inc("rag_prefetch_first_turn_total", tier=tier or "miss")
+
+
+def prefetch_stats() -> dict:
+    """Prefetch outcomes, first-turn hit rate, and first-turn latency with/without prefetch."""
+    snap = metrics.snapshot()
+    outcomes = {k.split("=", 1)[1]: int(v) for k, v in snap["counters"].get("rag_prefetch_total", {}).items()}
+    first = snap["counters"].get("rag_prefetch_first_turn_total", {})
+    by_tier = {tier: int(first.get(f"tier={tier}", 0)) for tier in ("exact", "semantic", "miss")}
+    turns = sum(by_tier.values())
+    latency = snap["histograms"].get("rag_first_turn_seconds", {})
+    return {
+        "outcomes": outcomes, "first_turns": turns, **{f"first_turn_{t}": n for t, n in by_tier.items()},
+        "first_turn_hit_ratio": round((by_tier["exact"] + by_tier["semantic"]) / turns, 4) if turns else 0.0,
+        "first_turn_latency": {k.split("=", 1)[1]: v for k, v in latency.items()},
+    }
@@ -0,0 +1,126 @@
+"""
+Token-budgeted packing of the chat prompt's context sections.
+
+build_messages used fixed character cuts (300 per chunk, 2000 for declarations and
+summary). Here every section is measured in tokens and the budget left after the fixed
+instructions and the user message is shared by priority:
+
+  1. each section gets up to its floor (SECTION_FLOORS), in priority order;
+  2. what remains goes to sections that still have content, again in priority order.
+
+RAG chunks are ranked (retrieval order plus term overlap with the question), near-
+duplicates are dropped (ingest chunks overlap), and whole chunks are kept in preference
+to many clipped ones.
+"""
+from __future__ import annotations
+
+import json
+import re
+
+from ..utils.tokens import count_tokens, truncate_tokens
+from .sparse import tokenize
+
+# priority order; floors are the tokens a section is guaranteed when it has that much content
+SECTION_ORDER = ("profile", "rag", "declarations", "memory")
+SECTION_FLOORS = {"profile": 150, "rag": 1200, "declarations": 500, "memory": 600}
+
+DEDUP_CONTAINMENT = 0.8  # share of a chunk's shingles already present in a kept chunk
+MIN_PARTIAL_TOKENS = 60  # don't append a clipped chunk shorter than this
+
+_WORD = re.compile(r"\w+")
+
+
+def _shingles(text: str, n: int = 3) -> set:
+    words = _WORD.findall(text.lower())
+    return {" ".join(words[i:i + n]) for i in range(max(1, len(words) - n + 1))}
+
+
+def dedupe_chunks(chunks: list[str]) -> tuple[list[str], int]:
+    """Drop chunks mostly contained in an earlier one; returns (kept, dropped count)."""
+    kept, kept_sh, dropped = [], [], 0
+    for c in chunks:
+        sh = _shingles(c)
+        if sh and any(len(sh & k) / len(sh) >= DEDUP_CONTAINMENT for k in kept_sh):
+            dropped += 1
+            continue
+        kept.append(c)
+        kept_sh.append(sh)
+    return kept, dropped
+
+
+def rank_chunks(chunks: list[str], query: str) -> list[str]:
+    """Retrieval order, nudged by how many of the question's terms each chunk contains."""
+    q = set(tokenize(query))
+    if not q:
+        return list(chunks)
+
+    def score(item):
+        rank, c = item
+        overlap = len(q & set(tokenize(c))) / len(q)
+        return overlap + 1.0 / (rank + 2)
+
+    return [c for _, c in sorted(enumerate(chunks), key=score, reverse=True)]
+
+
+def compact_json(obj) -> str:
+    """JSON without empty values or whitespace."""
+    def strip(o):
+        if isinstance(o, dict):
+            o = {k: strip(v) for k, v in o.items()}
+            return {k: v for k, v in o.items() if v not in ("", None, [], {})}
+        if isinstance(o, list):
+            return [v for v in (strip(x) for x in o) if v not in ("", None, [], {})]
+        return o
+    return json.dumps(strip(obj or {}), separators=(",", ":"))
+
+
+def _fit_items(items: list[str], budget: int) -> tuple[str, int]:
+    """Whole items while they fit, then one clipped item if enough room is left."""
+    out, used = [], 0
+    for item in items:
+        line = f"- {item}"
+        t = count_tokens(line) + 1
+        if used + t <= budget:
+            out.append(line)
+            used += t
+            continue
+        room = budget - used
+        if room >= MIN_PARTIAL_TOKENS:
+            out.append(truncate_tokens(line, room - 1))
+            used = budget
+        break
+    return "\n".join(out), used
+
+
+def pack_sections(sections: dict[str, dict], budget: int) -> tuple[dict[str, str], dict]:
+    """
+    sections: name -> {"items": [...]} (list, packed whole-item-first) or {"text": str,
+    "keep": "head"|"tail"}. Returns (name -> packed text, stats).
+    """
+    need = {}
+    for name, sec in sections.items():
+        if "items" in sec:
+            need[name] = sum(count_tokens(f"- {i}") + 1 for i in sec["items"])
+        else:
+            need[name] = count_tokens(sec.get("text") or "")
+
+    alloc = {name: 0 for name in sections}
+    left = max(0, budget)
+    order = [n for n in SECTION_ORDER if n in sections] + [n for n in sections if n not in SECTION_ORDER]
+    for name in order:
+        give = min(need[name], SECTION_FLOORS.get(name, 0), left)
+        alloc[name] += give
+        left -= give
+    for name in order:
+        give = min(need[name] - alloc[name], left)
+        alloc[name] += give
+        left -= give
+
+    packed, used = {}, {}
+    for name, sec in sections.items():
+        if "items" in sec:
+            packed[name], used[name] = _fit_items(sec["items"], alloc[name])
+        else:
+            packed[name] = truncate_tokens(sec.get("text") or "", alloc[name], keep=sec.get("keep", "head"))
+            used[name] = count_tokens(packed[name])
+    return packed, {"budget": budget, "need": need, "used": used}
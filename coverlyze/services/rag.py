@@ -1,45 +1,108 @@
 from __future__ import annotations
+import hashlib
 import json
-from datetime import timedelta
+import logging
+import math
+import threading
+from collections import OrderedDict
 from typing import List, Optional
 
 from flask import current_app
 
+from ..utils import metrics
+from ..utils.cache import TieredCache
+from ..utils.deadline import remaining
 
-def search(query_text: str, *, state: Optional[str], top_k: int, line: str | None,
-           topic: str | None, coverages_any: list[str] | None, section: str | None,
-           allow_fallbacks: bool, strict_state: bool) -> list[dict]:
-    """
-    Thin wrapper around Qdrant search; implement your own payload schema.
-    For now, we assume qdrant payload has fields: text, state, source, chunk_index, line, coverages, section
-    """
-    qc = current_app.config["QDRANT_CLIENT"]
-    coll = current_app.config.get("QDRANT_COLLECTION", "state_guidelines")
+logger = logging.getLogger(__name__)
+
+_cache: TieredCache | None = None
+_local_index = None
+
+
+def rag_cache() -> TieredCache:
+    """Retrieved chunks keyed by a digest of (filters, query text, k); shared across workers via Redis."""
+    global _cache
+    if _cache is None:
+        cfg = current_app.config
+        _cache = TieredCache("rag", max_items=cfg.get("RAG_CACHE_MAX_ITEMS", 512),
+                             ttl_s=cfg.get("RAG_CACHE_TTL_S", 24 * 3600))
+    return _cache
+
+
+def local_index():
+    """The memory-mapped snapshot reader when RAG_BACKEND=local, else None."""
+    global _local_index
+    cfg = current_app.config
+    if cfg.get("RAG_BACKEND", "qdrant") != "local":
+        return None
+    if _local_index is None:
+        from .local_index import LocalIndex
+        _local_index = LocalIndex(cfg.get("RAG_LOCAL_INDEX_DIR", "var/rag_index"),
+                                  check_interval_s=cfg.get("RAG_LOCAL_INDEX_CHECK_S", 10))
+    return _local_index
 
-    # Basic vector search via text-embedding-3-large
-    from .embeddings import embed_texts
-    vec = embed_texts([query_text])[0]
-
-    # Optional payload filter
-    flt = None
-    if strict_state and state:
-        from qdrant_client.models import Filter, FieldCondition, MatchValue
-        flt = Filter(must=[FieldCondition(key="state", match=MatchValue(value=state))])
-
-    hits = qc.search(
-        collection_name=coll,
-        query_vector=vec,
-        query_filter=flt,
-        with_payload=True,
-        limit=top_k,
-    )
 
+def build_filter(*, state: str | None, line: str | None, coverages_any: list[str] | None,
+                 section: str | None):
+    """Qdrant filter for every declared payload constraint (None when unconstrained)."""
+    from qdrant_client.models import FieldCondition, Filter, MatchAny, MatchValue
+    must = []
+    if state:
+        must.append(FieldCondition(key="state", match=MatchValue(value=state)))
+    if line:
+        must.append(FieldCondition(key="line", match=MatchValue(value=line)))
+    if coverages_any:
+        must.append(FieldCondition(key="coverages", match=MatchAny(any=list(coverages_any))))
+    if section:
+        must.append(FieldCondition(key="section", match=MatchValue(value=section)))
+    return Filter(must=must) if must else None
+
+
+def _search_requests(qc, coll: str, query_text: str, vec, flt, top_k: int, mode: str, state: str | None) -> list:
+    """One dense SearchRequest, plus a bm25 one in hybrid mode when corpus stats exist."""
+    from qdrant_client.models import NamedSparseVector, SearchRequest, SparseVector
+    if mode == "hybrid":
+        from . import sparse
+        stats = sparse.load_stats(qc, coll, state) or sparse.load_stats(qc, coll, None)
+        if stats:
+            indices, values = sparse.query_vector(query_text, stats)
+            prefetch = top_k * int(current_app.config.get("RAG_HYBRID_PREFETCH", 4))
+            return [
+                SearchRequest(vector=vec, filter=flt, limit=prefetch, with_payload=True),
+                SearchRequest(vector=NamedSparseVector(name=sparse.SPARSE_VECTOR_NAME,
+                                                       vector=SparseVector(indices=indices, values=values)),
+                              filter=flt, limit=prefetch, with_payload=True),
+            ]
+        logger.debug("no bm25 stats for %s; dense-only search", coll)
+    return [SearchRequest(vector=vec, filter=flt, limit=top_k, with_payload=True)]
+
+
+def _combine(responses: list[list], top_k: int) -> list[tuple]:
+    if len(responses) > 1:
+        from .sparse import rrf_fuse
+        return rrf_fuse(responses, limit=top_k)
+    return [(h, float(h.score) if hasattr(h, "score") else 0.0) for h in responses[0][:top_k]]
+
+
+def _search_timeout(deadline: float | None) -> dict:
+    """Qdrant's server-side timeout (whole seconds) for the time left, as search_batch kwargs."""
+    left = remaining(deadline)
+    return {} if left is None else {"timeout": max(1, math.ceil(left))}
+
+
+def _qdrant_search(qc, coll: str, query_text: str, vec, flt, top_k: int, mode: str, state: str | None,
+                   deadline: float | None = None):
+    requests = _search_requests(qc, coll, query_text, vec, flt, top_k, mode, state)
+    return _combine(qc.search_batch(collection_name=coll, requests=requests, **_search_timeout(deadline)), top_k)
+
+
+def _to_results(scored: list[tuple]) -> list[dict]:
     results = []
-    for h in hits:
+    for h, score in scored:
         payload = h.payload or {}
         results.append({
             "text": payload.get("text", ""),
-            "score": float(h.score) if hasattr(h, "score") else 0.0,
+            "score": score,
             "metadata": {
                 "state": payload.get("state"),
                 "source": payload.get("source"),
@@ -52,36 +115,132 @@ def search(query_text: str, *, state: Optional[str], top_k: int, line: str | Non
     return results
 
 
-def rag_retrieve(*, state: str | None, topic: str = "general", k: int = 5, line: str | None = None,
-                 coverage: str | None = None, coverages_any: list[str] | None = None,
-                 section: str | None = None, user_query: str | None = None) -> list[str]:
-    user_profile = {}  # not needed here, kept for API parity
-    state_norm = state.upper() if state else None
+def search(query_text: str, *, state: Optional[str], top_k: int, line: str | None,
+           topic: str | None, coverages_any: list[str] | None, section: str | None,
+           allow_fallbacks: bool, strict_state: bool, query_vector: list[float] | None = None,
+           mode: str | None = None, deadline: float | None = None) -> list[dict]:
+    """
+    Qdrant search over payloads with fields: text, state, source, chunk_index, line, coverages, section.
+    state (when strict_state), line, coverages_any and section are all pushed down as
+    filters. mode "hybrid" fuses dense and bm25 sparse results with reciprocal-rank
+    fusion (RAG_RETRIEVAL_MODE picks the default). With allow_fallbacks, an empty result
+    is retried with section, then coverages, then line dropped; state is never relaxed.
+    RAG_BACKEND=local serves dense search from the local snapshot when it covers the
+    state, and falls back to Qdrant otherwise. With a deadline, the embedding and search
+    timeouts are cut to the time left and no further fallback is tried once it has passed.
+    """
+    qc = current_app.config.get("QDRANT_CLIENT")
+    coll = current_app.config.get("QDRANT_COLLECTION", "state_guidelines")
+    mode = mode or current_app.config.get("RAG_RETRIEVAL_MODE", "dense")
+
+    # Basic vector search via text-embedding-3-large
+    from .embeddings import embed_texts
+    vec = query_vector if query_vector is not None else embed_texts([query_text], deadline=deadline)[0]
+
+    constraints = {"line": line, "coverages_any": coverages_any, "section": section}
+    attempts = [dict(constraints)]
+    if allow_fallbacks:
+        for relax in ("section", "coverages_any", "line"):
+            if constraints[relax]:
+                constraints = {**constraints, relax: None}
+                attempts.append(dict(constraints))
+
+    local = local_index()
+    if local is not None and not local.has_state(state if strict_state else None):
+        metrics.inc("rag_local_index_fallbacks_total")
+        local = None
+    backend = "local" if local is not None else "qdrant"
+
+    scored = []
+    with metrics.timer("rag_search_seconds", mode=mode, backend=backend), metrics.stage("rag_search"):
+        for i, attempt in enumerate(attempts):
+            if i and remaining(deadline) == 0:
+                metrics.inc("deadline_degrades_total", stage="rag", action="no_fallback")
+                break
+            if local is not None:
+                scored = local.search(vec, state=state if strict_state else None, top_k=top_k, **attempt)
+            else:
+                flt = build_filter(state=state if strict_state else None, **attempt)
+                scored = _qdrant_search(qc, coll, query_text, vec, flt, top_k, mode, state, deadline)
+            if scored:
+                if i:
+                    metrics.inc("rag_filter_fallbacks_total", relaxed=i)
+                break
+
+    return _to_results(scored)
+
+
+def search_many(queries: list[dict], vectors: list, *, mode: str | None = None,
+                deadline: float | None = None) -> list[list[dict]]:
+    """
+    Several searches in one Qdrant search_batch round trip, results in input order.
+    Each query dict holds search()'s keyword arguments plus query_text. Queries served
+    by the local index, or that come back empty and allow fallbacks, go through search().
+    """
+    cfg = current_app.config
+    mode = mode or cfg.get("RAG_RETRIEVAL_MODE", "dense")
+    if local_index() is not None:
+        return [search(**q, query_vector=vec, mode=mode, deadline=deadline) for q, vec in zip(queries, vectors)]
+
+    qc = cfg.get("QDRANT_CLIENT")
+    coll = cfg.get("QDRANT_COLLECTION", "state_guidelines")
+    requests, spans = [], []
+    for q, vec in zip(queries, vectors):
+        state = q["state"] if q.get("strict_state") else None
+        flt = build_filter(state=state, line=q.get("line"), coverages_any=q.get("coverages_any"),
+                           section=q.get("section"))
+        reqs = _search_requests(qc, coll, q["query_text"], vec, flt, q["top_k"], mode, q.get("state"))
+        spans.append((len(requests), len(reqs)))
+        requests.extend(reqs)
+    with metrics.timer("rag_search_seconds", mode=mode, backend="qdrant_batch"), metrics.stage("rag_search"):
+        responses = qc.search_batch(collection_name=coll, requests=requests,
+                                    **_search_timeout(deadline)) if requests else []
+
+    out = []
+    for q, vec, (start, n) in zip(queries, vectors, spans):
+        scored = _combine(responses[start:start + n], q["top_k"])
+        relaxable = any(q.get(c) for c in ("line", "coverages_any", "section"))
+        if not scored and q.get("allow_fallbacks") and relaxable:
+            out.append(search(**q, query_vector=vec, mode=mode, deadline=deadline))
+        else:
+            out.append(_to_results(scored))
+    return out
+
+
+# seed text per topic when the caller has no user query
+SEED_QUERIES = {
+    "umbrella": "umbrella eligibility and underlying auto/home liability limits",
+    "auto_adjust": "auto liability property damage comp collision UM UIM PIP rules",
+    "general": "state insurance guidelines for auto and home",
+}
+
+
+def rag_query_text(state: str | None, topic: str | None, user_query: str | None = None) -> str:
+    seed = SEED_QUERIES.get((topic or "general"), "state insurance guidelines")
+    q_prefix = f"{state.upper()} " if state else ""
+    return f"{q_prefix}{(user_query or seed)}".strip()
 
-    # seed text
-    base_query_map = {
-        "umbrella": "umbrella eligibility and underlying auto/home liability limits",
-        "auto_adjust": "auto liability property damage comp collision UM UIM PIP rules",
-        "general": "state insurance guidelines for auto and home",
+
+def _prepare(*, state: str | None, topic: str = "general", k: int = 5, line: str | None = None,
+             coverage: str | None = None, coverages_any: list[str] | None = None,
+             section: str | None = None, user_query: str | None = None) -> dict:
+    state_norm = state.upper() if state else None
+    qtext = rag_query_text(state_norm, topic, user_query)
+    # stable digests, so every worker and restart shares cache entries
+    filters = {"state": state_norm, "topic": topic, "line": line, "coverage": coverage,
+               "coverages_any": sorted(coverages_any or []), "section": section, "k": k,
+               "mode": current_app.config.get("RAG_RETRIEVAL_MODE", "dense")}
+    bucket = _digest(filters)
+    covs = list(dict.fromkeys([*(coverages_any or []), *([coverage] if coverage else [])]))
+    return {
+        "qtext": qtext, "bucket": bucket, "key": _digest({"bucket": bucket, "q": qtext}),
+        "search": {"query_text": qtext, "state": state_norm, "top_k": k, "line": line, "topic": topic,
+                   "coverages_any": covs or None, "section": section, "allow_fallbacks": True,
+                   "strict_state": True},
     }
-    seed = base_query_map.get((topic or "general"), "state insurance guidelines")
-    q_prefix = f"{state_norm} " if state_norm else ""
-    qtext = f"{q_prefix}{(user_query or seed)}".strip()
-
-    # cache
-    redis = current_app.config["SESSION_REDIS"]
-    cov_key = ",".join(coverages_any or [])
-    cache_key = f"rag:{state_norm or 'UNK'}:{topic}:{line}:{coverage}:{cov_key}:{hash(qtext)}:{k}"
-    try:
-        cached = redis.get(cache_key)
-        if cached:
-            return json.loads(cached.decode("utf-8") if isinstance(cached, (bytes, bytearray)) else cached)
-    except Exception:
-        pass
 
-    hits = search(qtext, state=state_norm, top_k=k, line=line, topic=topic, coverages_any=coverages_any,
-                  section=section, allow_fallbacks=False, strict_state=True)
 
+def format_chunks(hits: list[dict]) -> list[str]:
     chunks = []
     for h in hits or []:
         meta = h.get("metadata", {}) or {}
@@ -101,10 +260,217 @@ def rag_retrieve(*, state: str | None, topic: str = "general", k: int = 5, line:
             tags.append(meta["section"])
         tag_str = f" ({', '.join(tags)})" if tags else ""
         chunks.append(f"[{src}{tag_str}]\n{txt}")
+    return chunks
+
+
+def rag_retrieve(*, state: str | None, topic: str = "general", k: int = 5, line: str | None = None,
+                 coverage: str | None = None, coverages_any: list[str] | None = None,
+                 section: str | None = None, user_query: str | None = None,
+                 deadline: float | None = None) -> list[str]:
+    return rag_retrieve_many([{
+        "state": state, "topic": topic, "k": k, "line": line, "coverage": coverage,
+        "coverages_any": coverages_any, "section": section, "user_query": user_query,
+    }], deadline=deadline)[0]
+
+
+def rag_retrieve_many(requests: list[dict], tiers: list | None = None,
+                      deadline: float | None = None) -> list[list[str]]:
+    """
+    rag_retrieve for several requests (each a dict of its keyword arguments), results in
+    input order. Exact cache hits come from one MGET; the rest are embedded in a single
+    call, checked against the semantic tier, and searched with one search_batch.
+    If `tiers` is given it is filled with the tier that served each request.
+
+    With a deadline, cached chunks are still served, but the embedding and the search
+    only start with at least RAG_MIN_BUDGET_S left; requests that can't be served in
+    time come back empty (tier "skipped"), as do ones whose call failed after the
+    deadline passed.
+    """
+    with metrics.stage("rag_retrieve"):
+        return _retrieve_many(requests, tiers, deadline)
+
+
+def _retrieve_many(requests: list[dict], tiers: list | None, deadline: float | None) -> list[list[str]]:
+    prepared = [_prepare(**r) for r in requests]
+    cache = rag_cache()
+    out: list = [None] * len(prepared)
+    served = tiers if tiers is not None else []
+    served[:] = ["miss"] * len(prepared)
+    for i, raw in enumerate(cache.get_many([p["key"] for p in prepared])):
+        if raw:
+            metrics.inc("rag_cache_lookups_total", tier="exact")
+            out[i] = json.loads(raw)
+            served[i] = "exact"
+
+    todo = [i for i, chunks in enumerate(out) if chunks is None]
+    if not todo:
+        return out
 
-    if chunks:
+    def skip(indices, action: str):
+        metrics.inc("deadline_degrades_total", len(indices), stage="rag", action=action)
+        for i in indices:
+            out[i], served[i] = [], "skipped"
+        return out
+
+    min_left = float(current_app.config.get("RAG_MIN_BUDGET_S", 1.0))
+    if deadline is not None and remaining(deadline) < min_left:
+        return skip(todo, "skip")
+
+    # semantic tier: a near-identical query under the same filters
+    from .embeddings import embed_texts
+    try:
+        qvecs = embed_texts([prepared[i]["qtext"] for i in todo], deadline=deadline)
+    except Exception:
+        if remaining(deadline) != 0:
+            raise
+        return skip(todo, "timeout")
+    pending = []
+    for i, qvec in zip(todo, qvecs):
+        index = SemanticIndex(prepared[i]["bucket"])
+        near_key = index.lookup(qvec)
+        cached = cache.get(near_key) if near_key else None
+        if cached:
+            metrics.inc("rag_cache_lookups_total", tier="semantic")
+            out[i] = json.loads(cached)
+            served[i] = "semantic"
+            continue
+        metrics.inc("rag_cache_lookups_total", tier="miss")
+        pending.append((i, qvec, index))
+
+    if pending and deadline is not None and remaining(deadline) < min_left:
+        return skip([i for i, _, _ in pending], "skip")
+    if pending:
         try:
-            redis.setex(cache_key, timedelta(minutes=3), json.dumps(chunks))
+            results = search_many([prepared[i]["search"] for i, _, _ in pending], [v for _, v, _ in pending],
+                                  deadline=deadline)
         except Exception:
-            pass
-    return chunks
+            if remaining(deadline) != 0:
+                raise
+            return skip([i for i, _, _ in pending], "timeout")
+        fresh = {}
+        for (i, qvec, index), hits in zip(pending, results):
+            out[i] = format_chunks(hits)
+            if out[i]:
+                fresh[prepared[i]["key"]] = json.dumps(out[i])
+                index.add(qvec, prepared[i]["key"])
+        cache.set_many(fresh)
+    return out
+
+
+def _digest(obj) -> str:
+    return hashlib.sha256(json.dumps(obj, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+_mirror_lock = threading.Lock()
+_mirrors: OrderedDict[str, dict] = OrderedDict()  # Redis key -> {"seq", "dim", "keys", "mat"}
+
+
+class SemanticIndex:
+    """
+    Recent query vectors per filter bucket. Redis holds a capped list of
+    <64-char exact cache key><8-byte sequence number><unit-length float32 vector> plus a
+    counter of entries ever added. Each process mirrors the newest RAG_SEMANTIC_MAX_ENTRIES
+    as a matrix (for the RAG_SEMANTIC_LOCAL_BUCKETS most recently used buckets) and on
+    lookup fetches only the entries added since it last looked, so a miss costs one GET
+    when nothing changed. lookup() returns the exact key of the most similar cached query
+    at or above RAG_SEMANTIC_THRESHOLD.
+    """
+
+    KEY_LEN = 64
+    SEQ_LEN = 8
+
+    def __init__(self, bucket: str):
+        cfg = current_app.config
+        self.key = f"ragsem:v2:{bucket}"
+        self.seq_key = f"{self.key}:seq"
+        self.threshold = float(cfg.get("RAG_SEMANTIC_THRESHOLD", 0.95))
+        self.max_entries = int(cfg.get("RAG_SEMANTIC_MAX_ENTRIES", 256))
+        self.local_buckets = int(cfg.get("RAG_SEMANTIC_LOCAL_BUCKETS", 16))
+        self.ttl_s = int(cfg.get("RAG_CACHE_TTL_S", 24 * 3600))
+        self.redis = cfg.get("SESSION_REDIS")
+
+    @staticmethod
+    def _unit(vec):
+        import numpy as np
+        v = np.asarray(vec, dtype=np.float32)
+        n = float(np.linalg.norm(v))
+        return v / n if n else v
+
+    def _parse(self, raw: list, dim: int) -> list[tuple[int, str, bytes]]:
+        """(seq, exact key, vector bytes) of the well-formed entries, newest first."""
+        head = self.KEY_LEN + self.SEQ_LEN
+        return [(int.from_bytes(r[self.KEY_LEN:head], "big"), r[:self.KEY_LEN].decode("ascii"), r[head:])
+                for r in raw or [] if len(r) == head + 4 * dim]
+
+    def _sync(self, dim: int) -> dict:
+        """This process's mirror of the bucket, brought up to date with Redis."""
+        import numpy as np
+        seq = int(self.redis.get(self.seq_key) or 0)
+        with _mirror_lock:
+            mirror = _mirrors.get(self.key)
+        if mirror is not None and mirror["dim"] == dim and mirror["seq"] == seq:
+            return mirror
+
+        entries, keys, mat = None, [], None
+        if mirror is not None and mirror["dim"] == dim and 0 < seq - mirror["seq"] < self.max_entries:
+            new = [e for e in self._parse(self.redis.lrange(self.key, 0, seq - mirror["seq"] - 1), dim)
+                   if e[0] > mirror["seq"]]
+            # a gap means entries were pushed between the GET and the LRANGE: read it all instead
+            if new and len(new) == max(e[0] for e in new) - mirror["seq"]:
+                entries, keys, mat = new, mirror["keys"], mirror["mat"]
+        if entries is None:
+            entries = self._parse(self.redis.lrange(self.key, 0, self.max_entries - 1), dim)
+        if entries:
+            fresh = np.frombuffer(b"".join(e[2] for e in entries), dtype=np.float32).reshape(len(entries), dim)
+            mat = fresh if mat is None else np.vstack([fresh, mat])
+        keys = ([e[1] for e in entries] + keys)[:self.max_entries]
+        mirror = {"seq": max([seq] + [e[0] for e in entries]), "dim": dim, "keys": keys,
+                  "mat": mat[:self.max_entries] if mat is not None else None}
+        with _mirror_lock:
+            _mirrors[self.key] = mirror
+            _mirrors.move_to_end(self.key)
+            while len(_mirrors) > self.local_buckets:
+                _mirrors.popitem(last=False)
+        return mirror
+
+    def lookup(self, vec) -> str | None:
+        if self.threshold >= 1.0 or self.redis is None:
+            return None
+        import numpy as np
+        q = self._unit(vec)
+        try:
+            mirror = self._sync(len(q))
+        except Exception as e:
+            logger.debug("semantic cache read failed: %s", e)
+            return None
+        if mirror["mat"] is None:
+            return None
+        sims = mirror["mat"] @ q
+        best = int(np.argmax(sims))
+        if sims[best] < self.threshold:
+            return None
+        return mirror["keys"][best]
+
+    def add(self, vec, exact_key: str):
+        if self.threshold >= 1.0 or self.redis is None:
+            return
+        try:
+            seq = int(self.redis.incr(self.seq_key))
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.lpush(self.key, exact_key.encode("ascii") + seq.to_bytes(self.SEQ_LEN, "big")
+                       + self._unit(vec).tobytes())
+            pipe.ltrim(self.key, 0, self.max_entries - 1)
+            pipe.expire(self.key, self.ttl_s)
+            pipe.expire(self.seq_key, self.ttl_s)
+            pipe.execute()
+        except Exception as e:
+            logger.debug("semantic cache write failed: %s", e)
+
+
+def rag_cache_stats() -> dict:
+    """Lookups per tier (exact / semantic / miss) from the metrics counters, with hit ratios."""
+    counts = metrics.snapshot()["counters"].get("rag_cache_lookups_total", {})
+    by_tier = {tier: int(counts.get(f"tier={tier}", 0)) for tier in ("exact", "semantic", "miss")}
+    total = sum(by_tier.values())
+    ratios = {f"{tier}_hit_ratio": round(by_tier[tier] / total, 4) if total else 0.0 for tier in ("exact", "semantic")}
+    return {"lookups": total, **by_tier, **ratios}
@@ -0,0 +1,173 @@
+"""
+BM25 sparse vectors for hybrid retrieval.
+
+Chunks are stored in Qdrant with a named sparse vector ("bm25") next to the dense
+one. Document weights carry BM25's saturated term frequency; query weights carry
+IDF, so Qdrant's sparse dot product is the BM25 score. IDF needs corpus statistics
+(chunk count, average length, document frequencies); ingest computes them per state
+and stores them in a small side collection, one point per state plus "_all".
+"""
+from __future__ import annotations
+
+import json
+import logging
+import math
+import re
+import uuid
+import zlib
+from collections import Counter
+from typing import Iterable
+
+from ..utils.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+SPARSE_VECTOR_NAME = "bm25"
+ALL_STATES = "_all"
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Short tokens matter here ("um", "pd", "4" in "Part 4"), so only drop true filler words.
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have if in into is it its of on or that the their
+this to was were will with which shall may such any all
+""".split())
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:[.\-/][a-z0-9]+)*")
+_stats_cache = LRUCache(max_items=128, ttl_s=300)
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercased word tokens plus adjacent-word bigrams ("part 4", "property damage")."""
+    words = [w for w in _TOKEN.findall((text or "").lower()) if w not in STOPWORDS]
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def token_id(token: str) -> int:
+    return zlib.crc32(token.encode("utf-8"))
+
+
+class StatsAccumulator:
+    """Running chunk count, token total and document frequencies."""
+
+    def __init__(self):
+        self.n = 0
+        self.total = 0
+        self.df: Counter = Counter()
+
+    def add(self, text: str):
+        toks = tokenize(text)
+        self.n += 1
+        self.total += len(toks)
+        self.df.update({token_id(t) for t in toks})
+
+    def stats(self) -> dict:
+        return {"n": self.n, "avgdl": self.total / self.n if self.n else 0.0, "df": dict(self.df)}
+
+
+def corpus_stats(texts: Iterable[str]) -> dict:
+    """{"n", "avgdl", "df": {token_id: chunks containing it}} for a set of chunks."""
+    acc = StatsAccumulator()
+    for text in texts:
+        acc.add(text)
+    return acc.stats()
+
+
+def doc_vector(text: str, avgdl: float) -> tuple[list[int], list[float]]:
+    """Sparse (indices, values) with BM25 term-frequency saturation and length normalization."""
+    toks = tokenize(text)
+    if not toks:
+        return [], []
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * len(toks) / (avgdl or len(toks)))
+    tf = Counter(token_id(t) for t in toks)
+    indices = sorted(tf)
+    return indices, [round(tf[i] * (BM25_K1 + 1) / (tf[i] + norm), 4) for i in indices]
+
+
+def query_vector(text: str, stats: dict | None) -> tuple[list[int], list[float]]:
+    """Sparse (indices, values) weighted by IDF; unit weights when stats are missing."""
+    ids = sorted({token_id(t) for t in tokenize(text)})
+    if not stats or not stats.get("n"):
+        return ids, [1.0] * len(ids)
+    n, df = stats["n"], stats["df"]
+    values = []
+    for i in ids:
+        d = df.get(i, 0)
+        values.append(round(math.log(1 + (n - d + 0.5) / (d + 0.5)), 4))
+    return ids, values
+
+
+def stats_collection(collection: str) -> str:
+    return f"{collection}__bm25_stats"
+
+
+def _stats_point_id(state: str) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"bm25-stats:{state}"))
+
+
+def save_stats(qc, collection: str, by_state: dict[str, dict]):
+    from qdrant_client.models import PointStruct
+    coll = stats_collection(collection)
+    try:
+        qc.get_collection(coll)
+    except Exception:
+        qc.create_collection(collection_name=coll, vectors_config={})
+    points = [PointStruct(id=_stats_point_id(state), vector={},
+                          payload={"state": state, "n": st["n"], "avgdl": st["avgdl"],
+                                   "df": json.dumps({str(k): v for k, v in st["df"].items()})})
+              for state, st in by_state.items()]
+    qc.upsert(collection_name=coll, points=points, wait=True)
+    for state in by_state:
+        _stats_cache.delete(f"{collection}:{state}")
+
+
+def load_stats(qc, collection: str, state: str | None) -> dict | None:
+    """Corpus stats for a state (or all states), cached in-process for a few minutes."""
+    state = state or ALL_STATES
+    key = f"{collection}:{state}"
+    cached = _stats_cache.get(key)
+    if cached is not None:
+        return cached or None
+    stats = {}
+    try:
+        recs = qc.retrieve(collection_name=stats_collection(collection), ids=[_stats_point_id(state)], with_payload=True)
+        if recs:
+            p = recs[0].payload or {}
+            stats = {"n": p.get("n", 0), "avgdl": p.get("avgdl", 0.0),
+                     "df": {int(k): v for k, v in json.loads(p.get("df") or "{}").items()}}
+    except Exception as e:
+        logger.debug("no bm25 stats for %s/%s: %s", collection, state, e)
+    _stats_cache.set(key, stats)
+    return stats or None
+
+
+def rebuild_stats(qc, collection: str) -> dict[str, dict]:
+    """Recompute per-state stats from every chunk's payload text and store them."""
+    accs: dict[str, StatsAccumulator] = {ALL_STATES: StatsAccumulator()}
+    offset = None
+    while True:
+        points, offset = qc.scroll(collection_name=collection, limit=1024, offset=offset,
+                                   with_payload=["text", "state"], with_vectors=False)
+        for p in points:
+            payload = p.payload or {}
+            text = payload.get("text") or ""
+            accs[ALL_STATES].add(text)
+            if payload.get("state"):
+                accs.setdefault(payload["state"], StatsAccumulator()).add(text)
+        if offset is None:
+            break
+    by_state = {state: acc.stats() for state, acc in accs.items()}
+    save_stats(qc, collection, by_state)
+    return by_state
+
+
+def rrf_fuse(result_lists: list[list], limit: int, k: int = 60) -> list:
+    """Reciprocal-rank fusion of ranked Qdrant hit lists (deduplicated by point id)."""
+    scores: dict = {}
+    hits: dict = {}
+    for results in result_lists:
+        for rank, hit in enumerate(results):
+            scores[hit.id] = scores.get(hit.id, 0.0) + 1.0 / (k + rank + 1)
+            hits.setdefault(hit.id, hit)
+    order = sorted(scores, key=scores.get, reverse=True)[:limit]
+    return [(hits[i], scores[i]) for i in order]
@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+import time
+from io import BytesIO
+from typing import Callable, Optional
+
+from ..utils import metrics
+from .dec_parser import extract_dec_page_data
+from .llm import summarize_dec_page
+from .ocr import extract_text_smart_report
+
+
+def run_upload_pipeline(pdf_bytes: bytes, emit: Optional[Callable] = None) -> dict:
+    """
+    extract_text_smart -> extract_dec_page_data -> LLM summary.
+    `emit(stage, **data)` is called as each stage finishes (job events / SSE).
+    """
+    emit = emit or (lambda stage, **data: None)
+
+    t0 = time.monotonic()
+    with metrics.stage("upload_extract"):
+        extracted_text, ocr_report = extract_text_smart_report(BytesIO(pdf_bytes))
+    sizes = {"chars": len(extracted_text or ""), "pages": len(ocr_report),
+             "vision_pages": sum(1 for p in ocr_report if p["backend"] == "vision")}
+    metrics.note(pdf_bytes=len(pdf_bytes), **sizes)
+    emit("extracted", **sizes, elapsed_s=round(time.monotonic() - t0, 3))
+
+    t0 = time.monotonic()
+    with metrics.stage("upload_parse"):
+        extracted_data = extract_dec_page_data(extracted_text)
+    emit("parsed", vehicles=len(extracted_data.get("vehicles", [])),
+         drivers=len(extracted_data.get("drivers", [])), elapsed_s=round(time.monotonic() - t0, 3))
+
+    t0 = time.monotonic()
+    with metrics.stage("upload_summarize"):
+        auto_summary = summarize_dec_page(extracted_text)
+    emit("summarized", elapsed_s=round(time.monotonic() - t0, 3))
+
+    return {"extracted_text": extracted_text, "extracted_data": extracted_data, "auto_summary": auto_summary,
+            "ocr_report": ocr_report}
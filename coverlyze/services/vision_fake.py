@@ -0,0 +1,149 @@
+"""
+Offline stand-ins for the Vision and Cloud Storage clients used by services/ocr.py.
+Enable with VISION_BACKEND=fake (see extensions.google_clients) to run or benchmark
+the OCR transport without GCP. Latencies are simulated with sleeps.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from io import BytesIO
+from types import SimpleNamespace
+
+from google.cloud.vision_v1 import AnnotateFileResponse, AnnotateImageResponse
+
+
+def _page_count(pdf_bytes: bytes) -> int:
+    import pdfplumber
+    with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
+        return len(pdf.pages)
+
+
+def _page_response(page_number: int) -> AnnotateImageResponse:
+    return AnnotateImageResponse(
+        full_text_annotation={"text": f"FAKE OCR page {page_number}\nPolicy text recognized from image."},
+        context={"page_number": page_number},
+    )
+
+
+def _split_gs(uri: str) -> tuple[str, str]:
+    bucket, _, path = uri[len("gs://"):].partition("/")
+    return bucket, path
+
+
+class FakeBlob:
+    def __init__(self, storage: "FakeStorageClient", bucket: str, name: str):
+        self._storage = storage
+        self.bucket_name = bucket
+        self.name = name
+
+    def upload_from_string(self, data, content_type=None):
+        time.sleep(self._storage.upload_latency_s)
+        self._storage._put(self.bucket_name, self.name, data if isinstance(data, bytes) else data.encode("utf-8"))
+
+    def download_as_bytes(self) -> bytes:
+        time.sleep(self._storage.download_latency_s)
+        return self._storage._get(self.bucket_name, self.name)
+
+    def delete(self):
+        time.sleep(self._storage.delete_latency_s)
+        self._storage._delete(self.bucket_name, self.name)
+
+
+class FakeBucket:
+    def __init__(self, storage: "FakeStorageClient", name: str):
+        self._storage = storage
+        self.name = name
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self._storage, self.name, name)
+
+
+class FakeStorageClient:
+    def __init__(self, upload_latency_s: float = 0.05, download_latency_s: float = 0.05,
+                 delete_latency_s: float = 0.02, list_latency_s: float = 0.05):
+        self.upload_latency_s = upload_latency_s
+        self.download_latency_s = download_latency_s
+        self.delete_latency_s = delete_latency_s
+        self.list_latency_s = list_latency_s
+        self._objects: dict[tuple[str, str], bytes] = {}
+        self._lock = threading.Lock()
+
+    def _put(self, bucket, name, data):
+        with self._lock:
+            self._objects[(bucket, name)] = data
+
+    def _get(self, bucket, name) -> bytes:
+        with self._lock:
+            return self._objects[(bucket, name)]
+
+    def _delete(self, bucket, name):
+        with self._lock:
+            self._objects.pop((bucket, name), None)
+
+    def bucket(self, name: str) -> FakeBucket:
+        return FakeBucket(self, name)
+
+    def list_blobs(self, bucket, prefix: str = ""):
+        time.sleep(self.list_latency_s)
+        name = getattr(bucket, "name", bucket)
+        with self._lock:
+            keys = sorted(k for b, k in self._objects if b == name and k.startswith(prefix))
+        return [FakeBlob(self, name, k) for k in keys]
+
+    def object_count(self) -> int:
+        with self._lock:
+            return len(self._objects)
+
+
+class _FakeOperation:
+    def __init__(self, fn, latency_s: float):
+        self._fn = fn
+        self._latency_s = latency_s
+
+    def result(self, timeout=None):
+        time.sleep(self._latency_s)
+        return self._fn()
+
+
+class FakeVisionClient:
+    def __init__(self, storage: FakeStorageClient, request_latency_s: float = 0.3,
+                 per_page_s: float = 0.02, async_overhead_s: float = 1.0):
+        self.storage = storage
+        self.request_latency_s = request_latency_s
+        self.per_page_s = per_page_s
+        self.async_overhead_s = async_overhead_s
+        self.calls: list[tuple[str, int]] = []
+
+    def batch_annotate_files(self, requests, timeout=None):
+        out = []
+        for req in requests:
+            pages = list(req.get("pages") or [1, 2, 3, 4, 5])[:5]
+            self.calls.append(("batch_annotate_files", len(pages)))
+            time.sleep(self.request_latency_s + self.per_page_s * len(pages))
+            out.append(SimpleNamespace(responses=[_page_response(n) for n in pages]))
+        return SimpleNamespace(responses=out)
+
+    def async_batch_annotate_files(self, requests):
+        req = requests[0]
+        src_bucket, src_name = _split_gs(req["input_config"]["gcs_source"]["uri"])
+        dest_bucket, dest_prefix = _split_gs(req["output_config"]["gcs_destination"]["uri"])
+        batch = req["output_config"].get("batch_size", 20)
+        n_pages = _page_count(self.storage._get(src_bucket, src_name))
+        self.calls.append(("async_batch_annotate_files", n_pages))
+
+        def run():
+            for start in range(1, n_pages + 1, batch):
+                end = min(n_pages, start + batch - 1)
+                shard = AnnotateFileResponse(responses=[_page_response(n) for n in range(start, end + 1)])
+                self.storage._put(dest_bucket, f"{dest_prefix}output-{start}-to-{end}.json",
+                                  AnnotateFileResponse.to_json(shard).encode("utf-8"))
+            return SimpleNamespace(responses=[])
+
+        return _FakeOperation(run, self.async_overhead_s + self.per_page_s * n_pages)
+
+
+def fake_google_clients(vision_opts: dict | None = None,
+                        storage_opts: dict | None = None) -> tuple[FakeVisionClient, FakeStorageClient]:
+    storage = FakeStorageClient(**(storage_opts or {}))
+    return FakeVisionClient(storage, **(vision_opts or {})), storage
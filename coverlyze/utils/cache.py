@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+_registry: dict[str, "TieredCache"] = {}
+_registry_lock = threading.Lock()
+
+
+class LRUCache:
+    """Bounded in-process LRU with per-entry TTL. Values are stored as-is."""
+
+    def __init__(self, max_items: int = 256, ttl_s: float | None = None):
+        self.max_items = max(1, int(max_items))
+        self.ttl_s = ttl_s
+        self._data: OrderedDict[str, tuple[float | None, object]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                self.evictions += 1
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, ttl_s: float | None = None):
+        ttl = ttl_s if ttl_s is not None else self.ttl_s
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def _default_redis():
+    from ..extensions import redis_client
+    return redis_client()
+
+
+class TieredCache:
+    """
+    Two-tier cache: in-process LRU in front of Redis.
+    Values are bytes/str; callers handle (de)serialization. Redis errors are
+    swallowed so a cache outage degrades to a miss, never to a failed request.
+    """
+
+    def __init__(self, namespace: str, *, max_items: int = 256, ttl_s: int = 3600,
+                 redis_getter: Optional[Callable] = None, use_redis: bool = True):
+        self.namespace = namespace
+        self.ttl_s = int(ttl_s)
+        self.local = LRUCache(max_items=max_items, ttl_s=ttl_s)
+        self._redis_getter = redis_getter or _default_redis
+        self.use_redis = use_redis
+        self._lock = threading.Lock()
+        self.hits_local = 0
+        self.hits_redis = 0
+        self.misses = 0
+        self.sets = 0
+        with _registry_lock:
+            _registry[namespace] = self
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _redis(self):
+        if not self.use_redis:
+            return None
+        try:
+            return self._redis_getter()
+        except Exception:
+            return None
+
+    def _count(self, attr: str, n: int = 1):
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + n)
+
+    def get(self, key: str):
+        val = self.local.get(key)
+        if val is not None:
+            self._count("hits_local")
+            return val
+        r = self._redis()
+        if r is not None:
+            try:
+                val = r.get(self._key(key))
+            except Exception as e:
+                logger.debug("cache %s redis get failed: %s", self.namespace, e)
+                val = None
+            if val is not None:
+                self.local.set(key, val)
+                self._count("hits_redis")
+                return val
+        self._count("misses")
+        return None
+
+    def get_many(self, keys: list[str]) -> list:
+        """Batch lookup; one Redis MGET for everything the LRU doesn't hold."""
+        out = [self.local.get(k) for k in keys]
+        missing = [i for i, v in enumerate(out) if v is None]
+        self._count("hits_local", len(keys) - len(missing))
+        r = self._redis() if missing else None
+        if r is not None:
+            try:
+                vals = r.mget([self._key(keys[i]) for i in missing])
+            except Exception as e:
+                logger.debug("cache %s redis mget failed: %s", self.namespace, e)
+                vals = [None] * len(missing)
+            still_missing = []
+            for i, v in zip(missing, vals):
+                if v is None:
+                    still_missing.append(i)
+                    continue
+                out[i] = v
+                self.local.set(keys[i], v)
+            self._count("hits_redis", len(missing) - len(still_missing))
+            missing = still_missing
+        self._count("misses", len(missing))
+        return out
+
+    def set(self, key: str, value, ttl_s: int | None = None):
+        if value is None:
+            return
+        ttl = int(ttl_s or self.ttl_s)
+        self.local.set(key, value, ttl_s=ttl)
+        self._count("sets")
+        r = self._redis()
+        if r is not None:
+            try:
+                r.setex(self._key(key), ttl, value)
+            except Exception as e:
+                logger.debug("cache %s redis set failed: %s", self.namespace, e)
+
+    def set_many(self, items: dict, ttl_s: int | None = None):
+        if not items:
+            return
+        ttl = int(ttl_s or self.ttl_s)
+        for k, v in items.items():
+            self.local.set(k, v, ttl_s=ttl)
+        self._count("sets", len(items))
+        r = self._redis()
+        if r is not None:
+            try:
+                pipe = r.pipeline(transaction=False)
+                for k, v in items.items():
+                    pipe.setex(self._key(k), ttl, v)
+                pipe.execute()
+            except Exception as e:
+                logger.debug("cache %s redis pipeline set failed: %s", self.namespace, e)
+
+    def touch(self, keys: list[str], ttl_s: int | None = None):
+        """Extend the Redis TTL of existing entries."""
+        r = self._redis() if keys else None
+        if r is None:
+            return
+        try:
+            pipe = r.pipeline(transaction=False)
+            for k in keys:
+                pipe.expire(self._key(k), int(ttl_s or self.ttl_s))
+            pipe.execute()
+        except Exception as e:
+            logger.debug("cache %s redis touch failed: %s", self.namespace, e)
+
+    def delete(self, key: str):
+        self.local.delete(key)
+        r = self._redis()
+        if r is not None:
+            try:
+                r.delete(self._key(key))
+            except Exception:
+                pass
+
+    def stats(self) -> dict:
+        lookups = self.hits_local + self.hits_redis + self.misses
+        return {
+            "hits_local": self.hits_local,
+            "hits_redis": self.hits_redis,
+            "misses": self.misses,
+            "sets": self.sets,
+            "hit_rate": round((self.hits_local + self.hits_redis) / lookups, 4) if lookups else 0.0,
+            "local_items": len(self.local),
+            "local_evictions": self.local.evictions,
+        }
+
+
+def cache_stats() -> dict:
+    with _registry_lock:
+        caches = dict(_registry)
+    return {name: c.stats() for name, c in caches.items()}
+
+
+def clear_local_caches():
+    with _registry_lock:
+        caches = list(_registry.values())
+    for c in caches:
+        c.local.clear()
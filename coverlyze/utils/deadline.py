@@ -0,0 +1,49 @@
+"""
+Per-request time budget.
+
+A deadline is a time.monotonic() timestamp passed down as `deadline=` (None means no
+budget). Each stage sizes its own timeouts from what is left and degrades instead of
+starting work it can't finish. `budget_stage` records where the time went.
+"""
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+
+from . import metrics
+
+# seconds; a chat turn's budget is at most ~60s (gunicorn's timeout)
+BUDGET_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 45.0, 60.0)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's budget ran out before a stage that can't be skipped."""
+
+
+def make_deadline(budget_s: float, started: float | None = None) -> float:
+    """Deadline budget_s after `started` (a perf_counter() reading), or after now."""
+    spent = time.perf_counter() - started if started is not None else 0.0
+    return time.monotonic() + budget_s - spent
+
+
+def remaining(deadline: float | None) -> float | None:
+    """Seconds left (never negative), or None without a deadline."""
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+def within(seconds: float, deadline: float | None) -> float:
+    """A timeout of `seconds`, shortened to what's left of the deadline."""
+    left = remaining(deadline)
+    return seconds if left is None else min(seconds, left)
+
+
+@contextmanager
+def budget_stage(stage: str, deadline: float | None = None):
+    """Time a stage into request_budget_seconds{stage}; with a deadline, also what's left after it."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe("request_budget_seconds", time.perf_counter() - t0, buckets=BUDGET_BUCKETS, stage=stage)
+        if deadline is not None:
+            metrics.observe("request_budget_left_seconds", remaining(deadline), buckets=BUDGET_BUCKETS, stage=stage)
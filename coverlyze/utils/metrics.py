@@ -0,0 +1,310 @@
+"""
+In-process counters, gauges and histograms.
+
+Recording is a dict update under one lock, so it is cheap enough for the hot path
+(see benchmarks/bench_metrics.py). Each process publishes its state to Redis every
+METRICS_PUSH_S (start_publisher); `collect` sums the processes of this host, so
+/metrics is the same whichever gunicorn worker answers the scrape. Counters and
+histograms of exited processes are kept for METRICS_RETAIN_S so totals don't drop
+when a worker restarts; their gauges are left out as soon as they stop publishing.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+# Seconds; roughly log-spaced from 5 ms to 2 min.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_lock = threading.Lock()
+_counters: dict[tuple, float] = {}
+_histograms: dict[tuple, dict] = {}
+_gauges: dict[tuple, float] = {}
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+
+def inc(name: str, value: float = 1, **labels):
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0) + value
+
+
+def gauge(name: str, value: float, **labels):
+    """Set a current value (in-flight requests, breaker state)."""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def gauge_add(name: str, delta: float, **labels):
+    k = _key(name, labels)
+    with _lock:
+        _gauges[k] = _gauges.get(k, 0) + delta
+
+
+def observe(name: str, value: float, buckets: tuple = DEFAULT_BUCKETS, **labels):
+    k = _key(name, labels)
+    with _lock:
+        h = _histograms.get(k)
+        if h is None:
+            h = _histograms[k] = {"buckets": buckets, "counts": [0] * len(buckets), "count": 0, "sum": 0.0}
+        i = bisect_left(h["buckets"], value)  # first bucket with value <= bound
+        if i < len(h["counts"]):
+            h["counts"][i] += 1
+        h["count"] += 1
+        h["sum"] += value
+
+
+@contextmanager
+def timer(name: str, **labels):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - t0, **labels)
+
+
+@contextmanager
+def stage(name: str, **labels):
+    """Time a pipeline stage into stage_seconds{stage}; failures count in stage_errors_total{stage,error}."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        inc("stage_errors_total", stage=name, error=type(e).__name__, **labels)
+        raise
+    finally:
+        elapsed = time.perf_counter() - t0
+        observe("stage_seconds", elapsed, stage=name, **labels)
+        trace_stage(name, elapsed)
+
+
+# --- per-request trace (slow-request log, utils/profiling.py) ---
+
+TRACE_MAX_STAGES = 200
+_trace: ContextVar[dict | None] = ContextVar("metrics_trace", default=None)
+
+
+def begin_trace() -> dict:
+    """Start collecting this request's (or job's) stage timings and note()d sizes."""
+    t = {"stages": [], "sizes": {}}
+    _trace.set(t)
+    return t
+
+
+def end_trace() -> dict | None:
+    t = _trace.get()
+    _trace.set(None)
+    return t
+
+
+def trace_stage(name: str, seconds: float):
+    """Add a stage to the current trace; a no-op outside one. stage() calls this itself."""
+    t = _trace.get()
+    if t is not None and len(t["stages"]) < TRACE_MAX_STAGES:
+        t["stages"].append((name, round(seconds, 4)))
+
+
+def note(**sizes):
+    """Record input sizes (pages, chars, ...) on the current trace, for the slow-request log."""
+    t = _trace.get()
+    if t is not None:
+        t["sizes"].update(sizes)
+
+
+def _quantile(h: dict, q: float) -> float | None:
+    """Upper bucket bound containing the q-quantile (coarse, like Prometheus histogram_quantile)."""
+    if not h["count"]:
+        return None
+    target, seen = q * h["count"], 0
+    for b, c in zip(h["buckets"], h["counts"]):
+        seen += c
+        if seen >= target:
+            return b
+    return float("inf")
+
+
+def snapshot() -> dict:
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        hists = {k: {**h, "counts": list(h["counts"])} for k, h in _histograms.items()}
+
+    def label_str(labels):
+        return ",".join(f"{k}={v}" for k, v in labels)
+
+    out = {"counters": {}, "gauges": {}, "histograms": {}}
+    for (name, labels), v in sorted(counters.items()):
+        out["counters"].setdefault(name, {})[label_str(labels)] = v
+    for (name, labels), v in sorted(gauges.items()):
+        out["gauges"].setdefault(name, {})[label_str(labels)] = v
+    for (name, labels), h in sorted(hists.items()):
+        out["histograms"].setdefault(name, {})[label_str(labels)] = {
+            "count": h["count"], "sum": round(h["sum"], 4),
+            "avg": round(h["sum"] / h["count"], 4) if h["count"] else None,
+            "p50": _quantile(h, 0.5), "p95": _quantile(h, 0.95), "p99": _quantile(h, 0.99),
+        }
+    return out
+
+
+# --- cross-process aggregation ---
+
+HOST = socket.gethostname()
+_publisher_pid: int | None = None
+
+
+def _reset_after_fork():
+    """A forked worker starts from zero: the parent's values are published by the parent."""
+    global _lock, _publisher_pid
+    _lock = threading.Lock()
+    _counters.clear()
+    _gauges.clear()
+    _histograms.clear()
+    _publisher_pid = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def export_state() -> dict:
+    """This process's raw values, JSON-serializable (labels as [key, value] pairs)."""
+    with _lock:
+        return {
+            "ts": time.time(),
+            "counters": [[n, list(map(list, lb)), v] for (n, lb), v in _counters.items()],
+            "gauges": [[n, list(map(list, lb)), v] for (n, lb), v in _gauges.items()],
+            "histograms": [[n, list(map(list, lb)), list(h["buckets"]), list(h["counts"]), h["count"], h["sum"]]
+                           for (n, lb), h in _histograms.items()],
+        }
+
+
+def merge_states(states: list[dict], live_after: float = 0.0) -> dict:
+    """Sum counters and histograms over processes; gauges only from those that published after live_after."""
+    counters: dict[tuple, float] = {}
+    gauges: dict[tuple, float] = {}
+    hists: dict[tuple, dict] = {}
+    for st in states:
+        for n, lb, v in st["counters"]:
+            k = (n, tuple(map(tuple, lb)))
+            counters[k] = counters.get(k, 0) + v
+        if st["ts"] >= live_after:
+            for n, lb, v in st["gauges"]:
+                k = (n, tuple(map(tuple, lb)))
+                gauges[k] = gauges.get(k, 0) + v
+        for n, lb, buckets, counts, count, total in st["histograms"]:
+            k = (n, tuple(map(tuple, lb)))
+            h = hists.get(k)
+            if h is None:
+                hists[k] = {"buckets": list(buckets), "counts": list(counts), "count": count, "sum": total}
+            elif h["buckets"] == list(buckets):
+                h["counts"] = [a + b for a, b in zip(h["counts"], counts)]
+                h["count"] += count
+                h["sum"] += total
+            else:
+                logger.warning("metrics: bucket mismatch for %s, skipping one process", n)
+    return {"counters": counters, "gauges": gauges, "histograms": hists, "processes": len(states)}
+
+
+def _state_key(namespace: str, pid: int | None = None) -> str:
+    return f"{namespace}:{HOST}:{pid or os.getpid()}"
+
+
+def publish(redis, namespace: str = "metrics", retain_s: int = 3600):
+    """Write this process's state to Redis and register it under the host's process set."""
+    index = f"{namespace}:{HOST}"
+    pipe = redis.pipeline(transaction=False)
+    pipe.setex(_state_key(namespace), retain_s, json.dumps(export_state(), separators=(",", ":")))
+    pipe.sadd(index, _state_key(namespace))
+    pipe.expire(index, retain_s)
+    pipe.execute()
+
+
+def collect(redis, namespace: str = "metrics", push_s: float = 5.0, retain_s: int = 3600) -> dict:
+    """Publish this process, then merge every process of this host that is still retained."""
+    publish(redis, namespace, retain_s)
+    index = f"{namespace}:{HOST}"
+    keys = sorted(k.decode() if isinstance(k, bytes) else k for k in redis.smembers(index))
+    raws = redis.mget(keys) if keys else []
+    gone = [k for k, raw in zip(keys, raws) if raw is None]
+    if gone:
+        redis.srem(index, *gone)
+    states = [json.loads(raw) for raw in raws if raw is not None]
+    return merge_states(states, live_after=time.time() - 3 * push_s)
+
+
+def _publish_loop(get_redis, namespace: str, push_s: float, retain_s: int, pid: int):
+    while _publisher_pid == pid:
+        time.sleep(push_s)
+        try:
+            publish(get_redis(), namespace, retain_s)
+        except Exception as e:
+            logger.debug("metrics publish failed: %s", e)
+
+
+def start_publisher(get_redis, *, namespace: str = "metrics", push_s: float = 5.0, retain_s: int = 3600):
+    """Start this process's publisher thread once (again in a forked child). Cheap to call per request."""
+    global _publisher_pid
+    pid = os.getpid()
+    if _publisher_pid == pid:
+        return
+    with _lock:
+        if _publisher_pid == pid:
+            return
+        _publisher_pid = pid
+    threading.Thread(target=_publish_loop, args=(get_redis, namespace, push_s, retain_s, pid),
+                     name="metrics-publisher", daemon=True).start()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(labels: tuple, le: str | None = None) -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in labels]
+    if le is not None:
+        parts.append(f'le="{le}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+def render_prometheus(state: dict) -> str:
+    """Prometheus text exposition (0.0.4) of a merged state."""
+    lines = []
+
+    def family(series: dict, kind: str):
+        last = None
+        for (name, labels), v in sorted(series.items()):
+            if name != last:
+                lines.append(f"# TYPE {name} {kind}")
+                last = name
+            yield name, labels, v
+
+    for name, labels, v in family(state["counters"], "counter"):
+        lines.append(f"{name}{_labels_text(labels)} {_num(v)}")
+    for name, labels, v in family(state["gauges"], "gauge"):
+        lines.append(f"{name}{_labels_text(labels)} {_num(v)}")
+    for name, labels, h in family(state["histograms"], "histogram"):
+        cumulative = 0
+        for b, c in zip(h["buckets"], h["counts"]):
+            cumulative += c
+            lines.append(f"{name}_bucket{_labels_text(labels, _num(b))} {cumulative}")
+        lines.append(f"{name}_bucket{_labels_text(labels, '+Inf')} {h['count']}")
+        lines.append(f"{name}_sum{_labels_text(labels)} {_num(round(h['sum'], 6))}")
+        lines.append(f"{name}_count{_labels_text(labels)} {h['count']}")
+    lines.append("# TYPE metrics_processes gauge")
+    lines.append(f"metrics_processes {state.get('processes', 1)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,327 @@
+"""
+Opt-in profiling of single requests, and the always-on slow-request log.
+
+A request is profiled when it carries a valid X-Profile header (signed with PROFILE_SECRET,
+minted by `flask profile-token`) or hits a path armed with `flask profile-arm`. Mode "sample"
+(default) reads the request thread's stack every PROFILE_INTERVAL_MS from a helper thread and
+writes collapsed stacks (flamegraph.pl / speedscope / inferno input); "cprofile" runs the
+deterministic profiler and writes .pstats. Files go to PROFILE_DIR with a .json sidecar holding
+the stage timings. An async /upload passes the mode on to its job, so the profile covers the
+worker's extraction, OCR and summary, not the enqueue.
+
+Every request and job collects its stage timings (metrics.stage) and input sizes (metrics.note);
+one slower than SLOW_REQUEST_S (SLOW_JOB_S for jobs) is logged as one JSON line and kept in
+Redis (SLOW_LOG_KEEP) for /debug_slow.
+"""
+from __future__ import annotations
+
+import cProfile
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import current_app, g, request
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_MODES = ("sample", "cprofile")
+ARMED_KEY = "profile:armed"  # hash path -> requests left to profile
+SLOW_LOG_KEY = "slow:requests"
+
+_active = 0
+_active_lock = threading.Lock()
+_armed: tuple[float, dict] = (0.0, {})
+
+
+# --- triggers ---
+
+def sign_token(secret: str, mode: str = "sample", ttl_s: int = 600, now: float | None = None) -> str:
+    """X-Profile header value: '<mode>.<expires>.<hmac>', valid for ttl_s."""
+    expires = int((now or time.time()) + ttl_s)
+    payload = f"{mode}.{expires}"
+    return f"{payload}.{hmac.new(secret.encode(), payload.encode(), hashlib.sha256).hexdigest()}"
+
+
+def verify_token(secret: str, token: str, now: float | None = None) -> str | None:
+    """The token's mode if it is signed with secret and not expired, else None."""
+    if not secret or not token:
+        return None
+    try:
+        mode, expires, sig = token.strip().split(".")
+        expired = int(expires) < (now or time.time())
+    except ValueError:
+        return None
+    expected = hmac.new(secret.encode(), f"{mode}.{expires}".encode(), hashlib.sha256).hexdigest()
+    if expired or mode not in PROFILE_MODES or not hmac.compare_digest(sig, expected):
+        return None
+    return mode
+
+
+def arm(redis, path: str, count: int = 1, ttl_s: int = 3600):
+    """Profile the next `count` requests to path on any process (count 0 disarms)."""
+    if count <= 0:
+        redis.hdel(ARMED_KEY, path)
+        return
+    pipe = redis.pipeline()
+    pipe.hset(ARMED_KEY, path, count)
+    pipe.expire(ARMED_KEY, ttl_s)
+    pipe.execute()
+
+
+def _take_armed(redis, path: str, poll_s: float) -> bool:
+    """True if path is armed; claims one of its remaining profiles. Redis is polled every poll_s."""
+    global _armed
+    fetched_at, armed = _armed
+    if time.monotonic() - fetched_at > poll_s:
+        try:
+            armed = {(k.decode() if isinstance(k, bytes) else k): int(v) for k, v in redis.hgetall(ARMED_KEY).items()}
+        except Exception as e:
+            logger.debug("profile arm poll failed: %s", e)
+        _armed = (time.monotonic(), armed)
+    if path not in armed:
+        return False
+    left = redis.hincrby(ARMED_KEY, path, -1)
+    if left <= 0:
+        redis.hdel(ARMED_KEY, path)
+        armed.pop(path, None)
+    return left >= 0
+
+
+# --- profilers ---
+
+def _frame_name(code) -> str:
+    """'func (package/module.py:line)', the path cut after site-packages or before coverlyze/."""
+    path = code.co_filename
+    if (i := path.rfind("site-packages" + os.sep)) >= 0:
+        path = path[i + len("site-packages") + 1:]
+    elif (i := path.rfind("coverlyze" + os.sep)) >= 0:
+        path = path[i:]
+    else:
+        path = os.path.basename(path)
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack every interval_s from a helper thread; counts collapsed stacks."""
+
+    def __init__(self, thread_id: int, interval_s: float = 0.005):
+        self.thread_id = thread_id
+        self.interval_s = interval_s
+        self.stacks: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self) -> "SamplingProfiler":
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: str) -> int:
+        with open(path, "w") as f:
+            for stack, n in self.stacks.most_common():
+                f.write(f"{stack} {n}\n")
+        return sum(self.stacks.values())
+
+
+def _gevent_patched() -> bool:
+    """True under gevent workers: requests run on greenlets, which sys._current_frames() can't see."""
+    monkey = sys.modules.get("gevent.monkey")
+    return monkey is not None and monkey.is_module_patched("threading")
+
+
+class _Run:
+    """One traced request or job: its trace, and its profiler when profiled."""
+
+    def __init__(self, label: str, slow_s: float, mode: str | None):
+        if mode == "sample" and _gevent_patched():
+            logger.info("profile of %s: sample mode can't see greenlets, using cprofile", label)
+            mode = "cprofile"
+        self.label = label
+        self.slow_s = slow_s
+        self.mode = mode
+        self.profile_id = None
+        self.status = None
+        self.t0 = time.perf_counter()
+        self.trace = metrics.begin_trace()
+        self._profiler = None
+        if mode:
+            self._start_profile(mode)
+
+    def _start_profile(self, mode: str):
+        global _active
+        cfg = current_app.config
+        with _active_lock:
+            if _active >= cfg.get("PROFILE_MAX_ACTIVE", 2):
+                metrics.inc("profiles_total", mode=mode, result="busy")
+                logger.warning("profile of %s skipped: PROFILE_MAX_ACTIVE already running", self.label)
+                return
+            _active += 1
+        if mode == "cprofile":
+            self._profiler = cProfile.Profile()
+            try:
+                self._profiler.enable()
+            except ValueError as e:  # another profiler active in this process (3.12+)
+                self._profiler = None
+                with _active_lock:
+                    _active -= 1
+                metrics.inc("profiles_total", mode=mode, result="busy")
+                logger.warning("profile of %s skipped: %s", self.label, e)
+                return
+        else:
+            interval_s = cfg.get("PROFILE_INTERVAL_MS", 5) / 1000
+            self._profiler = SamplingProfiler(threading.get_ident(), interval_s).start()
+        self.profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+    def _write_profile(self, record: dict):
+        global _active
+        try:
+            if isinstance(self._profiler, cProfile.Profile):
+                self._profiler.disable()
+            else:
+                self._profiler.stop()
+            out_dir = current_app.config.get("PROFILE_DIR", "var/profiles")
+            os.makedirs(out_dir, exist_ok=True)
+            base = os.path.join(out_dir, f"{self.profile_id}-{_slug(self.label)}")
+            if isinstance(self._profiler, cProfile.Profile):
+                self._profiler.dump_stats(base + ".pstats")
+            else:
+                record["samples"] = self._profiler.write(base + ".collapsed")
+                record["interval_ms"] = self._profiler.interval_s * 1000
+            with open(base + ".json", "w") as f:
+                json.dump(record, f, indent=1)
+            metrics.inc("profiles_total", mode=self.mode, result="ok")
+            logger.info("profile of %s written to %s.*", self.label, base)
+        except Exception as e:
+            metrics.inc("profiles_total", mode=self.mode, result="error")
+            logger.warning("profile of %s failed: %s", self.label, e)
+        finally:
+            with _active_lock:
+                _active -= 1
+
+    def finish(self, error: BaseException | None = None) -> dict:
+        elapsed = time.perf_counter() - self.t0
+        metrics.end_trace()
+        record = {"label": self.label, "elapsed_s": round(elapsed, 3), "status": self.status,
+                  "error": type(error).__name__ if error else None, "sizes": self.trace["sizes"],
+                  "stages": self.trace["stages"], "profile_id": self.profile_id, "pid": os.getpid(),
+                  "ts": round(time.time(), 3)}
+        if self._profiler is not None:
+            self._write_profile({**record, "mode": self.mode})
+        if elapsed >= self.slow_s:
+            _log_slow(record)
+        return record
+
+
+def _slug(label: str) -> str:
+    return "".join(c if c.isalnum() else "_" for c in label).strip("_")[:60]
+
+
+def _log_slow(record: dict):
+    metrics.inc("slow_requests_total", label=record["label"])
+    line = json.dumps(record, separators=(",", ":"))
+    logger.warning("slow request: %s", line)
+    try:
+        redis = current_app.config["SESSION_REDIS"]
+        pipe = redis.pipeline(transaction=False)
+        pipe.lpush(SLOW_LOG_KEY, line)
+        pipe.ltrim(SLOW_LOG_KEY, 0, current_app.config.get("SLOW_LOG_KEEP", 200) - 1)
+        pipe.execute()
+    except Exception as e:
+        logger.debug("slow log store failed: %s", e)
+
+
+def recent_slow(redis, limit: int = 50) -> list[dict]:
+    """Newest first, across every process sharing this Redis."""
+    return [json.loads(raw) for raw in redis.lrange(SLOW_LOG_KEY, 0, limit - 1)]
+
+
+@contextmanager
+def traced(label: str, mode: str | None = None, slow_s: float | None = None):
+    """Trace (and with mode, profile) a unit of work outside a request, e.g. a background job."""
+    run = _Run(label, current_app.config.get("SLOW_JOB_S", 30) if slow_s is None else slow_s,
+               mode if mode in PROFILE_MODES else None)
+    try:
+        yield run
+    except BaseException as e:
+        run.status = "error"
+        run.finish(e)
+        raise
+    run.status = "ok"
+    run.finish()
+
+
+# --- Flask hooks ---
+
+def _requested_mode(cfg) -> str | None:
+    token = request.headers.get(PROFILE_HEADER)
+    if token:
+        mode = verify_token(cfg.get("PROFILE_SECRET", ""), token)
+        if mode is None:
+            metrics.inc("profiles_total", mode="header", result="bad_token")
+        return mode
+    try:
+        if _take_armed(cfg["SESSION_REDIS"], request.path, cfg.get("PROFILE_POLL_S", 5)):
+            return cfg.get("PROFILE_MODE", "sample")
+    except Exception as e:
+        logger.debug("profile arm check failed: %s", e)
+    return None
+
+
+def current_profile_mode() -> str | None:
+    """The mode this request is profiled with, for passing on to the job it enqueues."""
+    run = g.get("_profiling_run")
+    return run.mode if run is not None and run.profile_id else None
+
+
+def _before_request():
+    cfg = current_app.config
+    if request.endpoint in cfg.get("SLOW_REQUEST_IGNORE", ()):
+        return
+    rule = request.url_rule.rule if request.url_rule else request.path
+    g._profiling_run = _Run(f"{request.method} {rule}", cfg.get("SLOW_REQUEST_S", 10), _requested_mode(cfg))
+
+
+def _after_request(response):
+    run = g.get("_profiling_run")
+    if run is not None:
+        run.status = response.status_code
+        if run.profile_id:
+            response.headers["X-Profile-Id"] = run.profile_id
+    return response
+
+
+def _teardown_request(error=None):
+    # after a streamed body (stream_with_context) has been sent, so /chat/stream is timed in full
+    run = g.pop("_profiling_run", None)
+    if run is not None:
+        run.finish(error)
+
+
+def init_profiling(app):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
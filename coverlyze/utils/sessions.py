@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import pickle
+import time
+import zlib
+
+from flask import Response, current_app, session
+from flask_session.sessions import RedisSession, RedisSessionInterface
+
+from . import metrics
+from .cache import TieredCache
+
+# Large per-upload values kept out of the session blob; the session holds their digests.
+DOC_KEYS = ("extracted_text", "extracted_data", "dec_summary")
+
+# Bytes; session blobs and documents.
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+_COMPRESSED = b"Z"  # pickle output starts with b"\x80", so the marker is unambiguous
+
+
+def save_session_now():
+    """
+    Persist the session from inside a streamed response body. Flask saves the session
+    once, before the first byte is sent, so changes made while streaming would be lost.
+    """
+    app = current_app._get_current_object()
+    app.session_interface.save_session(app, session._get_current_object(), Response())
+
+
+class DocStore:
+    """
+    Content-addressed documents in Redis ("doc:<sha256>"), zlib-compressed JSON.
+    Identical uploads share one entry; sessions extend its TTL while they live.
+    """
+
+    def __init__(self, ttl_s: int, max_items: int = 64):
+        self.cache = TieredCache("doc", max_items=max_items, ttl_s=ttl_s)
+
+    def put(self, value) -> str:
+        raw = json.dumps(value, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha256(raw).hexdigest()
+        if self.cache.local.get(digest) is None:
+            blob = zlib.compress(raw, 6)
+            self.cache.set(digest, blob)
+            metrics.observe("docstore_doc_bytes", len(blob), buckets=SIZE_BUCKETS)
+        return digest
+
+    def get(self, digest: str):
+        blob = self.cache.get(digest)
+        return json.loads(zlib.decompress(blob)) if blob else None
+
+    def touch(self, digests: list[str]):
+        self.cache.touch(digests)
+
+
+class DocSession(RedisSession):
+    """
+    RedisSession whose DOC_KEYS live in the DocStore: assigning one stores the value and
+    records its digest under "docs"; reading one loads it (once per request).
+    """
+
+    store: DocStore | None = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._doc_values: dict = {}
+
+    def __setitem__(self, key, value):
+        if key in DOC_KEYS and self.store is not None:
+            self._doc_values[key] = value
+            super().__setitem__("docs", {**dict.get(self, "docs", {}), key: self.store.put(value)})
+            if dict.__contains__(self, key):
+                super().__delitem__(key)
+            return
+        super().__setitem__(key, value)
+
+    def __getitem__(self, key):
+        if key in DOC_KEYS and not dict.__contains__(self, key):
+            digest = dict.get(self, "docs", {}).get(key)
+            if digest is None:
+                raise KeyError(key)
+            if key not in self._doc_values:
+                self._doc_values[key] = self.store.get(digest) if self.store is not None else None
+            return self._doc_values[key]
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        return default if value is None and key in DOC_KEYS else value
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or (key in DOC_KEYS and key in dict.get(self, "docs", {}))
+
+    def clear(self):
+        self._doc_values.clear()
+        super().clear()
+
+
+class CompactRedisSessionInterface(RedisSessionInterface):
+    """
+    Flask-Session's Redis interface with three changes: DOC_KEYS go to the DocStore,
+    blobs over compress_min_bytes are zlib-compressed, and a session whose serialized
+    form is unchanged since it was opened is not rewritten (only its TTL is extended).
+    """
+
+    session_class = DocSession
+
+    def __init__(self, redis, key_prefix, use_signer=False, permanent=True, *, store: DocStore,
+                 compress_min_bytes: int = 1024):
+        super().__init__(redis, key_prefix, use_signer, permanent)
+        self.store = store
+        self.compress_min_bytes = compress_min_bytes
+        self.serializer = self
+
+    # serializer protocol used by RedisSessionInterface.open_session
+    def loads(self, raw: bytes):
+        if raw[:1] == _COMPRESSED:
+            raw = zlib.decompress(raw[1:])
+        return pickle.loads(raw)
+
+    def dumps(self, data: dict) -> bytes:
+        raw = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(raw) >= self.compress_min_bytes:
+            raw = _COMPRESSED + zlib.compress(raw, 6)
+        return raw
+
+    def open_session(self, app, request):
+        with metrics.stage("session_load"):
+            s = super().open_session(app, request)
+        if s is not None:
+            s.store = self.store
+            s.fingerprint = hashlib.sha1(self.dumps(dict(s))).digest() if s else None
+        return s
+
+    def save_session(self, app, session, response):
+        with metrics.stage("session_save"):
+            self._save(app, session, response)
+
+    def _save(self, app, session, response):
+        if not session:
+            if session.modified:
+                metrics.inc("session_writes_total", result="deleted")
+            return super().save_session(app, session, response)
+
+        t0 = time.perf_counter()
+        val = self.dumps(dict(session))
+        metrics.observe("session_serialize_seconds", time.perf_counter() - t0)
+        metrics.observe("session_bytes", len(val), buckets=SIZE_BUCKETS)
+
+        ttl = int(app.permanent_session_lifetime.total_seconds())
+        fingerprint = hashlib.sha1(val).digest()
+        if fingerprint == getattr(session, "fingerprint", None):
+            self.redis.expire(self.key_prefix + session.sid, ttl)
+            metrics.inc("session_writes_total", result="unchanged")
+        else:
+            self.redis.setex(name=self.key_prefix + session.sid, value=val, time=ttl)
+            session.fingerprint = fingerprint
+            metrics.inc("session_writes_total", result="written")
+            metrics.inc("session_bytes_written_total", len(val))
+        self.store.touch(list((session.get("docs") or {}).values()))
+
+        session_id = self._get_signer(app).sign(session.sid.encode()) if self.use_signer else session.sid
+        kwargs = {"samesite": self.get_cookie_samesite(app)} if self.has_same_site_capability else {}
+        response.set_cookie(app.config["SESSION_COOKIE_NAME"], session_id,
+                            expires=self.get_expiration_time(app, session), httponly=self.get_cookie_httponly(app),
+                            domain=self.get_cookie_domain(app), path=self.get_cookie_path(app),
+                            secure=self.get_cookie_secure(app), **kwargs)
+
+
+def init_sessions(app):
+    """Install CompactRedisSessionInterface using the SESSION_* settings already in app.config."""
+    cfg = app.config
+    ttl = int(cfg["PERMANENT_SESSION_LIFETIME"].total_seconds())
+    app.session_interface = CompactRedisSessionInterface(
+        cfg["SESSION_REDIS"], cfg["SESSION_KEY_PREFIX"], cfg["SESSION_USE_SIGNER"], cfg["SESSION_PERMANENT"],
+        store=DocStore(ttl_s=ttl, max_items=cfg.get("DOCSTORE_CACHE_MAX_ITEMS", 64)),
+        compress_min_bytes=cfg.get("SESSION_COMPRESS_MIN_BYTES", 1024),
+    )
+
+
+def session_stats() -> dict:
+    """Session write outcomes, bytes written, blob size and serialization time."""
+    snap = metrics.snapshot()
+    writes = {k.split("=", 1)[1]: int(v) for k, v in snap["counters"].get("session_writes_total", {}).items()}
+    hists = snap["histograms"]
+    return {
+        "writes": writes,
+        "bytes_written": int(sum(snap["counters"].get("session_bytes_written_total", {}).values())),
+        "session_bytes": hists.get("session_bytes", {}).get(""),
+        "serialize_seconds": hists.get("session_serialize_seconds", {}).get(""),
+    }
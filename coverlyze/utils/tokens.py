@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+import math
+
+try:  # optional: exact counts for OpenAI models
+    import tiktoken
+    _enc = tiktoken.get_encoding("o200k_base")
+except Exception:  # not installed, or the encoding can't be loaded offline
+    _enc = None
+
+# English prose averages ~4 characters per token for OpenAI BPE vocabularies.
+CHARS_PER_TOKEN = 4
+
+
+def count_tokens(text: str) -> int:
+    """Token count with tiktoken when available, else a character-based estimate."""
+    if not text:
+        return 0
+    if _enc is not None:
+        return len(_enc.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_tokens(text: str, max_tokens: int, *, keep: str = "head") -> str:
+    """Cut text to at most max_tokens, keeping the head (default) or the tail."""
+    if max_tokens <= 0 or not text:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if _enc is not None:
+        ids = _enc.encode(text, disallowed_special=())
+        ids = ids[:max_tokens] if keep == "head" else ids[-max_tokens:]
+        return _enc.decode(ids)
+    n = max_tokens * CHARS_PER_TOKEN
+    return text[:n] if keep == "head" else text[-n:]
@@ -0,0 +1,46 @@
+"""Background job worker: `python -m coverlyze.worker`."""
+from __future__ import annotations
+
+import logging
+import signal
+import threading
+
+from . import create_app
+from .routes.metrics import start_metrics_publisher
+from .services.jobs import job_queue, process_job
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    app = create_app()
+    start_metrics_publisher(app)  # upload stages count in /metrics of web pods on the same host
+    stopping = threading.Event()
+    # finish the job in hand, then exit
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+
+    with app.app_context():
+        q = job_queue()
+        reaps = hasattr(q, "requeue_orphans")
+        if reaps:
+            q.start_heartbeat(stopping)
+            q.requeue_orphans()  # jobs a killed worker (e.g. the previous deploy) had in hand
+        logger.info("worker started (%s)", type(q).__name__)
+        while not stopping.is_set():
+            job_id = q.dequeue(timeout_s=5)
+            if job_id:
+                try:
+                    process_job(q, job_id)
+                finally:
+                    q.ack(job_id)
+            elif reaps:
+                q.requeue_orphans()
+        if reaps:
+            q.retire()
+    logger.info("worker stopped")
+
+
+if __name__ == "__main__":
+    main()
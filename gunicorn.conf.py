@@ -1,4 +1,28 @@
+import os
+
 bind = "0.0.0.0:8080"
-workers = 2
-threads = 2
-timeout = 60
+timeout = int(os.getenv("WEB_TIMEOUT_S", "60"))  # chat turns budget CHAT_DEADLINE_S inside this
+
+# Import the app once in the master and fork workers from it. Safe because extensions
+# build clients lazily and drop them after fork (no shared sockets or gRPC channels);
+# the Redis client is kept, since redis-py drops its inherited connections itself.
+preload_app = os.getenv("WEB_PRELOAD", "1") not in ("0", "false", "False")
+
+# SERVING_MODE=async runs gevent workers: each one multiplexes many requests on an event
+# loop, so a worker can hold hundreds of concurrent OpenAI/Qdrant/Redis waits.
+if os.getenv("SERVING_MODE", "sync") == "async":
+    from gevent import monkey
+    monkey.patch_all()
+    # Vision/Storage use gRPC, which needs its own hook to cooperate with gevent. Only load it
+    # when uploads are OCR'd inline (UPLOAD_ASYNC=0); otherwise the job worker does the OCR and
+    # web pods never touch gRPC.
+    if os.getenv("UPLOAD_ASYNC", "1") in ("0", "false", "False"):
+        import grpc.experimental.gevent as grpc_gevent
+        grpc_gevent.init_gevent()
+
+    worker_class = "gevent"
+    workers = int(os.getenv("WEB_WORKERS", "2"))
+    worker_connections = int(os.getenv("WORKER_CONNECTIONS", "500"))
+else:
+    workers = int(os.getenv("WEB_WORKERS", "2"))
+    threads = int(os.getenv("WEB_THREADS", "2"))